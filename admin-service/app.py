@@ -7,6 +7,7 @@ from routes.posts import bp_posts
 from routes.transactions import bp_tx
 from routes.config import bp_cfg
 from routes.stats import bp_stats
+import http_middleware
 
 load_dotenv()
 
@@ -26,12 +27,15 @@ def create_app():
     app.register_blueprint(bp_tx)
     app.register_blueprint(bp_cfg)
     app.register_blueprint(bp_stats)
+    http_middleware.init_app(app)
+
+    # gunicorn không chạy khối __main__ nên tạo bảng ngay trong create_app
+    with app.app_context():
+        db.create_all()
     return app
 
 app = create_app()
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
     port = int(os.getenv("PORT", "5003"))
     app.run(host="0.0.0.0", port=port, debug=False)
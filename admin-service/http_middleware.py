@@ -0,0 +1,73 @@
+# http_middleware.py — nén response + ETag/304 cho JSON GET.
+# File gốc ở common/http_middleware.py; mỗi service build Docker context riêng nên giữ một bản chép,
+# cập nhật bằng `python common/sync_shared.py` — đừng sửa trực tiếp bản chép.
+#
+#   import http_middleware
+#   http_middleware.init_app(app)
+#
+# Env:
+#   COMPRESS_MIN_SIZE   chỉ nén body >= N byte (mặc định 1024)
+#   COMPRESS_LEVEL      gzip level 1-9 (mặc định 6); brotli dùng quality tương ứng
+#   HTTP_ETAG           0 = tắt ETag tự sinh cho JSON GET
+import gzip
+import hashlib
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # không có brotli thì chỉ gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+HTTP_ETAG = os.getenv("HTTP_ETAG", "1") != "0"
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "application/xml",
+    "image/svg+xml", "text/html", "text/css", "text/plain", "text/xml", "text/csv", "text/javascript",
+}
+
+
+def _add_etag(resp):
+    """Weak ETag theo nội dung cho JSON GET 200; If-None-Match khớp -> 304 không body."""
+    if (not HTTP_ETAG or request.method not in ("GET", "HEAD") or resp.status_code != 200
+            or resp.mimetype != "application/json" or resp.direct_passthrough or resp.is_streamed
+            or "ETag" in resp.headers):
+        return resp
+    resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest(), weak=True)
+    return resp.make_conditional(request)
+
+
+def _compress(resp):
+    if (resp.status_code < 200 or resp.status_code in (204, 206, 304) or request.method == "HEAD"
+            or resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers
+            or resp.mimetype not in COMPRESSIBLE_TYPES):
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return resp
+    resp.vary.add("Accept-Encoding")
+
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        body, encoding = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11)), "br"
+    elif accept["gzip"]:
+        body, encoding = gzip.compress(data, compresslevel=COMPRESS_LEVEL), "gzip"
+    else:
+        return resp
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    # ETag mạnh phải khác nhau giữa các bản mã hoá; hạ xuống weak để không vi phạm
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+
+def init_app(app):
+    @app.after_request
+    def _http_middleware(resp):
+        return _compress(_add_etag(resp))
+    return app
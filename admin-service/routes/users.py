@@ -16,7 +16,7 @@ def fwd_headers():
 @require_admin
 def list_users():
     try:
-        r = requests.get(f"{AUTH_URL}/auth/admin/users",
+        r = requests.get(f"{AUTH_URL}/auth/admin/users", params=request.args,
                          headers=fwd_headers(), timeout=6)
         return (r.json(), r.status_code) if r.ok else ({"error":"auth_upstream","detail":r.text}, r.status_code)
     except requests.RequestException as e:
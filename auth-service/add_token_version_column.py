@@ -0,0 +1,17 @@
+from flask import Flask
+from models import db
+import os
+from sqlalchemy import text
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///auth.db')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+with app.app_context():
+    try:
+        db.session.execute(text('ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0'))
+        db.session.commit()
+        print('✅ Added token_version column successfully')
+    except Exception as e:
+        print(f'⚠️  Column may already exist or error: {e}')
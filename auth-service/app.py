@@ -3,6 +3,7 @@ from flask import Flask, jsonify
 from models import db
 from routes import bp
 from oauth_client import register_providers
+import http_middleware
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH  = os.path.join(BASE_DIR, "auth.db") 
@@ -19,6 +20,7 @@ app.config.update(
 db.init_app(app)
 register_providers(app)                  
 app.register_blueprint(bp)
+http_middleware.init_app(app)
 
 @app.get("/")
 def root():
@@ -28,7 +30,10 @@ def root():
 def health():
     return jsonify(ok=True), 200
 
+# gunicorn không chạy khối __main__ nên tạo bảng ngay khi import
+with app.app_context():
+    db.create_all()
+
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5001)), debug=True)
\ No newline at end of file
+    # dev server; production chạy bằng gunicorn (xem gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5001)), debug=os.getenv("FLASK_DEBUG") == "1")
\ No newline at end of file
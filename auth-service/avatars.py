@@ -0,0 +1,98 @@
+# auth-service/avatars.py
+"""
+Lưu avatar theo nội dung (sha256) + tạo sẵn thumbnail WebP lúc upload.
+
+<avatar_dir>/<sha>.<ext>      ảnh gốc (đã xoay theo EXIF, bỏ metadata)
+<avatar_dir>/<sha>_s.webp     96px  (thẻ listing, header)
+<avatar_dir>/<sha>_m.webp     256px (trang hồ sơ)
+
+Tên file đổi khi nội dung đổi nên có thể cache vĩnh viễn (immutable).
+"""
+import hashlib
+import io
+import os
+import re
+from pathlib import Path
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+AVATAR_SIZES = {"s": 96, "m": 256}
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", str(40_000_000)))
+WEBP_QUALITY = int(os.getenv("AVATAR_WEBP_QUALITY", "80"))
+
+_FORMAT_EXT = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+HASHED_NAME = re.compile(r"^([0-9a-f]{64})(?:_([sm]))?\.(jpg|png|gif|webp)$")
+
+
+class AvatarError(ValueError):
+    """Ảnh upload không hợp lệ; str(exc) là mã lỗi trả cho client."""
+
+
+def _open(data: bytes) -> Image.Image:
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > AVATAR_MAX_PIXELS:
+            raise AvatarError("image_too_large")
+        img.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise AvatarError("bad_image")
+    if img.format not in _FORMAT_EXT:
+        raise AvatarError("unsupported_type")
+    return img
+
+
+def _atomic_write(path: Path, write):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def store_avatar(data: bytes, avatar_dir: Path) -> str:
+    """Lưu ảnh + các biến thể, trả về tên file gốc (<sha>.<ext>). Upload trùng nội dung không ghi lại."""
+    if not data:
+        raise AvatarError("no_file")
+    if len(data) > AVATAR_MAX_BYTES:
+        raise AvatarError("file_too_large")
+
+    img = _open(data)
+    ext = _FORMAT_EXT[img.format]
+    fmt = img.format
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "P") else "RGB")
+
+    # Ảnh gốc lưu lại không kèm EXIF (GPS, model máy...); hash theo bytes đã chuẩn hoá
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.convert("RGB").save(buf, "JPEG", quality=90, optimize=True)
+    else:
+        img.save(buf, fmt)
+    original = buf.getvalue()
+    sha = hashlib.sha256(original).hexdigest()
+
+    avatar_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{sha}.{ext}"
+    target = avatar_dir / name
+    if not target.exists():
+        _atomic_write(target, lambda f: f.write(original))
+    for size, px in AVATAR_SIZES.items():
+        variant = avatar_dir / f"{sha}_{size}.webp"
+        if variant.exists():
+            continue
+        thumb = ImageOps.fit(img, (px, px), Image.LANCZOS)
+        _atomic_write(variant, lambda f: thumb.save(f, "WEBP", quality=WEBP_QUALITY, method=4))
+    return name
+
+
+def variant_name(name: str, size: str | None) -> str:
+    """Tên file biến thể <sha>_<size>.webp nếu có; tên cũ (username.jpg) giữ nguyên."""
+    m = HASHED_NAME.match(name)
+    if not m or not size or size not in AVATAR_SIZES or m.group(2):
+        return name
+    return f"{m.group(1)}_{size}.webp"
+
+
+def is_hashed(name: str) -> bool:
+    return bool(HASHED_NAME.match(name))
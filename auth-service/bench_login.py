@@ -0,0 +1,76 @@
+"""
+Benchmark: throughput POST /auth/login theo từng mức cost của PASSWORD_HASH_METHOD.
+
+Mỗi method: tạo user với hash tương ứng, bắn N lần login từ C thread đồng thời
+qua test client, in login/s, p50/p95 và số lần bị 429 (pool hash đầy).
+
+Chạy: python bench_login.py [-n 200] [-c 16] [--method scrypt:16384:8:1 ...]
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import passwords
+from app import app
+from models import db, User
+
+DEFAULT_METHODS = [
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:600000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+]
+PASSWORD = "bench-password-123"
+
+
+def _bench(client_factory, username, total, concurrency):
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+        started = time.perf_counter()
+        r = local.client.post("/auth/login", json={"username": username, "password": PASSWORD})
+        return r.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    ok = sorted(lat for code, lat in results if code == 200)
+    busy = sum(1 for code, _ in results if code == 429)
+    p50 = statistics.median(ok) * 1000 if ok else 0
+    p95 = ok[max(0, int(len(ok) * 0.95) - 1)] * 1000 if ok else 0
+    return len(ok) / elapsed, p50, p95, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput vs password hash cost")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--method", action="append", default=[])
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+    print(f"{'method':<24}{'login/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'429':>6}")
+    for i, method in enumerate(args.method or DEFAULT_METHODS):
+        passwords.configure(method=method)
+        username = f"bench{i}"
+        with app.app_context():
+            db.session.add(User(username=username, email=f"{username}@bench.local",
+                                password=passwords.hash_password(PASSWORD),
+                                role="member", approved=True))
+            db.session.commit()
+        rate, p50, p95, busy = _bench(app.test_client, username, args.requests, args.concurrency)
+        print(f"{method:<24}{rate:>10.1f}{p50:>10.1f}{p95:>10.1f}{busy:>6}")
+
+
+if __name__ == "__main__":
+    main()
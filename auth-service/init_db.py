@@ -2,7 +2,7 @@
 import os
 from datetime import datetime
 from sqlalchemy import or_
-from werkzeug.security import generate_password_hash
+from passwords import hash_password
 from app import app
 from models import db, User, UserProfile
 
@@ -39,7 +39,7 @@ def ensure_admin():
         admin = User(
             username=ADMIN_USERNAME,
             email=ADMIN_EMAIL,
-            password=generate_password_hash(ADMIN_PASSWORD),
+            password=hash_password(ADMIN_PASSWORD),
             role="admin",
             approved=True,
             locked=False,
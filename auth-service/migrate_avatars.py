@@ -0,0 +1,39 @@
+"""
+Chuyển avatar cũ (đặt theo username/uuid) sang lưu theo sha256 + tạo thumbnail WebP.
+File cũ được giữ lại để link cũ vẫn chạy; chỉ cập nhật user_profile.avatar_url.
+
+Chạy: python migrate_avatars.py
+"""
+from pathlib import Path
+
+from app import app
+from avatars import AvatarError, is_hashed, store_avatar
+from models import db, UserProfile
+from routes import AVATAR_DIR
+
+
+def main():
+    with app.app_context():
+        avatar_dir = Path(app.static_folder) / AVATAR_DIR
+        done = skipped = 0
+        for prof in UserProfile.query.filter(UserProfile.avatar_url.isnot(None)).all():
+            name = prof.avatar_url
+            if is_hashed(name) or name.startswith(("http://", "https://")):
+                continue
+            src = avatar_dir / name
+            if not src.is_file():
+                print(f"⚠️  user {prof.user_id}: thiếu file {name}")
+                skipped += 1
+                continue
+            try:
+                prof.avatar_url = store_avatar(src.read_bytes(), avatar_dir)
+                done += 1
+            except AvatarError as e:
+                print(f"⚠️  user {prof.user_id}: {name} -> {e}")
+                skipped += 1
+        db.session.commit()
+        print(f"✅ Đã chuyển {done} avatar, bỏ qua {skipped}")
+
+
+if __name__ == "__main__":
+    main()
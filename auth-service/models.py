@@ -42,6 +42,8 @@ class User(db.Model):
     locked = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     phone = db.Column(db.String(20), unique=True)
+    # tăng mỗi khi admin đổi trạng thái -> token cũ (claim "tv") hết hiệu lực
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     profile = db.relationship("UserProfile", uselist=False, back_populates="user", cascade="all, delete-orphan")
 
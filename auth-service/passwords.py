@@ -0,0 +1,81 @@
+# auth-service/passwords.py
+"""
+Hash/verify mật khẩu với tham số lấy từ env, chạy trong pool giới hạn.
+
+- PASSWORD_HASH_METHOD: method của werkzeug, vd "scrypt:32768:8:1" hoặc "pbkdf2:sha256:600000"
+- PASSWORD_SALT_LENGTH: độ dài salt
+- PASSWORD_HASH_WORKERS: số thread hash song song (mặc định = số CPU)
+- PASSWORD_HASH_MAX_PENDING: số yêu cầu hash tối đa đang chạy + chờ; vượt quá -> HashPoolBusy (429)
+- PASSWORD_HASH_QUEUE_TIMEOUT: số giây chờ một chỗ trống trước khi trả HashPoolBusy
+
+Hash cũ khác method/salt hiện tại được băm lại khi user đăng nhập thành công.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashPoolBusy(Exception):
+    """Pool hash đã đầy; route trả 429 + Retry-After."""
+
+
+_cfg = {}
+_pool = None
+_slots = None
+
+
+def configure(method=None, salt_length=None, workers=None, max_pending=None, queue_timeout=None):
+    global _pool, _slots
+    method = method or os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    salt_length = int(salt_length or os.getenv("PASSWORD_SALT_LENGTH", "16"))
+    workers = int(workers or os.getenv("PASSWORD_HASH_WORKERS", "0")) or (os.cpu_count() or 2)
+    max_pending = int(max_pending or os.getenv("PASSWORD_HASH_MAX_PENDING", "0")) or workers * 4
+    if queue_timeout is None:
+        queue_timeout = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "0.5"))
+
+    # "scrypt" -> "scrypt:32768:8:1": lấy dạng đầy đủ mà werkzeug ghi vào hash để so sánh
+    full_method = generate_password_hash("", method=method, salt_length=1).split("$", 1)[0]
+    _cfg.update(method=method, full_method=full_method, salt_length=salt_length,
+                queue_timeout=queue_timeout, workers=workers, max_pending=max_pending)
+
+    old = _pool
+    _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+    _slots = threading.BoundedSemaphore(max_pending)
+    if old:
+        old.shutdown(wait=False)
+
+
+def settings() -> dict:
+    return dict(_cfg)
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=_cfg["queue_timeout"]):
+        raise HashPoolBusy()
+    try:
+        return _pool.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _run(generate_password_hash, password, _cfg["method"], _cfg["salt_length"])
+
+
+def verify_password(pwhash: str, password: str) -> bool:
+    if not pwhash:
+        return False
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash: str) -> bool:
+    try:
+        method, salt, _ = pwhash.split("$", 2)
+    except (AttributeError, ValueError):
+        return True
+    return method != _cfg["full_method"] or len(salt) != _cfg["salt_length"]
+
+
+configure()
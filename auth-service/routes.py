@@ -1,8 +1,10 @@
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 import os
 import re
 import jwt
 import time
+import threading
 from urllib.parse import urlencode, parse_qs
 from oauth_client import oauth
 from flask import send_from_directory, url_for, current_app
@@ -10,14 +12,15 @@ from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, session, render_template, current_app, flash, redirect
 from types import SimpleNamespace
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash 
+from passwords import HashPoolBusy, hash_password, verify_password, needs_rehash
+from avatars import AVATAR_MAX_BYTES, AvatarError, store_avatar, variant_name, is_hashed
 from pathlib import Path
-import uuid
 from models import db, User, UserProfile
 
 WEB_BASE_URL = os.getenv("WEB_BASE_URL", "http://localhost:8000")
 ALLOWED_IMAGE_EXTS = {"png", "jpg", "jpeg", "gif", "webp"}
 AVATAR_DIR = "uploads/avatars"  
+AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 SECRET = os.getenv("JWT_SECRET", "devsecret")  
@@ -44,24 +47,78 @@ def _make_token(u: User) -> str:
         "role": u.role,
         "approved": u.approved,
         "locked": u.locked,
+        "tv": u.token_version or 0,
         "exp": datetime.utcnow() + timedelta(hours=6),
     }
     return jwt.encode(payload, SECRET, algorithm="HS256")
 
-def _require_admin():
+# ---------- Cache trạng thái user (locked/approved/token_version) ----------
+# Mỗi process giữ bản sao ngắn hạn để request có JWT không phải đọc DB;
+# khoá/duyệt user có hiệu lực ở mọi worker sau tối đa USER_STATUS_TTL giây.
+USER_STATUS_TTL = float(os.getenv("USER_STATUS_TTL", "30"))
+USER_STATUS_CACHE_MAX = int(os.getenv("USER_STATUS_CACHE_MAX", "10000"))
+_status_cache: dict[int, tuple[float, SimpleNamespace]] = {}
+_status_lock = threading.Lock()
+
+def _user_status(uid) -> SimpleNamespace | None:
+    try:
+        uid = int(uid)
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic()
+    with _status_lock:
+        hit = _status_cache.get(uid)
+    if hit and hit[0] > now:
+        return hit[1]
+    row = (
+        db.session.query(User.role, User.approved, User.locked, User.token_version)
+        .filter(User.id == uid)
+        .first()
+    )
+    if not row:
+        return None
+    status = SimpleNamespace(
+        id=uid, role=row.role, approved=bool(row.approved),
+        locked=bool(row.locked), token_version=row.token_version or 0,
+    )
+    with _status_lock:
+        if len(_status_cache) >= USER_STATUS_CACHE_MAX:
+            _status_cache.pop(next(iter(_status_cache)))
+        _status_cache[uid] = (now + USER_STATUS_TTL, status)
+    return status
+
+def _forget_user_status(uid: int):
+    with _status_lock:
+        _status_cache.pop(uid, None)
+
+def _verify_user_token():
+    """Decode JWT + kiểm tra trạng thái qua cache. Trả (payload, status, err)."""
     auth = request.headers.get("Authorization", "")
     if not auth.startswith("Bearer "):
-        return None, ({"error": "no_token"}, 401)
+        return None, None, ({"error": "no_token"}, 401)
     token = auth.split(" ", 1)[1]
     try:
         payload = jwt.decode(token, SECRET, algorithms=["HS256"])
     except Exception:
-        return None, ({"error": "invalid_token"}, 401)
-    if payload.get("role") != "admin":
-        return None, ({"error": "forbidden"}, 403)
-    return payload, None
+        return None, None, ({"error": "invalid_token"}, 401)
+    st = _user_status(payload.get("sub"))
+    if st and isinstance(payload.get("tv"), int) and payload["tv"] > st.token_version:
+        # token mới hơn bản cache của worker này (update_status chỉ xoá cache ở worker
+        # xử lý request đó) -> bỏ cache, đọc lại DB rồi mới quyết định
+        _forget_user_status(st.id)
+        st = _user_status(st.id)
+    if not st:
+        return None, None, ({"error": "user_not_found"}, 404)
+    # token_version chỉ tăng: chỉ token cũ hơn DB mới bị thu hồi
+    if isinstance(payload.get("tv"), int) and payload["tv"] < st.token_version:
+        return None, None, ({"error": "token_revoked"}, 401)
+    if st.locked:
+        return None, None, ({"error": "locked"}, 403)
+    if st.role != "admin" and not st.approved:
+        return None, None, ({"error": "not_approved"}, 403)
+    return payload, st, None
 
-def _require_user():
+def _require_admin():
     auth = request.headers.get("Authorization", "")
     if not auth.startswith("Bearer "):
         return None, ({"error": "no_token"}, 401)
@@ -70,16 +127,24 @@ def _require_user():
         payload = jwt.decode(token, SECRET, algorithms=["HS256"])
     except Exception:
         return None, ({"error": "invalid_token"}, 401)
-    u = User.query.get(payload.get("sub"))
+    if payload.get("role") != "admin":
+        return None, ({"error": "forbidden"}, 403)
+    return payload, None
+
+def _require_user():
+    _, st, err = _verify_user_token()
+    if err:
+        return None, err
+    # trạng thái đã kiểm qua cache; chỉ nạp User (kèm profile) vì route cần dữ liệu
+    u = User.query.options(joinedload(User.profile)).filter(User.id == st.id).first()
     if not u:
+        _forget_user_status(st.id)
         return None, ({"error": "user_not_found"}, 404)
-    if u.locked:
-        return None, ({"error": "locked"}, 403)
-    if u.role != "admin" and not u.approved:
-        return None, ({"error": "not_approved"}, 403)
     return u, None
 
 def _save_avatar(file_storage, username: str | None = None):
+    """Lưu avatar theo sha256 nội dung (kèm thumbnail WebP), trả (tên file, lỗi).
+    username giữ lại cho tương thích chữ ký cũ; tên file không còn phụ thuộc vào nó."""
     if not file_storage or not getattr(file_storage, "filename", ""):
         return None, "no_file"
 
@@ -91,27 +156,18 @@ def _save_avatar(file_storage, username: str | None = None):
     if ext not in ALLOWED_IMAGE_EXTS:
         return None, "unsupported_type"
 
-    dest_dir = Path(current_app.static_folder) / AVATAR_DIR
-    dest_dir.mkdir(parents=True, exist_ok=True)
-
-    # If a username is provided, prefer a predictable filename based on it.
-    # Use a secure version and append a short timestamp if the file exists to avoid collisions.
-    if username:
-        safe_user = secure_filename(username) or uuid.uuid4().hex
-        base_name = f"{safe_user}.{ext}"
-        target = dest_dir / base_name
-        if target.exists():
-            # append timestamp to avoid overwriting
-            ts = int(time.time())
-            base_name = f"{safe_user}_{ts}.{ext}"
-            target = dest_dir / base_name
-        file_storage.save(target)
-        return base_name, None
-
-    # Fallback: random UUID filename
-    new_name = f"{uuid.uuid4().hex}.{ext}"
-    file_storage.save(dest_dir / new_name)
-    return new_name, None
+    data = file_storage.read(AVATAR_MAX_BYTES + 1)
+    try:
+        return store_avatar(data, Path(current_app.static_folder) / AVATAR_DIR), None
+    except AvatarError as e:
+        return None, str(e)
+
+@bp.errorhandler(HashPoolBusy)
+def _hash_pool_busy(_):
+    resp = jsonify(error="too_many_requests", hint="password hashing busy, retry shortly")
+    resp.status_code = 429
+    resp.headers["Retry-After"] = "1"
+    return resp
 
 @bp.get("/")
 def health():
@@ -143,7 +199,7 @@ def register():
     u = User(
         username=username,
         email=email,
-        password=generate_password_hash(password),
+        password=hash_password(password),
         role="member",
         approved=False, 
         locked=False,
@@ -213,7 +269,7 @@ def login():
     else:
         u = User.query.filter_by(username=identifier).first()
 
-    if not u or not check_password_hash(u.password, password):
+    if not u or not verify_password(u.password, password):
         if request.is_json:
             return {"error": "invalid_credentials"}, 401
         flash("Tên đăng nhập hoặc mật khẩu không đúng!", "error")
@@ -231,6 +287,14 @@ def login():
         flash("Tài khoản chưa được admin duyệt!", "error")
         return redirect(url_for("auth.login"))
 
+    # Tham số hash đã đổi (PASSWORD_HASH_METHOD/SALT_LENGTH) -> băm lại bằng mật khẩu vừa nhập
+    if needs_rehash(u.password):
+        try:
+            u.password = hash_password(password)
+            db.session.commit()
+        except HashPoolBusy:
+            pass  # lần đăng nhập sau sẽ thử lại
+
     token = _make_token(u)
 
     if request.is_json:
@@ -254,43 +318,110 @@ def login_page():
 
 @bp.get("/me")
 def me():
-    auth = request.headers.get("Authorization", "")
-    if not auth.startswith("Bearer "):
-        return {"error": "no_token"}, 401
-    try:
-        payload = jwt.decode(auth.split(" ", 1)[1], SECRET, algorithms=["HS256"])
-    except Exception:
-        return {"error": "invalid_token"}, 401
+    # hot path (gateway, reviews-service): không đọc DB khi cache trạng thái còn hạn
+    payload, _, err = _verify_user_token()
+    if err:
+        return err
     return payload
 
+ADMIN_USERS_PER_PAGE = 50
+ADMIN_USERS_MAX_PER_PAGE = 200
+# field name -> cột SQL; fields= chỉ SELECT đúng các cột được yêu cầu
+_ADMIN_USER_FIELDS = {
+    "id": User.id,
+    "username": User.username,
+    "email": User.email,
+    "phone": User.phone,
+    "role": User.role,
+    "approved": User.approved,
+    "locked": User.locked,
+    "created_at": User.created_at,
+    "full_name": UserProfile.full_name,
+    "avatar_url": UserProfile.avatar_url,
+}
+
+def _bool_arg(name: str):
+    v = (request.args.get(name) or "").strip().lower()
+    if v in ("1", "true", "yes"):
+        return True
+    if v in ("0", "false", "no"):
+        return False
+    return None
+
+def _int_arg(name: str, default: int | None = None) -> int | None:
+    try:
+        return int(request.args.get(name))
+    except (TypeError, ValueError):
+        return default
+
 @bp.get("/admin/users")
 def admin_list_users():
+    """
+    Danh sách user cho trang admin, phân trang + lọc ở DB, join profile trong 1 query.
+    Query: page, per_page (<= 200) hoặc cursor (id của dòng cuối trang trước),
+           q (tiền tố username/email/phone), role, approved, locked, fields=id,username,...
+    """
     _, err = _require_admin()
     if err:
         return err
-    # load users with related profile so admin view can include phone, full_name and avatar
-    users = User.query.order_by(User.id.desc()).all()
+
+    wanted = [f.strip() for f in (request.args.get("fields") or "").split(",") if f.strip()]
+    fields = [f for f in wanted if f in _ADMIN_USER_FIELDS or f == "is_admin"] or (
+        list(_ADMIN_USER_FIELDS) + ["is_admin"]
+    )
+    columns = {f: _ADMIN_USER_FIELDS[f] for f in fields if f in _ADMIN_USER_FIELDS}
+    columns["id"] = User.id
+    if "is_admin" in fields:
+        columns["role"] = User.role
+
+    query = db.session.query(*[c.label(name) for name, c in columns.items()])
+    if "full_name" in columns or "avatar_url" in columns:
+        query = query.outerjoin(UserProfile, UserProfile.user_id == User.id)
+
+    q = (request.args.get("q") or "").strip()
+    if q:
+        prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        conds = [User.username.ilike(prefix, escape="\\"), User.email.ilike(prefix, escape="\\")]
+        phone = normalize_phone(q) if re.fullmatch(r"[\d\s+().-]+", q) else None
+        if phone:
+            conds.append(User.phone.like(phone + "%"))
+        query = query.filter(or_(*conds))
+    role = (request.args.get("role") or "").strip()
+    if role:
+        query = query.filter(User.role == role)
+    for name, col in (("approved", User.approved), ("locked", User.locked)):
+        flag = _bool_arg(name)
+        if flag is not None:
+            query = query.filter(col.is_(flag))
+
+    per_page = max(1, min(_int_arg("per_page", ADMIN_USERS_PER_PAGE), ADMIN_USERS_MAX_PER_PAGE))
+    cursor = _int_arg("cursor")
+    meta = {"per_page": per_page}
+    query = query.order_by(User.id.desc())
+    if cursor is not None:
+        # keyset: không OFFSET, trang sâu vẫn nhanh như trang đầu
+        rows = query.filter(User.id < cursor).limit(per_page + 1).all()
+    else:
+        page = max(1, _int_arg("page", 1))
+        meta.update(page=page, total=query.order_by(None).count())
+        rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    meta["next_cursor"] = rows[-1].id if has_more and rows else None
+
     data = []
-    for u in users:
-        prof = None
-        try:
-            prof = u.profile
-        except Exception:
-            prof = None
-        data.append({
-            "id": u.id,
-            "username": u.username,
-            "email": u.email,
-            "phone": u.phone,
-            "role": u.role,
-            "is_admin": (u.role == "admin"),
-            "approved": u.approved,
-            "locked": u.locked,
-            "created_at": u.created_at.isoformat(),
-            "full_name": (prof.full_name if prof else None),
-            "avatar_url": (prof.avatar_url if prof else None),
-        })
-    return {"data": data}
+    for row in rows:
+        m = row._mapping
+        item = {}
+        for f in fields:
+            if f == "is_admin":
+                item[f] = m["role"] == "admin"
+            elif f == "created_at":
+                item[f] = m[f].isoformat() if m[f] else None
+            else:
+                item[f] = m[f]
+        data.append(item)
+    return {"data": data, **meta}
 
 
 @bp.patch("/users/<int:uid>/status")
@@ -307,7 +438,9 @@ def update_status(uid: int):
         u.approved, u.locked = False, True
     else:
         u.approved, u.locked = False, False
+    u.token_version = (u.token_version or 0) + 1
     db.session.commit()
+    _forget_user_status(u.id)
     return {"ok": True, "status": status}
 
 @bp.get("/profile")
@@ -315,7 +448,7 @@ def get_profile():
     u, err = _require_user()
     if err:
         return err
-    p = UserProfile.query.filter_by(user_id=u.id).first()
+    p = u.profile
     if not p:
         p = UserProfile(user_id=u.id)
         db.session.add(p)
@@ -349,13 +482,78 @@ def public_user(username: str):
 
 
 
+BULK_USERS_MAX = int(os.getenv("BULK_USERS_MAX", "200"))
+BULK_USERS_MAX_AGE = int(os.getenv("BULK_USERS_MAX_AGE", "60"))
+
+def _bulk_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return []
+    return [v for v in (str(x).strip() for x in value) if v]
+
+@bp.route("/users/bulk", methods=["GET", "POST"])
+def bulk_users():
+    """Public endpoint: id/username -> thông tin hiển thị cho nhiều user trong 1 query.
+    Body (POST) hoặc query (GET): ids=[1,2,...], usernames=["a","b",...] (tổng <= BULK_USERS_MAX).
+    Chỉ trả id, username, full_name, avatar_url — không có email/phone vì endpoint không cần
+    đăng nhập và được cache public; có ETag + Cache-Control để gateway/browser cache.
+    """
+    src = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    try:
+        ids = sorted({int(x) for x in _bulk_list(src.get("ids"))})
+    except ValueError:
+        return {"error": "invalid_ids"}, 400
+    usernames = sorted(set(_bulk_list(src.get("usernames"))))
+    if not ids and not usernames:
+        return {"error": "missing_fields", "hint": "ids or usernames required"}, 400
+    if len(ids) + len(usernames) > BULK_USERS_MAX:
+        return {"error": "too_many", "max": BULK_USERS_MAX}, 400
+
+    conds = []
+    if ids:
+        conds.append(User.id.in_(ids))
+    if usernames:
+        conds.append(User.username.in_(usernames))
+    rows = (
+        db.session.query(User.id, User.username, UserProfile.full_name, UserProfile.avatar_url)
+        .outerjoin(UserProfile, UserProfile.user_id == User.id)
+        .filter(or_(*conds))
+        .order_by(User.id)
+        .all()
+    )
+    users = [{
+        "id": r.id,
+        "username": r.username,
+        "full_name": r.full_name or r.username,
+        "avatar_url": r.avatar_url,
+    } for r in rows]
+    found_ids = {u["id"] for u in users}
+    found_names = {u["username"] for u in users}
+    body = {
+        "users": users,
+        "missing": {
+            "ids": [i for i in ids if i not in found_ids],
+            "usernames": [n for n in usernames if n not in found_names],
+        },
+    }
+
+    resp = jsonify(body)
+    resp.add_etag()
+    resp.headers["Cache-Control"] = f"public, max-age={BULK_USERS_MAX_AGE}"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp.make_conditional(request)
+
+
 @bp.put("/profile")
 def update_profile():
     u, err = _require_user()
     if err:
         return err
     d = request.get_json(force=True)
-    p = UserProfile.query.filter_by(user_id=u.id).first()
+    p = u.profile
     if not p:
         p = UserProfile(user_id=u.id)
         db.session.add(p)
@@ -382,7 +580,7 @@ def update_profile_form():
     u, err = _require_user()
     if err:
         return err
-    p = UserProfile.query.filter_by(user_id=u.id).first()
+    p = u.profile
     if not p:
         p = UserProfile(user_id=u.id)
         db.session.add(p)
@@ -452,11 +650,22 @@ def profile_page():
 
 @bp.get("/avatar/<path:name>")
 def get_avatar(name):
+    """?size=s|m trả thumbnail WebP tạo sẵn; file theo hash được cache 1 năm (immutable)."""
     avatar_dir = Path(current_app.static_folder) / AVATAR_DIR
-    file_path = avatar_dir / name
-    if not file_path.exists():
-        return {"error": "not_found"}, 404
-    return send_from_directory(avatar_dir, name)
+    served = variant_name(name, request.args.get("size"))
+    if not (avatar_dir / served).is_file():
+        served = name
+        if not (avatar_dir / served).is_file():
+            return {"error": "not_found"}, 404
+    if is_hashed(served):
+        resp = send_from_directory(avatar_dir, served, max_age=AVATAR_CACHE_MAX_AGE, etag=served.split(".")[0])
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+    else:
+        # avatar cũ đặt theo username có thể bị ghi đè -> cache ngắn, ETag/Last-Modified để revalidate
+        resp = send_from_directory(avatar_dir, served, max_age=300)
+        resp.cache_control.public = True
+    return resp
 
 @bp.get("/login/google")
 def login_google():
@@ -483,7 +692,7 @@ def callback_google():
         u = User(
             username=(email or f"gg_{sub}")[:30],
             email=email,
-            password=generate_password_hash(os.urandom(8).hex()),
+            password=hash_password(os.urandom(8).hex()),
             role="member",
             approved=True,   # xã hội: có thể cho auto-approve
             locked=False,
@@ -526,7 +735,7 @@ def callback_facebook():
         u = User(
             username=(email or f"fb_{sub}")[:30],
             email=email,
-            password=generate_password_hash(os.urandom(8).hex()),
+            password=hash_password(os.urandom(8).hex()),
             role="member",
             approved=True,
             locked=False,
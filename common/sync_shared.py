@@ -0,0 +1,65 @@
+"""
+Chép các file dùng chung trong common/ vào từng service.
+
+Mỗi service build Docker context riêng (build: ./<service>) nên không import chung được
+một module ở gốc repo; common/ là bản gốc, bản trong service chỉ là bản chép.
+
+Chạy (từ gốc repo):
+    python common/sync_shared.py           # ghi đè bản chép trong các service
+    python common/sync_shared.py --check   # chỉ kiểm tra, exit 1 nếu có bản chép lệch
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+COMMON = ROOT / "common"
+
+SERVICES = [
+    "admin-service",
+    "auth-service",
+    "favorites-service",
+    "gateway",
+    "listing-service",
+    "payment-service",
+    "pricing-service",
+    "reviews-service",
+    "search-service",
+]
+# pricing-service chạy gunicorn bằng tham số dòng lệnh trong Dockerfile, không dùng file config
+SHARED = {
+    "http_middleware.py": SERVICES,
+    "gunicorn.conf.py": [s for s in SERVICES if s != "pricing-service"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync common/ vào các service")
+    parser.add_argument("--check", action="store_true", help="không ghi, exit 1 nếu có bản chép lệch")
+    args = parser.parse_args()
+
+    stale = []
+    for name, services in SHARED.items():
+        source = (COMMON / name).read_bytes()
+        for service in services:
+            target = ROOT / service / name
+            if target.exists() and target.read_bytes() == source:
+                continue
+            stale.append(target.relative_to(ROOT))
+            if not args.check:
+                target.write_bytes(source)
+
+    if args.check:
+        for path in stale:
+            print(f"❌ {path} lệch với common/ — chạy python common/sync_shared.py")
+        if stale:
+            sys.exit(1)
+        print("✅ Các bản chép khớp common/")
+    else:
+        for path in stale:
+            print(f"✓ {path}")
+        print(f"✅ Đã cập nhật {len(stale)} file")
+
+
+if __name__ == "__main__":
+    main()
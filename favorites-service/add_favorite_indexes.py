@@ -0,0 +1,20 @@
+"""
+Thêm index (user_id, created_at, id) cho bảng favorites đã tồn tại
+(db.create_all() không thêm index vào bảng cũ). Chạy lại nhiều lần không sao.
+
+Chạy: python add_favorite_indexes.py   (dùng DATABASE_URL giống service)
+"""
+from app import app
+from models import db, Favorite
+
+
+def main():
+    with app.app_context():
+        for index in Favorite.__table__.indexes:
+            if index.name == "ix_favorites_user_created":
+                index.create(bind=db.engine, checkfirst=True)
+                print("ok:", index.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from flask import Flask, jsonify
-from models import db
+from models import db, Favorite, FavoriteCount
 from routes import bp
+import counts
+import http_middleware
 import os
 
 app = Flask(__name__)
@@ -8,12 +10,19 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///fav
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db.init_app(app)
 app.register_blueprint(bp)
+http_middleware.init_app(app)
 
 @app.get("/")
 def root():
     return jsonify(service="favorites", status="ok", prefix="/favorites")
 
+# gunicorn không chạy khối __main__ nên tạo bảng ngay khi import
+with app.app_context():
+    db.create_all()
+    # lần đầu chạy với bảng favorite_counts mới: dựng lại từ favorites có sẵn
+    if not FavoriteCount.query.first() and Favorite.query.first():
+        counts.rebuild()
+
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5004)), debug=True)
+    # dev server; production chạy bằng gunicorn (xem gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5004)), debug=os.getenv("FLASK_DEBUG") == "1")
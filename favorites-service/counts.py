@@ -0,0 +1,57 @@
+"""
+Bảng favorite_counts: số người đã thích mỗi (item_id, item_type).
+
+add_favorite / delete gọi bump() trước commit nên số liệu đổi cùng transaction với
+Favorite; GET /favorites/counts, /favorites/top và search sort=popular chỉ đọc bảng này
+thay vì COUNT(*) trên favorites. Lệch số liệu (sửa DB tay) thì chạy: python rebuild_favorite_counts.py
+"""
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Favorite, FavoriteCount
+
+
+def bump(item_type: str, item_id: int, delta: int):
+    where = (FavoriteCount.item_id == item_id) & (FavoriteCount.item_type == item_type)
+    values = {"count": FavoriteCount.count + delta}
+    # UPDATE cộng dồn trong DB -> hai request đồng thời không ghi đè nhau
+    if db.session.query(FavoriteCount).filter(where).update(values, synchronize_session=False) or delta < 0:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(FavoriteCount(item_id=item_id, item_type=item_type, count=delta))
+    except IntegrityError:
+        # request khác vừa tạo dòng này trước -> cộng dồn vào dòng đó
+        db.session.query(FavoriteCount).filter(where).update(values, synchronize_session=False)
+
+
+def get_counts(ids, item_type=None) -> dict:
+    """{item_id: số lượt thích} (cộng mọi item_type nếu không lọc); id chưa ai thích không có trong dict."""
+    ids = list(ids)
+    if not ids:
+        return {}
+    q = db.session.query(FavoriteCount.item_id, func.sum(FavoriteCount.count)).filter(FavoriteCount.item_id.in_(ids))
+    if item_type:
+        q = q.filter(FavoriteCount.item_type == item_type)
+    return {item_id: int(n) for item_id, n in q.group_by(FavoriteCount.item_id) if n}
+
+
+def top(limit: int, item_type=None) -> list:
+    q = FavoriteCount.query.filter(FavoriteCount.count > 0)
+    if item_type:
+        q = q.filter(FavoriteCount.item_type == item_type)
+    rows = q.order_by(FavoriteCount.count.desc(), FavoriteCount.item_id.desc()).limit(limit).all()
+    return [{"item_id": r.item_id, "item_type": r.item_type, "count": r.count} for r in rows]
+
+
+def rebuild() -> int:
+    """Tính lại toàn bộ favorite_counts từ bảng favorites (một transaction)."""
+    FavoriteCount.query.delete(synchronize_session=False)
+    rows = (
+        db.session.query(Favorite.item_id, Favorite.item_type, func.count(Favorite.id))
+        .group_by(Favorite.item_id, Favorite.item_type)
+        .all()
+    )
+    db.session.add_all(FavoriteCount(item_id=i, item_type=t, count=n) for i, t, n in rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,55 @@
+# gunicorn.conf.py — cấu hình chạy production (gunicorn tự đọc file này từ thư mục làm việc)
+# File gốc ở common/gunicorn.conf.py; bản trong từng service được chép bằng
+# `python common/sync_shared.py` — đừng sửa trực tiếp bản chép.
+# Khác biệt theo service đặt bằng ENV trong Dockerfile (PORT, GUNICORN_THREADS, GUNICORN_TIMEOUT)
+# và hook riêng trong gunicorn_hooks.py (tuỳ chọn, cạnh app.py).
+# Các service dùng chung bộ biến môi trường:
+#   PORT                     cổng lắng nghe
+#   WEB_CONCURRENCY          số worker process (mặc định 2 * CPU + 1, tối đa 8)
+#   GUNICORN_WORKER_CLASS    gthread (mặc định) | gevent (cần pip install gevent) | sync
+#   GUNICORN_THREADS         số thread mỗi worker gthread
+#   GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE
+#   GUNICORN_MAX_REQUESTS    tái tạo worker sau N request (chặn rò rỉ bộ nhớ), 0 = tắt
+#   GUNICORN_PRELOAD         1 = import app một lần ở master rồi fork (khởi động worker nhanh)
+# Reload nhẹ nhàng: kill -HUP <master> (worker mới lên rồi worker cũ mới dừng);
+# khi preload bật và cần nạp code mới: kill -USR2 <master> rồi kill -QUIT master cũ.
+import multiprocessing
+import os
+
+try:
+    import gunicorn_hooks
+except ImportError:
+    gunicorn_hooks = None
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or min(multiprocessing.cpu_count() * 2 + 1, 8)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def _dispose_engines(app):
+    """Kết nối DB mở trong master lúc preload (create_all) không được dùng chung giữa các worker."""
+    ext = getattr(app, "extensions", {}).get("sqlalchemy") if app else None
+    if not ext:
+        return
+    with app.app_context():
+        for engine in ext.engines.values():
+            engine.dispose(close=False)
+
+
+def post_fork(server, worker):
+    _dispose_engines(getattr(server.app, "callable", None))
+
+
+def post_worker_init(worker):
+    if gunicorn_hooks and hasattr(gunicorn_hooks, "post_worker_init"):
+        gunicorn_hooks.post_worker_init(worker)
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table, Text
 
 db = SQLAlchemy()
 
@@ -12,4 +13,40 @@ class Favorite(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     __table_args__ = (
         db.UniqueConstraint("user_id", "item_type", "item_id", name="uq_user_item"),
+        # /favorites/me: lọc theo user rồi sắp xếp mới nhất trước (keyset cursor)
+        db.Index("ix_favorites_user_created", "user_id", "created_at", "id"),
     )
+
+
+
+class FavoriteCount(db.Model):
+    """Số lượt yêu thích mỗi listing, cập nhật cùng transaction với thêm/xoá Favorite."""
+    __tablename__ = "favorite_counts"
+    item_id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (
+        # GET /favorites/top: đọc theo count giảm dần, không sort cả bảng
+        db.Index("ix_favorite_counts_type_count", "item_type", "count", "item_id"),
+        db.Index("ix_favorite_counts_count", "count", "item_id"),
+    )
+
+# Bảng products của listing-service (cùng Postgres), chỉ đọc cho /favorites/me?expand=listing.
+# MetaData riêng nên db.create_all() không tạo bảng này trong DB của favorites.
+listing_metadata = MetaData()
+products = Table(
+    "products", listing_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(180)),
+    Column("description", Text),
+    Column("price", Integer),
+    Column("province", String(80)),
+    Column("year", Integer),
+    Column("mileage", Integer),
+    Column("battery_capacity", String(50)),
+    Column("item_type", String(20)),
+    Column("main_image_url", String(255)),
+    Column("approved", Boolean),
+    Column("sold", Boolean),
+)
@@ -0,0 +1,17 @@
+"""
+Dựng lại bảng favorite_counts từ favorites (sau khi import/sửa dữ liệu tay).
+
+Chạy: python rebuild_favorite_counts.py   (dùng DATABASE_URL giống service)
+"""
+from app import app
+import counts
+
+
+def main():
+    with app.app_context():
+        n = counts.rebuild()
+        print(f"favorite_counts: {n} dòng")
+
+
+if __name__ == "__main__":
+    main()
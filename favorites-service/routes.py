@@ -1,8 +1,84 @@
-from flask import Blueprint, request
-from models import db, Favorite
+import os
+import re
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, delete, inspect, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Favorite, products
+import counts
 
 bp = Blueprint("favorites", __name__, url_prefix="/favorites")
 
+CONTAINS_MAX_IDS = int(os.getenv("FAVORITES_CONTAINS_MAX_IDS", "200"))
+FAVORITES_PER_PAGE = int(os.getenv("FAVORITES_PER_PAGE", "24"))
+FAVORITES_MAX_PER_PAGE = int(os.getenv("FAVORITES_MAX_PER_PAGE", "100"))
+COUNTS_MAX_AGE = int(os.getenv("FAVORITES_COUNTS_MAX_AGE", "30"))
+TOP_MAX_LIMIT = 100
+STATIC_UPLOAD_PREFIX = "/static/uploads/"
+# Ảnh upload qua pipeline của gateway: <prefix>_<sha16>.jpg + <base>_card.webp
+_PROCESSED_IMG = re.compile(r"^(.*_[0-9a-f]{16})\.jpg$")
+_LISTING_COLS = [c.label(f"listing_{c.name}") for c in products.c]
+_products_table = None
+
+
+def _has_products_table() -> bool:
+    """Bảng products có trong cùng DB không (compose: Postgres dùng chung; dev SQLite: không).
+
+    Chỉ nhớ kết quả True: listing-service có thể tạo bảng sau khi service này khởi động.
+    """
+    global _products_table
+    if not _products_table:
+        _products_table = inspect(db.engine).has_table("products")
+    return _products_table
+
+
+def _decode_cursor(raw):
+    try:
+        ts, _, fid = raw.rpartition("_")
+        return datetime.fromisoformat(ts), int(fid)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _img_url(url):
+    if not url:
+        return None
+    url = url.strip()
+    if url.lower().startswith(("http://", "https://", "/")):
+        return url
+    return STATIC_UPLOAD_PREFIX + url
+
+
+def _listing_summary(row):
+    """Tóm tắt listing từ các cột listing_* của dòng join; None nếu listing đã bị xoá."""
+    m = row._mapping
+    if m["listing_id"] is None:
+        return None
+    main = _img_url(m["listing_main_image_url"])
+    processed = _PROCESSED_IMG.match(main or "")
+    return {
+        "id": m["listing_id"],
+        "name": m["listing_name"],
+        "description": m["listing_description"],
+        "price": m["listing_price"],
+        "province": m["listing_province"],
+        "year": m["listing_year"],
+        "mileage": m["listing_mileage"],
+        "battery_capacity": m["listing_battery_capacity"],
+        "item_type": m["listing_item_type"],
+        "main_image_url": main,
+        "main_image_card_url": f"{processed.group(1)}_card.webp" if processed else main,
+        "approved": bool(m["listing_approved"]),
+        "sold": bool(m["listing_sold"]),
+    }
+
+
+def _insert(model):
+    """INSERT hỗ trợ on_conflict_do_nothing theo dialect đang chạy (Postgres / SQLite dev)."""
+    return (sqlite_insert if db.engine.dialect.name == "sqlite" else pg_insert)(model)
+
 
 @bp.get("/")
 def health():
@@ -11,17 +87,85 @@ def health():
 
 @bp.get("/me")
 def list_my_favorites():
+    """Danh sách yêu thích của user, mới nhất trước, phân trang keyset.
+
+    Query: user_id, per_page (mặc định FAVORITES_PER_PAGE, tối đa FAVORITES_MAX_PER_PAGE),
+    cursor (next_cursor của trang trước), expand=listing để kèm tóm tắt listing
+    (join bảng products dùng chung Postgres; "expanded": false nếu DB không có bảng đó).
+    """
     user_id = request.args.get("user_id", type=int)
     if not user_id:
         return {"error": "missing_user_id"}, 400
-    favs = Favorite.query.filter_by(user_id=user_id).order_by(Favorite.created_at.desc()).all()
-    data = [{
-        "id": f.id,
-        "item_type": f.item_type,
-        "item_id": f.item_id,
-        "created_at": f.created_at.isoformat(),
-    } for f in favs]
-    return {"data": data}
+    per_page = max(1, min(request.args.get("per_page", FAVORITES_PER_PAGE, type=int) or FAVORITES_PER_PAGE,
+                          FAVORITES_MAX_PER_PAGE))
+    expand = request.args.get("expand") == "listing" and _has_products_table()
+
+    base = Favorite.query.filter(Favorite.user_id == user_id)
+    q = base.order_by(Favorite.created_at.desc(), Favorite.id.desc())
+    raw_cursor = request.args.get("cursor")
+    cursor = _decode_cursor(raw_cursor)
+    if raw_cursor and cursor is None:
+        return {"error": "invalid_cursor"}, 400
+    if cursor is not None:
+        at, fid = cursor
+        q = q.filter(or_(Favorite.created_at < at, and_(Favorite.created_at == at, Favorite.id < fid)))
+    if expand:
+        q = q.outerjoin(products, products.c.id == Favorite.item_id).add_columns(*_LISTING_COLS)
+    rows = q.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    data = []
+    for row in rows:
+        f = row[0] if expand else row
+        item = {
+            "id": f.id,
+            "item_type": f.item_type,
+            "item_id": f.item_id,
+            "created_at": f.created_at.isoformat(),
+        }
+        if expand:
+            item["listing"] = _listing_summary(row)
+        data.append(item)
+    return {
+        "data": data,
+        "per_page": per_page,
+        # tổng cho header "N sản phẩm đã lưu" ở mọi trang; COUNT chỉ quét index (user_id, created_at, id)
+        "total": base.order_by(None).count(),
+        "next_cursor": f"{data[-1]['created_at']}_{data[-1]['id']}" if has_more else None,
+        "expanded": expand,
+    }
+
+
+@bp.post("/contains")
+def contains():
+    """Trong các item_ids, item nào user đã thích (để tô trái tim trên lưới listing).
+
+    Body: {user_id, item_ids: [...], item_type?}
+    Trả về {"item_ids": [...đã thích], "data": [{id, item_type, item_id}]} — chỉ các dòng khớp,
+    tra theo unique index (user_id, item_type, item_id) thay vì tải cả danh sách /me.
+    """
+    d = request.get_json(silent=True) or {}
+    try:
+        user_id = int(d.get("user_id") or 0)
+        item_ids = sorted({int(x) for x in d.get("item_ids") or []})
+    except (TypeError, ValueError):
+        return {"error": "invalid_fields"}, 400
+    if not user_id:
+        return {"error": "missing_user_id"}, 400
+    if len(item_ids) > CONTAINS_MAX_IDS:
+        return {"error": "too_many", "max": CONTAINS_MAX_IDS}, 400
+    if not item_ids:
+        return {"item_ids": [], "data": []}
+
+    q = db.session.query(Favorite.id, Favorite.item_type, Favorite.item_id).filter(Favorite.user_id == user_id)
+    if d.get("item_type"):
+        q = q.filter(Favorite.item_type == d["item_type"])
+    rows = q.filter(Favorite.item_id.in_(item_ids)).all()
+    return {
+        "item_ids": sorted({r.item_id for r in rows}),
+        "data": [{"id": r.id, "item_type": r.item_type, "item_id": r.item_id} for r in rows],
+    }
 
 
 @bp.post("")
@@ -38,21 +182,81 @@ def add_favorite():
     if not user_id or not item_type or not item_id:
         print(f"[favorites] missing_fields user_id={user_id} item_type={item_type} item_id={item_id}", flush=True)
         return {"error": "missing_fields", "received": {"user_id": user_id, "item_type": item_type, "item_id": item_id}}, 400
-    f = Favorite(user_id=user_id, item_type=item_type, item_id=item_id)
-    db.session.add(f)
+    # INSERT ... ON CONFLICT DO NOTHING trên uq_user_item: thêm trùng không còn
+    # phải bắt IntegrityError + rollback, và trả về id sẵn có (thêm lại là idempotent)
     try:
-        db.session.commit()
-        print(f"[favorites] created favorite id={f.id} user={f.user_id} type={f.item_type} item={f.item_id}", flush=True)
-    except Exception as e:
-        db.session.rollback()
-        print(f"[favorites] unique/commit error: {e}", flush=True)
-        return {"error": "exists"}, 409
-    return {"id": f.id}, 201
+        values = {"user_id": int(user_id), "item_type": str(item_type), "item_id": int(item_id)}
+    except (TypeError, ValueError):
+        return {"error": "invalid_fields"}, 400
+    stmt = (
+        _insert(Favorite)
+        .values(created_at=datetime.utcnow(), **values)
+        .on_conflict_do_nothing(index_elements=["user_id", "item_type", "item_id"])
+        .returning(Favorite.id)
+    )
+    fav_id = db.session.execute(stmt).scalar()
+    created = fav_id is not None
+    if created:
+        counts.bump(values["item_type"], values["item_id"], 1)
+    else:
+        fav_id = db.session.query(Favorite.id).filter_by(**values).scalar()
+    db.session.commit()
+    print(f"[favorites] {'created' if created else 'exists'} favorite id={fav_id} user={user_id} type={item_type} item={item_id}", flush=True)
+    return {"id": fav_id, "created": created}, 201 if created else 200
+
+
+@bp.delete("/by-item")
+def delete_favorite_by_item():
+    """DELETE /favorites/by-item?user_id=&item_id=[&item_type=] — xoá theo item bằng một câu DELETE có index."""
+    user_id = request.args.get("user_id", type=int)
+    item_id = request.args.get("item_id", type=int)
+    item_type = request.args.get("item_type")
+    if not user_id or not item_id:
+        return {"error": "missing_fields", "hint": "user_id and item_id required"}, 400
+    stmt = delete(Favorite).where(Favorite.user_id == user_id, Favorite.item_id == item_id)
+    if item_type:
+        stmt = stmt.where(Favorite.item_type == item_type)
+    rows = db.session.execute(stmt.returning(Favorite.id, Favorite.item_type, Favorite.item_id)).all()
+    for r in rows:
+        counts.bump(r.item_type, r.item_id, -1)
+    db.session.commit()
+    if not rows:
+        return {"error": "not_found"}, 404
+    return {"ok": True, "removed": [r.id for r in rows]}
 
 
 @bp.delete("/<int:fav_id>")
 def delete_favorite(fav_id: int):
     f = Favorite.query.get_or_404(fav_id)
     db.session.delete(f)
+    counts.bump(f.item_type, f.item_id, -1)
     db.session.commit()
     return {"ok": True}
+
+
+@bp.get("/counts")
+def favorite_counts():
+    """GET /favorites/counts?ids=1,2,3[&item_type=] -> {"counts": {"1": 5, "2": 0, ...}} từ favorite_counts."""
+    try:
+        ids = sorted({int(x) for x in (request.args.get("ids") or "").split(",") if x.strip()})
+    except ValueError:
+        return {"error": "invalid_ids"}, 400
+    if not ids:
+        return {"error": "missing_ids"}, 400
+    if len(ids) > CONTAINS_MAX_IDS:
+        return {"error": "too_many", "max": CONTAINS_MAX_IDS}, 400
+    found = counts.get_counts(ids, request.args.get("item_type"))
+    resp = jsonify(counts={str(i): found.get(i, 0) for i in ids})
+    resp.cache_control.public = True
+    resp.cache_control.max_age = COUNTS_MAX_AGE
+    return resp
+
+
+@bp.get("/top")
+def top_favorited():
+    """GET /favorites/top?limit=20[&item_type=vehicle] -> listing được thích nhiều nhất."""
+    limit = max(1, min(request.args.get("limit", 20, type=int) or 20, TOP_MAX_LIMIT))
+    resp = jsonify(items=counts.top(limit, request.args.get("item_type")))
+    resp.cache_control.public = True
+    resp.cache_control.max_age = COUNTS_MAX_AGE
+    return resp
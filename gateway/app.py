@@ -1,8 +1,12 @@
 # gateway/app.py 
-from flask import Flask, render_template, redirect, url_for, request, session, flash, Response, jsonify
-import os, requests, jwt, time, json, re
+from flask import Flask, render_template, redirect, url_for, request, session, flash, Response, jsonify, g, abort, send_from_directory
+import os, requests, jwt, time, json, re, uuid, hashlib, threading, mimetypes
 from functools import wraps
-from werkzeug.utils import secure_filename
+from urllib.parse import quote
+from werkzeug.security import safe_join
+
+import images
+import http_middleware
 
 # ===================== Config =====================
 AUTH_URL     = os.getenv("AUTH_URL",     "http://auth_service:5001")
@@ -11,7 +15,10 @@ LISTING_URL  = os.getenv("LISTING_URL",  "http://listing_service:5002")
 SEARCH_URL   = os.getenv("SEARCH_URL",   "http://search_service:5003")
 PRICING_URL  = os.getenv("PRICING_URL",  "http://pricing_service:5003")
 FAVORITES_URL = os.getenv("FAVORITES_URL", "http://favorites_service:5004")
+FAVORITES_PER_PAGE = int(os.getenv("FAVORITES_PER_PAGE", "24"))
 PAYMENT_URL = os.getenv("PAYMENT_URL", "http://payment_service:5003")
+# Số lần thử lại POST /payment/create khi timeout/mất kết nối (an toàn nhờ Idempotency-Key)
+PAYMENT_CREATE_RETRIES = int(os.getenv("PAYMENT_CREATE_RETRIES", "2"))
 
 JWT_SECRET = os.getenv("JWT_SECRET", "devsecret")
 JWT_ALGOS  = ["HS256"]
@@ -19,6 +26,8 @@ JWT_ALGOS  = ["HS256"]
 app = Flask(__name__, template_folder="templates", static_folder="static", static_url_path="/static")
 app.secret_key = os.getenv("GATEWAY_SECRET", "dev")
 app.config.update(SESSION_COOKIE_SAMESITE="Lax")
+# nén HTML/JSON + ETag cho JSON GET (asset đã nén sẵn / file tĩnh đi qua nguyên vẹn)
+http_middleware.init_app(app)
 
 # Dev-only: show session debug info in templates and enable a debug endpoint if set
 GATEWAY_DEBUG_SESSION = os.getenv("GATEWAY_DEBUG_SESSION", "0").lower() in ("1", "true", "yes")
@@ -32,38 +41,176 @@ def inject_debug_flags():
 UPLOAD_DIR = os.path.join(app.static_folder, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 ALLOWED_EXTS = {"jpg", "jpeg", "png", "webp"}
+IMAGE_ERRORS = {
+    "file_too_large": "Ảnh quá dung lượng cho phép.",
+    "image_too_large": "Ảnh có độ phân giải quá lớn.",
+    "unsupported_type": "Định dạng ảnh không được hỗ trợ.",
+    "bad_image": "File ảnh bị lỗi hoặc không phải ảnh.",
+}
+
+# ===================== Static assets =====================
+# build_static.py (chạy lúc build image) sinh static/dist/<tên>.<hash>.<ext> + .gz/.br và manifest.json.
+# url_for('static', filename='style.css') tự đổi sang bản đã hash; không có manifest (dev) thì giữ tên gốc.
+STATIC_IMMUTABLE_MAX_AGE = 31536000
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+# "" = Flask tự gửi file upload; "accel" = X-Accel-Redirect (nginx); "sendfile" = X-Sendfile (Apache/lighttpd)
+UPLOADS_SENDFILE = os.getenv("UPLOADS_SENDFILE", "").strip().lower()
+UPLOADS_ACCEL_PREFIX = os.getenv("UPLOADS_ACCEL_PREFIX", "/_uploads/")
+# Ảnh listing qua pipeline (images.py) có hash nội dung trong tên => cache vĩnh viễn được
+_HASHED_UPLOAD = re.compile(r"_[0-9a-f]{16}(?:_(?:card|detail))?\.(?:jpg|webp)$")
+
+def _load_static_manifest():
+    try:
+        with open(os.path.join(app.static_folder, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+STATIC_MANIFEST = _load_static_manifest()
+
+@app.url_defaults
+def _fingerprint_static(endpoint, values):
+    if endpoint == "static" and values.get("filename") in STATIC_MANIFEST:
+        values["filename"] = STATIC_MANIFEST[values["filename"]]
+
+def _cache_forever(resp):
+    resp.cache_control.no_cache = None
+    resp.cache_control.public = True
+    resp.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp
+
+def _send_fingerprinted(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        path = safe_join(app.static_folder, filename + suffix)
+        if request.accept_encodings[encoding] and path and os.path.isfile(path):
+            resp = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype,
+                                       max_age=STATIC_IMMUTABLE_MAX_AGE)
+            resp.headers["Content-Encoding"] = encoding
+            break
+    else:
+        resp = send_from_directory(app.static_folder, filename, max_age=STATIC_IMMUTABLE_MAX_AGE)
+    resp.vary.add("Accept-Encoding")
+    return _cache_forever(resp)
+
+def _send_upload(name):
+    path = safe_join(UPLOAD_DIR, name)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    if UPLOADS_SENDFILE in ("accel", "sendfile"):
+        # front proxy đọc header này và tự gửi bytes, worker gunicorn trả về ngay
+        resp = Response(mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        if UPLOADS_SENDFILE == "accel":
+            resp.headers["X-Accel-Redirect"] = UPLOADS_ACCEL_PREFIX + quote(name)
+        else:
+            resp.headers["X-Sendfile"] = os.path.abspath(path)
+    else:
+        resp = send_from_directory(UPLOAD_DIR, name, max_age=STATIC_MAX_AGE)
+    if _HASHED_UPLOAD.search(name):
+        return _cache_forever(resp)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = STATIC_MAX_AGE
+    return resp
+
+def serve_static(filename):
+    if filename.startswith("dist/"):
+        return _send_fingerprinted(filename)
+    if filename.startswith("uploads/"):
+        return _send_upload(filename[len("uploads/"):])
+    return send_from_directory(app.static_folder, filename, max_age=STATIC_MAX_AGE)
+
+app.view_functions["static"] = serve_static
 
 # ===================== Helpers =====================
+# Header cache/validator của upstream được trả nguyên cho browser để 304 đi xuyên qua gateway
+_UPSTREAM_CACHE_HEADERS = ("ETag", "Cache-Control", "Last-Modified", "Expires")
+
+def _conditional_headers():
+    """If-None-Match/If-Modified-Since của browser để gửi kèm request tới upstream."""
+    return {k: v for k, v in request.headers.items() if k in ("If-None-Match", "If-Modified-Since")}
+
+def _upstream_response(r, default_ctype="application/json"):
+    """Response từ requests.Response: body đã giải nén + content-type + header cache/ETag."""
+    headers = {k: r.headers[k] for k in _UPSTREAM_CACHE_HEADERS if k in r.headers}
+    return Response(r.content, status=r.status_code, headers=headers,
+                    content_type=r.headers.get("content-type") or default_ctype)
+
 def _num(x):
     if x is None: 
         return None
     m = re.search(r"\d+(?:\.\d+)?", str(x))
     return float(m.group(0)) if m else None
 
-def save_image(file_storage, prefix="img"):
+def _read_upload(file_storage):
     if not file_storage or file_storage.filename == "":
         return None
     ext = file_storage.filename.rsplit(".", 1)[-1].lower()
     if ext not in ALLOWED_EXTS:
         return None
-    fname = f"{prefix}_{int(time.time()*1000)}_{secure_filename(file_storage.filename)}"
-    path = os.path.join(UPLOAD_DIR, fname)
-    file_storage.save(path)
-    return f"/static/uploads/{fname}"  # public URL served by gateway
+    return file_storage.read()
+
+def submit_image(file_storage, prefix="img"):
+    """Đưa ảnh vào pool xử lý của images.py; None nếu không có file / sai đuôi."""
+    data = _read_upload(file_storage)
+    return images.submit(data, UPLOAD_DIR, prefix) if data else None
+
+def image_url(future):
+    """Chờ kết quả submit_image; ảnh hỏng/quá lớn -> images.ImageError."""
+    return f"/static/uploads/{future.result()}" if future else None  # public URL served by gateway
+
+# Claims đã verify, key = sha256(token) -> (hết hạn, claims); mỗi token chỉ verify chữ ký
+# một lần trong suốt thời hạn của nó thay vì nhiều lần mỗi request.
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "5000"))
+_claims_cache = {}
+_claims_lock = threading.Lock()
 
 def decode_token(token: str):
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _claims_lock:
+        hit = _claims_cache.get(key)
+    if hit and hit[0] > now:
+        return dict(hit[1])
     # bỏ verify_sub để tránh lỗi nếu sub không phải string
-    return jwt.decode(token, JWT_SECRET, algorithms=JWT_ALGOS, options={"verify_sub": False})
+    payload = jwt.decode(token, JWT_SECRET, algorithms=JWT_ALGOS, options={"verify_sub": False})
+    try:
+        expires = float(payload.get("exp") or now + 300)
+    except (TypeError, ValueError):
+        expires = now + 300
+    with _claims_lock:
+        if len(_claims_cache) >= TOKEN_CACHE_MAX:
+            for k in [k for k, (exp, _) in _claims_cache.items() if exp <= now] or [next(iter(_claims_cache))]:
+                _claims_cache.pop(k, None)
+        _claims_cache[key] = (expires, payload)
+    return dict(payload)
+
+def _session_claims(name: str):
+    """Claims của token trong session[name] (decode 1 lần/request, lưu trên g)."""
+    cache = g.setdefault("_session_claims", {})
+    if name not in cache:
+        token = session.get(name)
+        claims = None
+        if token:
+            try:
+                claims = decode_token(token)
+            except Exception:
+                claims = None
+        cache[name] = claims
+    return cache[name]
+
+def current_user_claims():
+    return _session_claims("access_token")
+
+def current_admin_claims():
+    # giống _forward_admin_headers: ưu tiên token admin, không có thì dùng token thường
+    if session.get("admin_access_token"):
+        return _session_claims("admin_access_token")
+    return _session_claims("access_token")
 
 def is_admin_session() -> bool:
-    token = session.get("admin_access_token") or session.get("access_token")
-    if not token:
-        return False
-    try:
-        payload = decode_token(token)
-        return str(payload.get("role", "")).lower() == "admin"
-    except Exception:
-        return False
+    payload = current_admin_claims()
+    return bool(payload) and str(payload.get("role", "")).lower() == "admin"
 
 def login_required(next_endpoint_name="login_page"):
     def _wrap(f):
@@ -202,24 +349,14 @@ def home():
     })
 
     # Enrich with current user's favorites (IDs + mapping) for heart state in template
-    favorites_ids = set()
+    # Chỉ hỏi favorites-service về các listing đang hiển thị, không tải cả danh sách yêu thích
     favorites_map = {}
     user = session.get("user") or {}
     uid = user.get("id")
     token = session.get("access_token")
     if uid and token:
-        try:
-            r = requests.get(f"{FAVORITES_URL}/favorites/me", params={"user_id": uid}, timeout=5,
-                              headers={"Authorization": f"Bearer {token}"})
-            if r.ok and r.headers.get("content-type", "").startswith("application/json"):
-                data = (r.json() or {}).get("data", [])
-                for f in data:
-                    fid = f.get("item_id")
-                    if fid:
-                        favorites_ids.add(fid)
-                        favorites_map[fid] = f.get("id")  # map listing -> favorite row id
-        except Exception as e:
-            print("[gateway] load favorites for home failed", e)
+        favorites_map = _favorites_contains(uid, token, [p.get("id") for p in cars + batts])
+    favorites_ids = set(favorites_map)
 
     return render_template("index.html", cars=cars, batts=batts, is_search=False,
                            favorites_ids=favorites_ids, favorites_map=favorites_map)
@@ -309,9 +446,8 @@ def proxy_me():
     if not token:
         return Response("Unauthorized", status=401)
     try:
-        r = requests.get(f"{AUTH_URL}/auth/me", headers={"Authorization": f"Bearer {token}"}, timeout=8)
-        ctype = r.headers.get("content-type") or "application/json"
-        return Response(r.content, status=r.status_code, content_type=ctype)
+        r = requests.get(f"{AUTH_URL}/auth/me", headers={"Authorization": f"Bearer {token}", **_conditional_headers()}, timeout=8)
+        return _upstream_response(r)
     except requests.RequestException:
         return Response("Auth service unreachable", status=502)
 
@@ -323,7 +459,7 @@ def proxy_profile():
     try:
         headers = {"Authorization": f"Bearer {token}"}
         if request.method == "GET":
-            r = requests.get(f"{AUTH_URL}/auth/profile", headers=headers, timeout=10)
+            r = requests.get(f"{AUTH_URL}/auth/profile", headers={**headers, **_conditional_headers()}, timeout=10)
             if r.ok and (r.headers.get("content-type","").startswith("application/json")):
                 try: _update_display_name_from_payload(r.json())
                 except Exception: pass
@@ -342,22 +478,27 @@ def proxy_profile():
             if r.ok and (r.headers.get("content-type","").startswith("application/json")):
                 try: _update_display_name_from_payload(r.json())
                 except Exception: pass
-        ctype = r.headers.get("content-type") or "application/json"
-        return Response(r.content, status=r.status_code, content_type=ctype)
+        return _upstream_response(r)
     except requests.RequestException:
         return Response("Auth service unreachable", status=502)
 
+_AVATAR_PASS_HEADERS = ("Content-Type", "Content-Length", "Cache-Control", "ETag", "Last-Modified", "Expires")
+
 @app.get("/auth/avatar/<path:name>")
 def proxy_avatar(name):
-    headers = {}
-    if session.get("access_token"):
-        headers["Authorization"] = f"Bearer {session['access_token']}"
+    """Stream avatar từ auth-service (không buffer cả file), giữ nguyên header cache/ETag."""
+    # avatar là public: không gửi token để response cache được ở browser/proxy
+    headers = {k: v for k, v in request.headers.items() if k in ("If-None-Match", "If-Modified-Since")}
     try:
-        r = requests.get(f"{AUTH_URL}/auth/avatar/{name}", headers=headers, timeout=12, stream=True)
+        r = requests.get(f"{AUTH_URL}/auth/avatar/{name}", params=request.args,
+                         headers=headers, timeout=12, stream=True)
     except requests.RequestException:
         return Response("Auth service unreachable", status=502)
-    ctype = r.headers.get("content-type", "image/jpeg")
-    return Response(r.content, status=r.status_code, content_type=ctype)
+    out = {k: r.headers[k] for k in _AVATAR_PASS_HEADERS if k in r.headers}
+    resp = Response(r.iter_content(chunk_size=64 * 1024), status=r.status_code, headers=out,
+                    direct_passthrough=True)
+    resp.call_on_close(r.close)
+    return resp
 
 # ===================== Listings (Member) =====================
 @app.route("/listings/new", methods=["GET", "POST"], endpoint="add_listing")
@@ -380,13 +521,16 @@ def add_listing():
             flash("Nhập các thông tin bắt buộc!", "error")
             return render_template("post_product.html")
 
-        # upload ảnh
-        main_url = save_image(request.files.get("main_image"), prefix=f"{u.get('username','user')}_main")
-        sub_urls = []
-        for f in request.files.getlist("sub_images"):
-            url = save_image(f, prefix=f"{u.get('username','user')}_sub")
-            if url:
-                sub_urls.append(url)
+        # upload ảnh: ảnh chính + ảnh phụ xử lý song song (resize, bỏ EXIF, tạo WebP card/detail)
+        username = u.get('username', 'user')
+        main_job = submit_image(request.files.get("main_image"), prefix=f"{username}_main")
+        sub_jobs = [submit_image(f, prefix=f"{username}_sub") for f in request.files.getlist("sub_images")]
+        try:
+            main_url = image_url(main_job)
+            sub_urls = [url for url in map(image_url, sub_jobs) if url]
+        except images.ImageError as e:
+            flash(IMAGE_ERRORS.get(str(e), "Ảnh không hợp lệ."), "error")
+            return render_template("post_product.html")
         pt = payload.get("product_type", "car").lower()
         item_type = "vehicle" if pt == "car" else "battery"
 
@@ -458,11 +602,10 @@ def proxy_my_listings():
     try:
         # Include sold items so the user's own listing view shows sold/removed items too
         params = {'owner': username, 'per_page': 200, 'include_sold': '1'}
-        r = requests.get(f"{LISTING_URL}/listings", params=params, timeout=8, headers=headers)
+        r = requests.get(f"{LISTING_URL}/listings", params=params, timeout=8, headers={**headers, **_conditional_headers()})
     except requests.RequestException:
         return Response('Listing service unreachable', status=502)
-    ctype = r.headers.get('content-type','application/json')
-    return Response(r.content, status=r.status_code, content_type=ctype)
+    return _upstream_response(r)
 
 
 @app.get('/payments/mine')
@@ -535,6 +678,29 @@ def proxy_my_payments():
     return jsonify({'items': out})
 
 
+@app.get('/payments/purchased')
+def proxy_my_purchase():
+    """Current user đã có payment PAID cho item_id chưa (buyer_id lấy từ session, không từ client).
+    Query: item_id (bắt buộc), seller_id (tuỳ chọn) -> {"purchased": bool, "payment_id": id|null}
+    """
+    u = session.get('user') or {}
+    uid = u.get('id')
+    if not uid:
+        return Response('Unauthorized', status=401)
+    item_id = request.args.get('item_id', type=int)
+    if item_id is None:
+        return jsonify(error='item_id is required'), 400
+    params = {'buyer_id': uid, 'item_id': item_id}
+    seller_id = request.args.get('seller_id', type=int)
+    if seller_id is not None:
+        params['seller_id'] = seller_id
+    try:
+        r = requests.get(f"{PAYMENT_URL}/payment/purchased", params=params, timeout=5)
+    except requests.RequestException:
+        return Response('Payment service unreachable', status=502)
+    return _upstream_response(r)
+
+
 
 @app.get("/listings/<int:pid>")
 def product_detail(pid):
@@ -552,70 +718,49 @@ def product_detail(pid):
 
 @app.get('/seller/info')
 def seller_info():
-    """Return basic seller display info (full_name, avatar) for a given username.
-    This attempts to use an admin listing from auth-service (requires admin token in env or admin session).
-    If no admin access is available, returns a minimal object with username only.
+    """Return seller display info (full_name, avatar) and contact (email, phone) for a username.
+    Name/avatar come from the public bulk lookup on auth-service (cacheable, display fields
+    only); email/phone come from the public GET /auth/users/<username>, as before.
+    If the user is unknown, returns a minimal object with username only.
     Query params: username (required)
     """
     username = request.args.get('username') or request.args.get('user')
     if not username:
         return jsonify(error='missing_username'), 400
 
-    # Try to use admin session first
-    user_map = {}
+    # Public bulk lookup (no admin token needed, cacheable)
+    u = None
     try:
-        if is_admin_session():
-            hdr = _forward_admin_headers()
-            r = requests.get(f"{AUTH_URL}/auth/admin/users", headers=hdr, timeout=8)
-            if r.ok:
-                data = r.json().get('data', [])
-                for u in data:
-                    user_map[str(u.get('username'))] = u
-        # Fallback to ADMIN_TOKEN env
-        if not user_map:
-            admin_token = os.getenv('ADMIN_TOKEN') or os.getenv('GATEWAY_ADMIN_TOKEN')
-            if admin_token:
-                hdr = {'Authorization': f'Bearer {admin_token}'}
-                r = requests.get(f"{AUTH_URL}/auth/admin/users", headers=hdr, timeout=8)
-                if r.ok:
-                    data = r.json().get('data', [])
-                    for u in data:
-                        user_map[str(u.get('username'))] = u
+        r = requests.post(f"{AUTH_URL}/auth/users/bulk", json={"usernames": [username]}, timeout=6)
+        if r.ok:
+            u = next((x for x in r.json().get('users', []) if str(x.get('username')) == username), None)
     except Exception:
-        user_map = {}
+        u = None
 
-    u = user_map.get(username)
+    # Contact info: bulk không trả email/phone nên lấy từ endpoint public của user
+    contact = {}
+    try:
+        r = requests.get(f"{AUTH_URL}/auth/users/{username}", timeout=6)
+        if r.ok:
+            contact = r.json() or {}
+    except Exception:
+        contact = {}
+
+    u = u or contact
     if u:
-        # If admin endpoint returned an avatar filename, expose it as /auth/avatar/<name>
+        # If auth-service returned an avatar filename, expose it as /auth/avatar/<name>
         avatar_field = u.get('avatar_url') or u.get('avatar') or None
-        avatar_src = (f"/auth/avatar/{avatar_field}" if avatar_field else None)
+        avatar_src = (f"/auth/avatar/{avatar_field}?size=s" if avatar_field else None)
         return jsonify({
-            'username': u.get('username'),
-            'full_name': u.get('full_name') or u.get('username'),
-            'email': u.get('email'),
-            'phone': u.get('phone'),
+            'username': u.get('username', username),
+            'full_name': u.get('full_name') or u.get('username') or username,
+            'email': contact.get('email'),
+            'phone': contact.get('phone'),
             'id': u.get('id'),
             'avatar_src': avatar_src,
             'reviews': []
         })
 
-    # Try public user endpoint on auth service as a fallback so we can show contact info
-    try:
-        r = requests.get(f"{AUTH_URL}/auth/users/{username}", timeout=6)
-        if r.ok:
-            data = r.json() or {}
-            return jsonify({
-                'id': data.get('id'),
-                'username': data.get('username', username),
-                'full_name': data.get('full_name', username),
-                'email': data.get('email'),
-                'phone': data.get('phone'),
-                'avatar_src': data.get('avatar_url') and f"/auth/avatar/{data.get('avatar_url')}" or None,
-                'reviews': []
-            })
-    except Exception:
-        pass
-
     # No info - return minimal
     return jsonify({'username': username, 'full_name': username, 'phone': None, 'reviews': []})
 
@@ -628,19 +773,37 @@ def admin_page():
     cur_status   = (request.args.get("status") or "").strip()     # '', pending, approved, spam, rejected
     cur_verified = (request.args.get("verified") or "").strip()   # '', '1', '0'
 
+    user_q    = (request.args.get("user_q") or "").strip()
+    user_status = (request.args.get("user_status") or "").strip()  # '', pending, approved
+    try:
+        user_page = max(1, int(request.args.get("user_page") or 1))
+    except ValueError:
+        user_page = 1
+    users_total, users_has_more = 0, False
+
     # ---- USERS (chỉ khi là admin) ----
     if is_admin_session():
         # Use admin headers (fall back to normal access token if admin token not present)
         headers = _forward_admin_headers()
+        # auth-service phân trang + lọc ở DB, chỉ lấy các cột bảng thành viên cần
+        params = {"role": "member", "page": user_page, "per_page": 50,
+                  "fields": "id,username,email,role,is_admin,approved,locked"}
+        if user_q:
+            params["q"] = user_q
+        if user_status in {"pending", "approved"}:
+            params["approved"] = "1" if user_status == "approved" else "0"
         for url in (f"{ADMIN_URL}/admin/users",
                     f"{AUTH_URL}/auth/admin/users",
                     f"{AUTH_URL}/auth/users"):
             try:
-                r = requests.get(url, headers=headers, timeout=8)
+                r = requests.get(url, headers=headers, params=params, timeout=8)
                 if r.ok and r.headers.get("content-type","").startswith("application/json"):
                     data = r.json()
                     raw = data.get("data", data if isinstance(data, list) else [])
                     users = [u for u in raw if not (u.get("is_admin") or str(u.get("role","")).lower()=="admin")]
+                    if isinstance(data, dict):
+                        users_total = data.get("total") or len(users)
+                        users_has_more = bool(data.get("next_cursor"))
                     break
             except requests.RequestException:
                 pass
@@ -664,7 +827,9 @@ def admin_page():
         "admin.html",
         users=users, products=products, transactions=transactions,
         is_admin=is_admin_session(),
-        cur_status=cur_status, cur_verified=cur_verified
+        cur_status=cur_status, cur_verified=cur_verified,
+        user_q=user_q, user_page=user_page, user_status=user_status,
+        users_total=users_total, users_has_more=users_has_more
     )
 
 
@@ -960,33 +1125,55 @@ def favorites_page():
         return redirect(url_for("home"))
     
     try:
-        # Get favorites from favorites service
+        # Một trang yêu thích kèm tóm tắt listing trong 1 response (expand=listing)
         headers = {"Authorization": f"Bearer {token}"}
-        resp = requests.get(f"{FAVORITES_URL}/favorites/me", params={"user_id": user_id}, headers=headers, timeout=5)
-        view_favs = []
+        params = {"user_id": user_id, "expand": "listing", "per_page": FAVORITES_PER_PAGE}
+        if request.args.get("cursor"):
+            params["cursor"] = request.args["cursor"]
+        resp = requests.get(f"{FAVORITES_URL}/favorites/me", params=params, headers=headers, timeout=5)
+        view_favs, body = [], {}
         if resp.ok and (resp.headers.get("content-type","" ).startswith("application/json")):
-            favs = resp.json().get("data", [])
-            # Fetch full listing details for each favorite, attach into expected template shape
-            for fav in favs:
-                item = None
-                try:
-                    r2 = requests.get(f"{LISTING_URL}/listings/{fav['item_id']}", headers=headers, timeout=6)
-                    if r2.ok and r2.headers.get("content-type","" ).startswith("application/json"):
-                        item = r2.json()
-                except Exception:
-                    item = None
+            body = resp.json() or {}
+            for fav in body.get("data", []):
+                item = fav.get("listing")
+                if not body.get("expanded"):
+                    # favorites-service không thấy bảng products (DB riêng khi chạy dev) -> hỏi listing-service
+                    try:
+                        r2 = requests.get(f"{LISTING_URL}/listings/{fav['item_id']}", headers=headers, timeout=6)
+                        if r2.ok and r2.headers.get("content-type","" ).startswith("application/json"):
+                            item = r2.json()
+                    except Exception:
+                        item = None
                 view_favs.append({
                     "id": fav.get("id"),
                     "item_type": fav.get("item_type"),
                     "item_id": fav.get("item_id"),
                     "item": item,
                 })
-        
-        return render_template("favorites.html", favs=view_favs)
+
+        next_cursor = body.get("next_cursor")
+        return render_template("favorites.html", favs=view_favs, total=body.get("total"),
+                               next_url=url_for("favorites_page", cursor=next_cursor) if next_cursor else None,
+                               first_url=url_for("favorites_page") if request.args.get("cursor") else None)
     except requests.RequestException:
         flash("Không thể tải danh sách yêu thích.", "error")
         return render_template("favorites.html", favs=[])
 
+def _favorites_contains(uid, token, item_ids) -> dict:
+    """{item_id: favorite id} cho các item_ids user đã thích (POST /favorites/contains)."""
+    ids = sorted({int(i) for i in item_ids if i})
+    if not ids:
+        return {}
+    try:
+        r = requests.post(f"{FAVORITES_URL}/favorites/contains", json={"user_id": int(uid), "item_ids": ids},
+                          timeout=5, headers={"Authorization": f"Bearer {token}"})
+        if r.ok and r.headers.get("content-type", "").startswith("application/json"):
+            return {f.get("item_id"): f.get("id") for f in (r.json() or {}).get("data", [])}
+    except requests.RequestException as e:
+        print("[gateway] favorites contains failed", e)
+    return {}
+
+
 @app.post("/favorites/add")
 @login_required()
 def add_favorite():
@@ -999,15 +1186,10 @@ def add_favorite():
         uid = user.get("id") or user.get("user_id")
         if uid:
             return uid
-        # 2. decode token
-        if token:
-            try:
-                payload = decode_token(token)
-                uid = payload.get("sub")
-                if uid:
-                    return uid
-            except Exception as e:
-                print("[gateway] decode_token failed", e)
+        # 2. claims đã verify trong before_request
+        payload = current_user_claims()
+        if payload and payload.get("sub"):
+            return payload.get("sub")
         # 3. call /auth/me (final fallback)
         if token:
             try:
@@ -1046,7 +1228,8 @@ def add_favorite():
         print(f"DEBUG favorites/add upstream status={resp.status_code} body={resp.text[:200]}")
         
         if resp.ok:
-            return jsonify(resp.json()), 201
+            # 201 = vừa thêm, 200 = đã có sẵn (favorites-service trả về id cũ, created=false)
+            return jsonify(resp.json()), resp.status_code
         elif resp.status_code == 409:
             return jsonify(error="already_exists"), 409
         elif resp.status_code == 400:
@@ -1076,22 +1259,17 @@ def remove_favorite_by_item():
         item_id = int(item_id)
     except Exception:
         return jsonify(error="invalid_item_id"), 400
-    # Fetch favorites to locate the favorite record id
+    # Một câu DELETE theo (user_id, item_type, item_id) ở favorites-service, không cần tra id trước
+    params = {"user_id": uid, "item_id": item_id}
+    if payload.get("item_type"):
+        params["item_type"] = str(payload["item_type"])
     try:
-        r = requests.get(f"{FAVORITES_URL}/favorites/me", params={"user_id": uid}, timeout=5,
-                          headers={"Authorization": f"Bearer {token}"})
-        fav_id = None
-        if r.ok and r.headers.get("content-type", "").startswith("application/json"):
-            for f in (r.json() or {}).get("data", []):
-                if f.get("item_id") == item_id:
-                    fav_id = f.get("id")
-                    break
-        if not fav_id:
-            return jsonify(error="favorite_not_found"), 404
-        del_resp = requests.delete(f"{FAVORITES_URL}/favorites/{fav_id}", timeout=5,
+        del_resp = requests.delete(f"{FAVORITES_URL}/favorites/by-item", params=params, timeout=5,
                                    headers={"Authorization": f"Bearer {token}"})
         if del_resp.ok:
-            return jsonify(ok=True, removed=fav_id)
+            return jsonify(ok=True, removed=(del_resp.json() or {}).get("removed", []))
+        if del_resp.status_code == 404:
+            return jsonify(error="favorite_not_found"), 404
         return jsonify(error="upstream_delete_failed", status=del_resp.status_code,
                        body=del_resp.text[:200]), del_resp.status_code
     except requests.RequestException as e:
@@ -1454,8 +1632,7 @@ def gw_reviews_proxy(subpath: str):
         else:
             r = requests.request(request.method, target, headers=headers, timeout=10)
 
-        resp = Response(r.content, status=r.status_code, content_type=r.headers.get('content-type', 'application/json'))
-        return resp
+        return _upstream_response(r)
     except requests.RequestException as e:
         return jsonify({'error': 'reviews_upstream_unreachable', 'detail': str(e)}), 502
 # ===================== Payment (proxy) =====================
@@ -1533,12 +1710,26 @@ def gw_payment_create():
                     elif existing_seller:
                         payload["seller_id"] = existing_seller
         
-        r = requests.post(
-            f"{PAYMENT_URL}/payment/create",
-            json=payload,
-            headers={**_forward_auth_headers(), "Content-Type": "application/json"},
-            timeout=10
-        )
+        # Cùng một key cho mọi lần thử: payment-service trả lại phản hồi gốc thay vì tạo payment mới
+        headers = {
+            **_forward_auth_headers(),
+            "Content-Type": "application/json",
+            "Idempotency-Key": request.headers.get("Idempotency-Key") or uuid.uuid4().hex,
+        }
+        for attempt in range(PAYMENT_CREATE_RETRIES + 1):
+            try:
+                r = requests.post(
+                    f"{PAYMENT_URL}/payment/create",
+                    json=payload,
+                    headers=headers,
+                    timeout=(3, 10)
+                )
+                if r.status_code < 500 or attempt == PAYMENT_CREATE_RETRIES:
+                    break
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == PAYMENT_CREATE_RETRIES:
+                    raise
+            time.sleep(0.2 * (2 ** attempt))
         ctype = r.headers.get("content-type") or "application/json"
         return Response(r.content, status=r.status_code, content_type=ctype)
     except requests.RequestException as e:
@@ -1584,11 +1775,20 @@ def gw_payment_invoice(contract_id: str):
     try:
         r = requests.get(
             f"{PAYMENT_URL}/payment/invoice/{contract_id}",
-            headers=_forward_auth_headers(),
+            headers={**_forward_auth_headers(), **_conditional_headers()},
             timeout=12,
         )
-        ctype = r.headers.get("content-type") or "text/html"
-        return Response(r.content, status=r.status_code, content_type=ctype)
+        return _upstream_response(r, "text/html")
+    except requests.RequestException as e:
+        return Response(f"Payment upstream error: {e}", status=502)
+
+@app.get("/payment/contract/document/<int:contract_id>")
+def gw_contract_document(contract_id: int):
+    """Bản hợp đồng đã ký: payment-service chỉ trả cho người mua/bán/admin nên phải kèm token phiên."""
+    try:
+        r = requests.get(f"{PAYMENT_URL}/payment/contract/document/{contract_id}",
+                         headers={**_forward_admin_headers(), **_conditional_headers()}, timeout=12)
+        return _upstream_response(r, "text/html")
     except requests.RequestException as e:
         return Response(f"Payment upstream error: {e}", status=502)
 
@@ -1611,6 +1811,7 @@ from flask import request, Response, jsonify
 
 PAYMENT_URL = os.getenv("PAYMENT_URL", "http://payment_service:5003")
 ADMIN_TOKEN  = os.getenv("ADMIN_TOKEN", "changeme-super-admin-token")
+_PAYMENT_INTERNAL_PATHS = {"purchased"}
 
 @app.route("/payment/<path:subpath>", methods=["GET","POST","PUT","PATCH","DELETE","OPTIONS"])
 def proxy_payment_catchall(subpath):
@@ -1618,6 +1819,10 @@ def proxy_payment_catchall(subpath):
     Proxy mọi request /payment/* sang payment-service (500x/compose).
     Các route cụ thể (nếu có) sẽ được Flask match trước; cái này là lưới an toàn.
     """
+    # purchased nhận buyer_id tuỳ ý -> chỉ dành cho service nội bộ; trình duyệt dùng /payments/purchased
+    if subpath.rstrip("/") in _PAYMENT_INTERNAL_PATHS:
+        return jsonify(error="not_found"), 404
+
     upstream = f"{PAYMENT_URL}/payment/{subpath}"
 
     headers = {k: v for k, v in request.headers if k.lower() != "host"}
@@ -1671,8 +1876,8 @@ def gw_payment_admin_reports():
                  headers=_forward_admin_headers(), timeout=10)
         ctype = r.headers.get("content-type") or "application/json"
 
-        # Try to parse JSON so we can enrich with buyer/seller display names when
-        # the current session is admin. If parsing fails, return raw upstream body.
+        # Try to parse JSON so we can enrich with buyer/seller display names.
+        # If parsing fails, return raw upstream body.
         try:
             payload = r.json()
         except Exception:
@@ -1680,52 +1885,22 @@ def gw_payment_admin_reports():
 
         items = payload.get("items") or []
 
-        # If current session is admin, attempt to fetch user list from Auth service
-        # (requires admin token in session) and map ids -> username for better UX.
+        # payment-service đã gắn buyer_name/seller_name; chỉ tra thêm các id còn thiếu
+        # qua /auth/users/bulk (1 query IN, không cần admin token).
         user_map = {}
-
-        # First attempt: use current admin session (forward Authorization header)
-        admin_session = is_admin_session()
-        print(f"[DEBUG] is_admin_session: {admin_session}, session keys: {list(session.keys())}")
-        
-        if admin_session:
+        missing_ids = sorted({
+            int(it[key]) for it in items for key, name in (("buyer_id", "buyer_name"), ("seller_id", "seller_name"))
+            if it.get(key) is not None and not it.get(name)
+        })
+        if missing_ids:
             try:
-                auth_headers = _forward_admin_headers()
-                print(f"[DEBUG] Calling /auth/admin/users with headers: {auth_headers}")
-                user_r = requests.get(f"{AUTH_URL}/auth/admin/users", headers=auth_headers, timeout=8)
-                print(f"[DEBUG] Auth response status: {user_r.status_code}")
+                user_r = requests.post(f"{AUTH_URL}/auth/users/bulk", json={"ids": missing_ids[:200]}, timeout=5)
                 if user_r.ok:
-                    udata = user_r.json().get("data", [])
-                    print(f"[DEBUG] Got {len(udata)} users from auth-service")
-                    user_map = {int(u.get("id")): (u.get("full_name") or u.get("username") or u.get("email") or f"#{u.get('id')}") for u in udata if u.get("id") is not None}
-                else:
-                    print(f"[DEBUG] Auth call failed: {user_r.text[:200]}")
-            except requests.RequestException as e:
-                # If auth service is unreachable or token not valid, silently skip this attempt
-                print(f"[DEBUG] Auth service unreachable: {e}")
+                    user_map = {int(u["id"]): (u.get("full_name") or u.get("username") or u.get("email") or f"#{u['id']}")
+                                for u in user_r.json().get("users", [])}
+            except requests.RequestException:
                 user_map = {}
 
-        # Fallback attempt: try using an admin token from environment (useful for non-interactive sessions)
-        if not user_map:
-            try:
-                admin_token = os.getenv("ADMIN_TOKEN") or os.getenv("GATEWAY_ADMIN_TOKEN") or os.getenv("ADMIN_TOKEN_FALLBACK")
-                print(f"[DEBUG] Fallback token exists: {bool(admin_token)}, length: {len(admin_token) if admin_token else 0}")
-                if admin_token:
-                    hdr = {"Authorization": f"Bearer {admin_token}"}
-                    user_r = requests.get(f"{AUTH_URL}/auth/admin/users", headers=hdr, timeout=8)
-                    print(f"[DEBUG] Fallback auth response status: {user_r.status_code}")
-                    if user_r.ok:
-                        udata = user_r.json().get("data", [])
-                        print(f"[DEBUG] Fallback got {len(udata)} users")
-                        user_map = {int(u.get("id")): (u.get("full_name") or u.get("username") or u.get("email") or f"#{u.get('id')}") for u in udata if u.get("id") is not None}
-                    else:
-                        print(f"[DEBUG] Fallback auth failed: {user_r.text[:200]}")
-            except Exception as e:
-                print(f"[DEBUG] Fallback exception: {e}")
-                user_map = {}
-        
-        print(f"[DEBUG] Final user_map size: {len(user_map)}")
-
         # Apply enrichment to items using any user_map we obtained
         if user_map:
             for it in items:
@@ -1748,82 +1923,12 @@ def gw_payment_admin_reports():
 
 @app.post("/payment/admin/approve/<int:payment_id>")
 def gw_payment_admin_approve(payment_id: int):
-    """Proxy duyệt giao dịch, sau đó đánh dấu listing đã bán"""
+    """Proxy duyệt giao dịch (payment-service tự đánh dấu listing đã bán qua outbox)"""
     try:
-        # Approve payment
         r = requests.post(f"{PAYMENT_URL}/payment/admin/approve/{payment_id}",
                   headers={**_forward_admin_headers(),
                                    "X-Admin-Token": GATEWAY_ADMIN_TOKEN},
                           timeout=10)
-        
-        if r.ok:
-            # Get payment details to retrieve stored items and mark listings as sold
-            try:
-                pr = requests.get(
-                    f"{PAYMENT_URL}/payment/{payment_id}",
-                    headers=_forward_admin_headers(),
-                    timeout=5,
-                )
-                if pr.ok:
-                    payment_data = pr.json()
-                    items = payment_data.get("items") or []
-                    processed_ids = set()
-
-                    # Prefer explicit items payload to determine listing IDs
-                    for item in items:
-                        if not isinstance(item, dict):
-                            continue
-                        item_id = item.get("item_id") or item.get("id")
-                        if item_id is None:
-                            continue
-                        try:
-                            listing_id = int(item_id)
-                        except Exception:
-                            continue
-                        if listing_id in processed_ids:
-                            continue
-                        processed_ids.add(listing_id)
-                        try:
-                            mark_resp = requests.put(
-                                f"{LISTING_URL}/listings/{listing_id}/mark_sold",
-                                headers=_forward_admin_headers(),
-                                timeout=5,
-                            )
-                            print(
-                                f"[DEBUG] Marked listing {listing_id} as sold: {mark_resp.status_code}"
-                            )
-                        except Exception as exc:
-                            print(f"[DEBUG] Failed to mark listing {listing_id}: {exc}")
-
-                    # Fallback: attempt to parse listing IDs from order_id if no items present
-                    if not processed_ids:
-                        order_id = payment_data.get("order_id", "")
-                        if order_id.startswith("ORD-"):
-                            import re
-
-                            for listing_id_str in re.findall(r"\d+", order_id[4:]):
-                                try:
-                                    listing_id = int(listing_id_str)
-                                except Exception:
-                                    continue
-                                if listing_id in processed_ids:
-                                    continue
-                                try:
-                                    mark_resp = requests.put(
-                                        f"{LISTING_URL}/listings/{listing_id}/mark_sold",
-                                        headers=_forward_admin_headers(),
-                                        timeout=5,
-                                    )
-                                    processed_ids.add(listing_id)
-                                    print(
-                                        f"[DEBUG] Marked listing {listing_id} via fallback: {mark_resp.status_code}"
-                                    )
-                                except Exception as exc:
-                                    print(f"[DEBUG] Fallback failed for listing {listing_id}: {exc}")
-            except Exception as e:
-                print(f"[DEBUG] Failed to mark listings as sold: {e}")
-                # Payment approved but listing mark failed — do not block response
-        
         ctype = r.headers.get("content-type") or "application/json"
         return Response(r.content, status=r.status_code, content_type=ctype)
     except requests.RequestException as e:
@@ -1874,5 +1979,6 @@ def debug_session():
         return jsonify({"session": None}), 200
 
 if __name__ == "__main__":
+    # dev server; production chạy bằng gunicorn (xem gunicorn.conf.py)
     port = int(os.getenv("PORT", "8000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,91 @@
+"""
+Fingerprint static assets của gateway lúc build (Dockerfile chạy script này).
+
+static/style.css            -> static/dist/style.<hash8>.css (+ .gz, + .br nếu có module brotli)
+static/images/logo.png      -> static/dist/images/logo.<hash8>.png
+static/manifest.json        {"style.css": "dist/style.<hash8>.css", ...}
+
+App đọc manifest lúc khởi động: url_for('static', filename='style.css') trả về URL đã hash,
+các file trong dist/ được cache 1 năm (immutable). Không có manifest thì dùng tên gốc như cũ.
+uploads/ là dữ liệu người dùng nên không đụng tới.
+
+Chạy: python build_static.py [--static-dir static]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # .br là tuỳ chọn; gzip luôn có
+    brotli = None
+
+SKIP_DIRS = {"uploads", "dist"}
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+MIN_COMPRESS_BYTES = 512
+
+
+def _digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()[:8]
+
+
+def _precompress(path: Path):
+    data = path.read_bytes()
+    if path.suffix.lower() not in COMPRESSIBLE or len(data) < MIN_COMPRESS_BYTES:
+        return []
+    written = []
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        path.with_name(path.name + ".gz").write_bytes(gz)
+        written.append("gz")
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            path.with_name(path.name + ".br").write_bytes(br)
+            written.append("br")
+    return written
+
+
+def build(static_dir: Path) -> dict:
+    dist = static_dir / "dist"
+    if dist.exists():
+        shutil.rmtree(dist)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        rel_root = Path(root).relative_to(static_dir)
+        if rel_root == Path("."):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in sorted(files):
+            src = Path(root) / name
+            rel = rel_root / name
+            if rel.as_posix() == "manifest.json":
+                continue
+            hashed = rel.with_name(f"{src.stem}.{_digest(src)}{src.suffix}")
+            target = dist / hashed
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src, target)
+            encodings = _precompress(target)
+            manifest[rel.as_posix()] = (Path("dist") / hashed).as_posix()
+            print(f"{rel.as_posix():<48} -> {manifest[rel.as_posix()]} {' '.join(encodings)}")
+    (static_dir / "manifest.json").write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint + precompress gateway static assets")
+    parser.add_argument("--static-dir", default=str(Path(__file__).resolve().parent / "static"))
+    args = parser.parse_args()
+    manifest = build(Path(args.static_dir))
+    print(f"{len(manifest)} file(s), brotli={'yes' if brotli else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# gateway/images.py
+"""
+Xử lý ảnh listing lúc upload: decode/kiểm tra, xoay theo EXIF rồi bỏ metadata,
+giới hạn độ phân giải ảnh chính và tạo sẵn các biến thể WebP.
+
+<upload_dir>/<prefix>_<sha16>.jpg           ảnh chính (cạnh dài tối đa IMAGE_MAX_DIM)
+<upload_dir>/<prefix>_<sha16>_card.webp     thẻ ở trang chủ / tìm kiếm / so sánh
+<upload_dir>/<prefix>_<sha16>_detail.webp   trang chi tiết
+
+Listing chỉ lưu tên ảnh chính; listing/search service suy ra URL biến thể từ
+tên file (PROCESSED_NAME), ảnh cũ không theo mẫu tên thì dùng lại URL gốc.
+Decode + resize chạy trong pool IMAGE_WORKERS thread, không chiếm request thread.
+"""
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(60_000_000)))
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or min(4, os.cpu_count() or 2)
+
+VARIANTS = {
+    "card": int(os.getenv("IMAGE_CARD_DIM", "480")),
+    "detail": int(os.getenv("IMAGE_DETAIL_DIM", "1024")),
+}
+_FORMATS = {"JPEG", "PNG", "WEBP", "MPO"}
+PROCESSED_NAME = re.compile(r"^(?P<base>.+_[0-9a-f]{16})\.jpg$")
+
+_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="img")
+
+
+class ImageError(ValueError):
+    """Ảnh upload không hợp lệ; str(exc) là mã lỗi."""
+
+
+def _open(data: bytes) -> Image.Image:
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            raise ImageError("image_too_large")
+        if img.format not in _FORMATS:
+            raise ImageError("unsupported_type")
+        img.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ImageError("bad_image")
+    return img
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _encode(img: Image.Image, fmt: str, **opts) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, fmt, **opts)
+    return buf.getvalue()
+
+
+def _downscale(img: Image.Image, max_dim: int) -> Image.Image:
+    if max(img.size) <= max_dim:
+        return img
+    out = img.copy()
+    out.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    return out
+
+
+def process_image(data: bytes, upload_dir: str, prefix: str = "img") -> str:
+    """Chuẩn hoá + lưu ảnh chính và biến thể, trả về tên file ảnh chính."""
+    if not data:
+        raise ImageError("no_file")
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ImageError("file_too_large")
+
+    img = ImageOps.exif_transpose(_open(data))
+    if img.mode != "RGB":
+        # nền trắng cho ảnh có alpha thay vì nền đen khi convert thẳng sang RGB
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+
+    main = _downscale(img, IMAGE_MAX_DIM)
+    # encode lại => không còn EXIF (GPS, model máy...)
+    main_bytes = _encode(main, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+    base = f"{secure_filename(prefix) or 'img'}_{hashlib.sha256(main_bytes).hexdigest()[:16]}"
+
+    os.makedirs(upload_dir, exist_ok=True)
+    name = f"{base}.jpg"
+    if not os.path.exists(os.path.join(upload_dir, name)):
+        _atomic_write(os.path.join(upload_dir, name), main_bytes)
+    for variant, px in VARIANTS.items():
+        path = os.path.join(upload_dir, f"{base}_{variant}.webp")
+        if os.path.exists(path):
+            continue
+        _atomic_write(path, _encode(_downscale(main, px), "WEBP", quality=IMAGE_WEBP_QUALITY, method=4))
+    return name
+
+
+def submit(data: bytes, upload_dir: str, prefix: str = "img"):
+    """Đưa ảnh vào pool xử lý, trả về Future[tên file]."""
+    return _pool.submit(process_image, data, upload_dir, prefix)
+
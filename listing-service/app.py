@@ -2,6 +2,7 @@
 from flask import Flask, jsonify
 from models import db
 from routes import bp
+import http_middleware
 import os
 
 def create_app():
@@ -11,6 +12,7 @@ def create_app():
 
     db.init_app(app)
     app.register_blueprint(bp)
+    http_middleware.init_app(app)
 
     @app.get("/")
     def health():
@@ -24,4 +26,5 @@ def create_app():
 if __name__ == "__main__":
     app = create_app()
     print("🚀 listing-service:", app.config["SQLALCHEMY_DATABASE_URI"])
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5002)), debug=True)
+    # dev server; production: gunicorn "app:create_app()" (xem gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5002)), debug=os.getenv("FLASK_DEBUG") == "1")
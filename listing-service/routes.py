@@ -2,7 +2,7 @@
 from flask import Blueprint, request, jsonify
 from models import db, Product, ProductStatus, ItemType, BlockedUser
 from sqlalchemy import or_
-import os, jwt, json, requests
+import os, re, jwt, json, requests
 from datetime import datetime
 
 
@@ -46,6 +46,14 @@ def _norm_img(url: str | None) -> str | None:
     # Nếu chỉ là tên file (không có prefix) => thêm /static/uploads/
     return STATIC_UPLOAD_PREFIX + url
 
+# Ảnh upload qua pipeline của gateway: <prefix>_<sha16>.jpg + <base>_card.webp / <base>_detail.webp
+_PROCESSED_IMG = re.compile(r"^(.*_[0-9a-f]{16})\.jpg$")
+
+def _img_variant(url: str | None, variant: str) -> str | None:
+    """URL biến thể WebP (card/detail); ảnh cũ không có biến thể => trả lại URL gốc."""
+    m = _PROCESSED_IMG.match(url or "")
+    return f"{m.group(1)}_{variant}.webp" if m else url
+
 def _strip_prefix(u: str | None) -> str | None:
     """Loại bỏ prefix /static/uploads/ khi lưu DB."""
     if not u:
@@ -73,8 +81,22 @@ def _resolve_owner_id(username: str | None) -> int | None:
         pass
     return None
 
-def to_json(p: Product):
-    """Chuyển Product sang dict JSON trả về cho client."""
+def _resolve_owner_ids(usernames) -> dict:
+    """Resolve nhiều username -> user ID trong 1 lần gọi /auth/users/bulk."""
+    names = sorted({u for u in usernames if u})
+    if not names:
+        return {}
+    try:
+        r = requests.post(f"{AUTH_URL}/auth/users/bulk", json={"usernames": names}, timeout=3)
+        if r.ok:
+            return {u.get("username"): u.get("id") for u in r.json().get("users", [])}
+    except Exception:
+        pass
+    return {}
+
+def to_json(p: Product, owner_ids: dict | None = None):
+    """Chuyển Product sang dict JSON trả về cho client.
+    owner_ids: map username -> id đã tra sẵn (trang danh sách), tránh gọi auth-service từng dòng."""
     sub_urls = []
     try:
         sub_urls = json.loads(p.sub_image_urls or "[]")
@@ -83,7 +105,10 @@ def to_json(p: Product):
     except Exception:
         sub_urls = []
 
-    owner_id = _resolve_owner_id(p.owner)
+    if owner_ids is not None:
+        owner_id = owner_ids.get(p.owner)
+    else:
+        owner_id = _resolve_owner_id(p.owner)
 
     return {
         "id": p.id,
@@ -99,6 +124,9 @@ def to_json(p: Product):
         "owner_id": owner_id,
         "main_image_url": _norm_img(p.main_image_url),
         "sub_image_urls": [_norm_img(u) for u in sub_urls],
+        "main_image_card_url": _img_variant(_norm_img(p.main_image_url), "card"),
+        "main_image_detail_url": _img_variant(_norm_img(p.main_image_url), "detail"),
+        "sub_image_detail_urls": [_img_variant(_norm_img(u), "detail") for u in sub_urls],
         "approved": bool(p.approved),
         "approved_at": p.approved_at.isoformat() if p.approved_at else None,
         "approved_by": p.approved_by,
@@ -201,9 +229,10 @@ def list_products():
     page = parse_int(request.args.get("page"), 1, 1)
     per_page = parse_int(request.args.get("per_page"), 12, 1, 50)
     page_obj = q.paginate(page=page, per_page=per_page, error_out=False)
+    owner_ids = _resolve_owner_ids(p.owner for p in page_obj.items)
 
     return jsonify({
-        "items": [to_json(p) for p in page_obj.items],
+        "items": [to_json(p, owner_ids) for p in page_obj.items],
         "page": page_obj.page,
         "per_page": page_obj.per_page,
         "total": page_obj.total,
@@ -430,3 +459,35 @@ def mark_available(pid):
     p.sold = False
     db.session.commit()
     return jsonify(message="Sản phẩm đã được đánh dấu còn hàng", item=to_json(p)), 200
+
+def _bulk_set_sold(sold: bool):
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = sorted({int(i) for i in (data.get("ids") or [])})
+    except (TypeError, ValueError):
+        return None, (jsonify(error="ids phải là danh sách số nguyên"), 400)
+    if not ids:
+        return None, (jsonify(error="Thiếu ids"), 400)
+    products = Product.query.filter(Product.id.in_(ids)).all()
+    for p in products:
+        p.sold = sold
+    db.session.commit()
+    updated = sorted(p.id for p in products)
+    missing = sorted(set(ids) - set(updated))
+    return {"updated": updated, "missing": missing}, None
+
+@bp.put("/mark_sold")
+def bulk_mark_sold():
+    """Đánh dấu nhiều sản phẩm đã bán trong một request (outbox của payment-service)"""
+    result, err = _bulk_set_sold(True)
+    if err:
+        return err
+    return jsonify(result), 200
+
+@bp.put("/mark_available")
+def bulk_mark_available():
+    """Đánh dấu nhiều sản phẩm còn hàng trong một request"""
+    result, err = _bulk_set_sold(False)
+    if err:
+        return err
+    return jsonify(result), 200
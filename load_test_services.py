@@ -0,0 +1,98 @@
+"""
+Load test nhanh cho các service: requests/sec + p50/p95 trên endpoint đọc nhẹ của từng service.
+
+So sánh trước/sau khi chuyển sang gunicorn:
+    # 1) chạy các service bằng `python app.py` (dev server) rồi:
+    python load_test_services.py --save before.json
+    # 2) chạy lại bằng gunicorn (docker compose up --build, hoặc `gunicorn app:app` trong từng thư mục):
+    python load_test_services.py --compare before.json
+
+Mặc định dùng port public trong docker-compose.yml; đổi bằng --target name=url.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TARGETS = {
+    "auth": "http://localhost:5001/health",
+    "admin": "http://localhost:5003/health",
+    "listing": "http://localhost:5002/listings/?per_page=12",
+    "search": "http://localhost:5010/search/",
+    "favorites": "http://localhost:5004/",
+    "payment": "http://localhost:5008/payment/health",
+    "reviews": "http://localhost:5011/",
+    "gateway": "http://localhost:8000/health",
+}
+
+
+def run(url, total, concurrency):
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = local.session.get(url, timeout=30).ok
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    lat = sorted(l for ok, l in results if ok)
+    return {
+        "rps": len(lat) / elapsed,
+        "p50_ms": statistics.median(lat) * 1000 if lat else 0.0,
+        "p95_ms": lat[max(0, int(len(lat) * 0.95) - 1)] * 1000 if lat else 0.0,
+        "errors": total - len(lat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/sec per service")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--only", action="append", default=[], help="tên service (lặp lại được)")
+    parser.add_argument("--target", action="append", default=[], help="name=url, ghi đè/thêm target")
+    parser.add_argument("--save", help="lưu kết quả JSON")
+    parser.add_argument("--compare", help="file JSON của lần chạy trước để in cột trước/sau")
+    args = parser.parse_args()
+
+    targets = dict(TARGETS)
+    for t in args.target:
+        name, _, url = t.partition("=")
+        targets[name] = url
+    if args.only:
+        targets = {k: v for k, v in targets.items() if k in args.only}
+    before = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            before = json.load(f)
+
+    header = f"{'service':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}"
+    print(header + (f"{'before':>10}{'x':>8}" if before else ""))
+    results = {}
+    for name, url in targets.items():
+        r = results[name] = run(url, args.requests, args.concurrency)
+        line = f"{name:<12}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['errors']:>8}"
+        prev = before.get(name)
+        if prev:
+            ratio = r["rps"] / prev["rps"] if prev["rps"] else 0.0
+            line += f"{prev['rps']:>10.1f}{ratio:>7.1f}x"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Backfill bảng payment_items từ Payment.items (JSON) của các payment cũ.
+
+Bảng được tạo bởi db.create_all() khi service khởi động (DB Postgres đã có bảng cũ
+chỉ gồm payment_id/item_id: chạy migrations/add_payment_items_columns.sql trước); payment mới
+tự ghi payment_items trong create_payment. Mặc định chỉ xử lý payment chưa có dòng nào,
+chạy lại nhiều lần không sao; --all ghi lại toàn bộ (lấp seller_id/price/quantity cho dòng cũ).
+
+Chạy: python backfill_payment_items.py [--batch 500] [--all]   (dùng DATABASE_URL giống service)
+"""
+import argparse
+import os
+
+os.environ.setdefault("OUTBOX_DISPATCHER", "0")
+
+from app import app
+from db import db
+from models import Payment, PaymentItem
+from routes import _payment_item_rows
+
+
+def backfill(batch_size: int, rebuild: bool = False) -> tuple[int, int]:
+    payments = rows = 0
+    last_id = 0
+    while True:
+        query = Payment.query.filter(Payment.id > last_id)
+        if not rebuild:
+            has_items = db.session.query(PaymentItem.id).filter(PaymentItem.payment_id == Payment.id).exists()
+            query = query.filter(~has_items)
+        batch = query.order_by(Payment.id).limit(batch_size).all()
+        if not batch:
+            break
+        if rebuild:
+            PaymentItem.query.filter(PaymentItem.payment_id.in_([p.id for p in batch])).delete(synchronize_session=False)
+        for p in batch:
+            items = _payment_item_rows(p.items if isinstance(p.items, list) else [], seller_id=p.seller_id)
+            for it in items:
+                it.payment_id = p.id
+            db.session.add_all(items)
+            rows += len(items)
+        payments += len(batch)
+        last_id = batch[-1].id
+        db.session.commit()
+        print(f"... payment id <= {last_id}: {rows} dòng")
+    return payments, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill payment_items từ Payment.items")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--all", action="store_true", help="ghi lại payment_items của mọi payment")
+    args = parser.parse_args()
+    with app.app_context():
+        db.create_all()
+        payments, rows = backfill(args.batch, rebuild=args.all)
+    print(f"✅ {payments} payment, {rows} dòng payment_items")
+
+
+if __name__ == "__main__":
+    main()
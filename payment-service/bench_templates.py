@@ -0,0 +1,96 @@
+"""
+Micro-benchmark: thời gian render một trang checkout/hóa đơn/hợp đồng/cảm ơn.
+
+So sánh cách cũ (render_template_string: parse + compile mỗi request) với
+render_template (template compile một lần, cache trong jinja_env).
+
+Chạy: python bench_templates.py [số_vòng]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from flask import render_template, render_template_string
+from app import app
+from db import db
+from models import Payment, PaymentMethod, Contract, ContractType
+from routes import _build_checkout_ui, _ensure_sale_contract
+
+
+def _seed():
+    payment = Payment(
+        order_id="ORD-BENCH-1",
+        buyer_id=1,
+        seller_id=2,
+        amount=125_000_000,
+        items=[{"item_id": 1, "title": "VinFast VF e34", "price": 125_000_000}],
+        method=PaymentMethod.BANKING,
+        provider="Manual",
+    )
+    db.session.add(payment)
+    db.session.commit()
+    invoice = Contract(
+        payment=payment,
+        contract_type=ContractType.INVOICE,
+        title=f"Invoice for payment #{payment.id}",
+        content="bench",
+        extra_data={"full_name": "Nguyễn Văn A", "product_name": "VinFast VF e34"},
+    )
+    db.session.add(invoice)
+    db.session.commit()
+    sale = _ensure_sale_contract(payment, {"full_name": "Nguyễn Văn A"})
+    return payment, invoice, sale
+
+
+def _contexts(payment, invoice, sale):
+    total = float(payment.amount)
+    return {
+        "checkout.html": dict(
+            payment=payment, ui=_build_checkout_ui(payment), error=None,
+            qr_text="", bank_name="MB Bank", bank_account="0", bank_owner="EV",
+        ),
+        "invoice.html": dict(
+            payment=payment, info=invoice.extra_data, confirmed=True, VAT=0.1,
+            bank_name="MB Bank", bank_account="0", bank_owner="EV",
+            buyer_name="Nguyễn Văn A", memo="PAY1-ORD1", qr_text="",
+            total=total, subtotal=total, vat=0, bank_initials="MB",
+            sale_code=f"H{sale.id:03d}", sale_id=sale.id, buyer_signed=False,
+            seller_signed=False, sale_status="draft", sale_content=sale.content,
+            seller_net=total,
+        ),
+        "sign_contract.html": dict(
+            content=sale.content, code=f"HD{sale.id:02d}", created="",
+            contract_id=sale.id, invoice_id=invoice.id, buyer_already_signed=False,
+        ),
+        "thankyou.html": dict(
+            p=payment, inv=invoice, sale=sale, order_id=payment.order_id,
+            sale_code=f"H{sale.id:03d}", amount=total,
+        ),
+    }
+
+
+def _timeit(fn, rounds):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with app.app_context():
+        payment, invoice, sale = _seed()
+        with app.test_request_context("/payment/checkout/1"):
+            print(f"{'template':<22}{'string (ms)':>14}{'loader (ms)':>14}{'speedup':>10}")
+            for name, ctx in _contexts(payment, invoice, sale).items():
+                source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+                before = _timeit(lambda: render_template_string(source, **ctx), rounds)
+                after = _timeit(lambda: render_template(name, **ctx), rounds)
+                print(f"{name:<22}{before:>14.3f}{after:>14.3f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
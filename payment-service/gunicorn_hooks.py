@@ -0,0 +1,14 @@
+# gunicorn_hooks.py — hook riêng của payment-service, common/gunicorn.conf.py import khi có file này.
+import os
+
+# Dispatcher outbox là thread nền: không chạy trong master (thread không sống qua fork),
+# mỗi worker tự khởi động một cái sau khi nạp app (SKIP LOCKED nên chạy song song an toàn).
+# Module này được import lúc gunicorn đọc config, trước khi preload app ở master.
+_outbox_enabled = os.getenv("OUTBOX_DISPATCHER", "1") != "0"
+os.environ["OUTBOX_DISPATCHER"] = "0"
+
+
+def post_worker_init(worker):
+    if _outbox_enabled:
+        import outbox
+        outbox.start_dispatcher(worker.wsgi)
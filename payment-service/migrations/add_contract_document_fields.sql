@@ -0,0 +1,8 @@
+-- Migration script to add frozen contract document fields to contracts table
+-- Run this after updating the model
+
+ALTER TABLE contracts
+ADD COLUMN IF NOT EXISTS document_sha256 VARCHAR(64),
+ADD COLUMN IF NOT EXISTS document_frozen_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS ix_contracts_document_sha256 ON contracts(document_sha256);
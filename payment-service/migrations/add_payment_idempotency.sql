@@ -0,0 +1,13 @@
+-- Migration script for idempotent POST /payment/create
+-- Run this after updating the model (idempotency_keys is created by db.create_all)
+
+-- Keep the oldest payment when a retried request already created duplicates
+DELETE FROM payments p
+USING payments older
+WHERE p.order_id = older.order_id
+  AND p.buyer_id = older.buyer_id
+  AND p.id > older.id
+  AND NOT EXISTS (SELECT 1 FROM contracts c WHERE c.payment_id = p.id);
+
+ALTER TABLE payments
+ADD CONSTRAINT uq_payment_order_buyer UNIQUE (order_id, buyer_id);
@@ -0,0 +1,11 @@
+-- Migration: payment_items mang thêm seller_id / price / quantity
+-- (bảng payment_items do db.create_all tạo; DB đã có bảng bản đầu chỉ gồm payment_id, item_id)
+-- Sau khi chạy: python backfill_payment_items.py --all
+
+ALTER TABLE payment_items ADD COLUMN IF NOT EXISTS seller_id INTEGER;
+ALTER TABLE payment_items ADD COLUMN IF NOT EXISTS price DOUBLE PRECISION;
+ALTER TABLE payment_items ADD COLUMN IF NOT EXISTS quantity INTEGER NOT NULL DEFAULT 1;
+
+CREATE INDEX IF NOT EXISTS ix_payment_items_item_payment ON payment_items (item_id, payment_id);
+CREATE INDEX IF NOT EXISTS ix_payment_items_seller ON payment_items (seller_id);
+CREATE INDEX IF NOT EXISTS ix_payment_items_payment ON payment_items (payment_id);
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum as PyEnum
-from sqlalchemy import Enum, Index
+from sqlalchemy import Enum, Index, UniqueConstraint
 from db import db
 
 
@@ -36,6 +36,12 @@ class SignatureType(PyEnum):
     IMAGE = "image"
 
 
+class OutboxStatus(PyEnum):
+    PENDING = "pending"
+    SENT = "sent"
+    DEAD = "dead"
+
+
 class Payment(db.Model):
     __tablename__ = "payments"
 
@@ -69,6 +75,8 @@ class Payment(db.Model):
 
     __table_args__ = (
         Index("ix_payment_status_created", "status", "created_at"),
+        # Một đơn hàng của một người mua chỉ tạo đúng một payment (retry an toàn)
+        UniqueConstraint("order_id", "buyer_id", name="uq_payment_order_buyer"),
     )
 
     contracts = db.relationship(
@@ -77,6 +85,34 @@ class Payment(db.Model):
         lazy=True,
         cascade="all, delete-orphan",
     )
+    line_items = db.relationship(
+        "PaymentItem",
+        back_populates="payment",
+        lazy=True,
+        cascade="all, delete-orphan",
+    )
+
+
+class PaymentItem(db.Model):
+    """Bản chuẩn hoá của Payment.items (JSON): mỗi listing trong payment một dòng,
+    để tra "ai đã mua listing X" bằng index thay vì duyệt JSON."""
+
+    __tablename__ = "payment_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    seller_id = db.Column(db.Integer, nullable=True)
+    price = db.Column(db.Float, nullable=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+
+    payment = db.relationship("Payment", back_populates="line_items")
+
+    __table_args__ = (
+        Index("ix_payment_items_item_payment", "item_id", "payment_id"),
+        Index("ix_payment_items_seller", "seller_id"),
+        Index("ix_payment_items_payment", "payment_id"),
+    )
 
 
 class Contract(db.Model):
@@ -109,6 +145,10 @@ class Contract(db.Model):
     seller_signature_data = db.Column(db.Text, nullable=True)
     seller_signed_at = db.Column(db.DateTime, nullable=True)
     
+    # Bản hợp đồng đã render và đóng băng lúc ký (sha256 của file HTML trên đĩa)
+    document_sha256 = db.Column(db.String(64), nullable=True, index=True)
+    document_frozen_at = db.Column(db.DateTime, nullable=True)
+
     # Legacy fields
     signer_name = db.Column(db.String(120))
     signed_at = db.Column(db.DateTime)
@@ -119,10 +159,52 @@ class Contract(db.Model):
     payment = db.relationship("Payment", back_populates="contracts")
 
 
+class IdempotencyKey(db.Model):
+    """Phản hồi gốc của POST /payment/create, tra theo header Idempotency-Key."""
+
+    __tablename__ = "idempotency_keys"
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(128), nullable=False, unique=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    payment_id = db.Column(db.Integer, db.ForeignKey("payments.id"), nullable=True)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class OutboxEvent(db.Model):
+    """Sự kiện gửi sang service khác, ghi cùng transaction với thay đổi payment."""
+
+    __tablename__ = "outbox_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(
+        Enum(OutboxStatus, name="outbox_status"),
+        nullable=False,
+        default=OutboxStatus.PENDING,
+    )
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+
 __all__ = [
     "db",
     "Payment",
+    "PaymentItem",
     "Contract",
+    "IdempotencyKey",
+    "OutboxEvent",
+    "OutboxStatus",
     "PaymentMethod",
     "PaymentStatus",
     "ContractType",
@@ -0,0 +1,185 @@
+"""
+Transactional outbox cho việc đánh dấu listing đã bán / còn hàng.
+
+admin approve/reject chỉ ghi OutboxEvent cùng transaction với payment rồi trả về ngay;
+một thread nền gom các sự kiện đến hạn, gửi theo lô sang listing-service và retry
+với backoff lũy thừa khi listing-service chậm hoặc lỗi.
+"""
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+from db import db
+from models import OutboxEvent, OutboxStatus, Payment
+
+LISTING_URL = os.getenv("LISTING_URL", "http://listing_service:5002")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "12"))
+OUTBOX_BACKOFF_MAX = int(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+
+MARK_SOLD = "listing.mark_sold"
+MARK_AVAILABLE = "listing.mark_available"
+_LISTING_ENDPOINTS = {
+    MARK_SOLD: "mark_sold",
+    MARK_AVAILABLE: "mark_available",
+}
+
+log = logging.getLogger("payment.outbox")
+_wakeup = threading.Event()
+_started = False
+_http = requests.Session()
+
+
+def listing_ids(payment: Payment) -> list[int]:
+    if payment.line_items:
+        return list(dict.fromkeys(it.item_id for it in payment.line_items))
+    # payment cũ chưa backfill payment_items: đọc từ JSON
+    ids = []
+    for item in payment.items or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            listing_id = int(item.get("item_id") or item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if listing_id not in ids:
+            ids.append(listing_id)
+    return ids
+
+
+def enqueue_listing_events(event_type: str, payment: Payment) -> int:
+    """Thêm sự kiện cho từng listing của payment vào session hiện tại (chưa commit)."""
+    ids = listing_ids(payment)
+    for listing_id in ids:
+        db.session.add(
+            OutboxEvent(
+                event_type=event_type,
+                payload={"listing_id": listing_id, "payment_id": payment.id},
+            )
+        )
+    return len(ids)
+
+
+def notify():
+    """Đánh thức dispatcher ngay sau khi commit thay vì đợi tới lượt poll kế tiếp."""
+    _wakeup.set()
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, OUTBOX_BACKOFF_MAX))
+
+
+def dispatch_once() -> int:
+    """Gửi một lô sự kiện đến hạn. Trả về số sự kiện đã xử lý."""
+    now = datetime.utcnow()
+    events = (
+        OutboxEvent.query.filter(
+            OutboxEvent.status == OutboxStatus.PENDING,
+            OutboxEvent.next_attempt_at <= now,
+        )
+        .order_by(OutboxEvent.id.asc())
+        .limit(OUTBOX_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not events:
+        db.session.rollback()
+        return 0
+
+    # Chỉ trạng thái cuối cùng của mỗi listing là quan trọng (approve rồi reject ngay...).
+    # Xét mọi sự kiện PENDING của các listing trong lô, kể cả sự kiện chưa đến hạn (đang
+    # backoff): chỉ gửi sự kiện mới nhất (id lớn nhất) của mỗi listing, các sự kiện cũ hơn
+    # coi như đã được thay thế. Nếu sự kiện mới nhất chưa đến hạn thì lô này không gửi gì
+    # cho listing đó -> một mark_sold cũ đang retry không thể ghi đè mark_available mới hơn.
+    due_ids = {ev.id for ev in events}
+    listing_key = OutboxEvent.payload["listing_id"].as_integer()
+    others = (
+        OutboxEvent.query.filter(
+            OutboxEvent.status == OutboxStatus.PENDING,
+            listing_key.in_(list({ev.payload.get("listing_id") for ev in events})),
+            OutboxEvent.id.notin_(due_ids),
+        )
+        .order_by(OutboxEvent.id.asc())
+        .all()
+    )
+    latest = {}
+    for ev in sorted(events + others, key=lambda e: e.id):
+        latest[ev.payload.get("listing_id")] = ev
+    superseded = [ev for ev in events + others if latest.get(ev.payload.get("listing_id")) is not ev]
+    to_send = [ev for ev in latest.values() if ev.id in due_ids]
+
+    batches = {}
+    for ev in to_send:
+        batches.setdefault(ev.event_type, []).append(ev)
+
+    for event_type, batch in batches.items():
+        endpoint = _LISTING_ENDPOINTS.get(event_type)
+        error = None
+        if not endpoint:
+            error = f"unknown event_type {event_type}"
+        else:
+            ids = sorted({ev.payload["listing_id"] for ev in batch})
+            try:
+                r = _http.put(
+                    f"{LISTING_URL}/listings/{endpoint}",
+                    json={"ids": ids},
+                    timeout=(3, 10),
+                )
+                if not r.ok:
+                    error = f"HTTP {r.status_code}: {r.text[:200]}"
+                else:
+                    missing = (r.json() or {}).get("missing") or []
+                    if missing:
+                        log.warning("listing-service: %s missing listings %s", endpoint, missing)
+            except requests.RequestException as exc:
+                error = str(exc)
+
+        for ev in batch:
+            ev.attempts += 1
+            if error is None:
+                ev.status = OutboxStatus.SENT
+                ev.sent_at = now
+                ev.last_error = None
+            else:
+                ev.last_error = error
+                if ev.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    ev.status = OutboxStatus.DEAD
+                    log.error("outbox event %s dead after %s attempts: %s", ev.id, ev.attempts, error)
+                else:
+                    ev.next_attempt_at = now + _backoff(ev.attempts)
+
+    for ev in superseded:
+        ev.status = OutboxStatus.SENT
+        ev.sent_at = now
+
+    db.session.commit()
+    return len(events)
+
+
+def _run(app):
+    while True:
+        processed = 0
+        try:
+            with app.app_context():
+                try:
+                    processed = dispatch_once()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            log.exception("outbox dispatch failed")
+        if processed < OUTBOX_BATCH_SIZE:
+            _wakeup.wait(OUTBOX_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_dispatcher(app):
+    global _started
+    if _started:
+        return
+    _started = True
+    threading.Thread(target=_run, args=(app,), name="outbox-dispatcher", daemon=True).start()
@@ -1,11 +1,16 @@
 import os
 import io
 import jwt
-from datetime import datetime
-from flask import Blueprint, jsonify, request, render_template_string, Response, redirect, url_for
+import json
+import hashlib
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify, request, render_template, Response, redirect, url_for, send_file, current_app
+from sqlalchemy.exc import IntegrityError
 from db import db
 from models import (
     Payment,
+    PaymentItem,
+    IdempotencyKey,
     PaymentMethod,
     PaymentStatus,
     Contract,
@@ -13,12 +18,13 @@ from models import (
     ContractStatus,
     SignatureType,
 )
+import outbox
 
 # VAT mặc định 10% (có thể override bằng biến môi trường VAT_RATE)
 VAT_RATE = float(os.getenv("VAT_RATE", "0.10"))
 
 # ============ Blueprint ============
-bp = Blueprint("payment", __name__, url_prefix="/payment")
+bp = Blueprint("payment", __name__, url_prefix="/payment", template_folder="templates")
 
 # ============ CORS ============
 @bp.after_request
@@ -58,6 +64,10 @@ BANK_OWNER = os.getenv("BANK_OWNER", "Second-hand EV & Battery Trading Platform"
 
 VAT_RATE = float(os.getenv("VAT_RATE", "0.1"))
 PAYMENT_PUBLIC_BASE = os.getenv("PAYMENT_PUBLIC_BASE", "http://localhost:5008")
+# Thời gian giữ Idempotency-Key của POST /payment/create
+IDEMPOTENCY_TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# Thư mục lưu bản hợp đồng đã ký (mặc định: <instance>/contracts)
+CONTRACT_STORE_DIR = os.getenv("CONTRACT_STORE_DIR")
 
 
 # ============ UTILS ============
@@ -199,6 +209,98 @@ Ký/ghi rõ họ tên                                Đại diện nền tảng
     return contract
 
 
+def _contract_store_dir() -> str:
+    return CONTRACT_STORE_DIR or os.path.join(current_app.instance_path, "contracts")
+
+
+def _contract_document_path(sha256: str) -> str:
+    return os.path.join(_contract_store_dir(), sha256[:2], f"{sha256}.html")
+
+
+def _render_contract_document(contract: Contract, frozen_at: datetime) -> bytes:
+    """HTML bản hợp đồng (nội dung + chữ ký hiện có) tại thời điểm frozen_at."""
+
+    def _sig(label, sig_type, data, signed_at):
+        return {
+            "label": label,
+            "type": sig_type.value if sig_type else None,
+            "data": data,
+            "signed_at": signed_at.strftime("%d/%m/%Y %H:%M") if signed_at else None,
+        }
+
+    html = render_template(
+        "contract_document.html",
+        title=contract.title,
+        code=f"HD{contract.id:02d}",
+        created=contract.created_at.strftime("%d/%m/%Y %H:%M") if contract.created_at else "",
+        frozen_at=frozen_at.strftime("%d/%m/%Y %H:%M"),
+        content=contract.content or "",
+        signatures=[
+            _sig(
+                "BÊN MUA (Bên A)",
+                contract.buyer_signature_type,
+                contract.buyer_signature_data or contract.signer_name,
+                contract.buyer_signed_at or contract.signed_at,
+            ),
+            _sig(
+                "BÊN BÁN (Bên B)",
+                contract.seller_signature_type,
+                contract.seller_signature_data,
+                contract.seller_signed_at,
+            ),
+        ],
+    )
+    return html.encode("utf-8")
+
+
+def _store_contract_document(data: bytes) -> str:
+    """Ghi file theo sha256 nội dung (không ghi đè file đã có), trả về sha256."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = _contract_document_path(sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    return sha256
+
+
+def _freeze_contract_document(contract: Contract) -> str:
+    """
+    Render hợp đồng (nội dung + chữ ký hiện có) thành file HTML tĩnh, lưu theo sha256.
+    File đã ghi không bao giờ bị sửa: mỗi lần ký sinh một bản mới và
+    contract.document_sha256 trỏ tới bản mới nhất.
+    """
+    now = datetime.utcnow()
+    sha256 = _store_contract_document(_render_contract_document(contract, now))
+    contract.document_sha256 = sha256
+    contract.document_frozen_at = now
+    return sha256
+
+
+def _request_claims() -> dict | None:
+    """Claims của JWT trong header Authorization (gateway forward token phiên đăng nhập)."""
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    try:
+        return jwt.decode(auth.split(" ", 1)[1].strip(), JWT_SECRET, algorithms=[JWT_ALGO])
+    except Exception:
+        return None
+
+
+def _can_view_contract(contract: Contract, claims: dict | None) -> bool:
+    """Chỉ người mua, người bán của payment hoặc admin được xem bản hợp đồng đã ký."""
+    if not claims:
+        return False
+    if str(claims.get("role", "")).lower() == "admin":
+        return True
+    uid = _coerce_int(claims.get("sub") or claims.get("user_id") or claims.get("id"))
+    payment = db.session.get(Payment, contract.payment_id)
+    return uid is not None and payment is not None and uid in (payment.buyer_id, payment.seller_id)
+
+
 def _invoice_contract(payment: Payment) -> Contract | None:
     return next(
         (c for c in (payment.contracts or []) if c.contract_type == ContractType.INVOICE),
@@ -360,6 +462,56 @@ def _extract_buyer_id(data):
     return None
 
 
+def _create_response(payment: Payment) -> dict:
+    return {
+        "payment_id": payment.id,
+        "id": payment.id,
+        "order_id": payment.order_id,
+        "status": payment.status.value,
+        "amount": float(payment.amount),
+        "checkout_url": f"/payment/checkout/{payment.id}",
+    }
+
+
+def _replayed(body: dict, status: int):
+    resp = jsonify(body)
+    resp.status_code = status
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def _payment_item_rows(items, seller_id=None) -> list[PaymentItem]:
+    """Dòng payment_items từ items đã qua _normalize_items: mỗi item_id (số) một dòng,
+    item_id lặp lại thì cộng dồn quantity; seller của item mặc định là seller của payment."""
+    rows = {}
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        item_id = _coerce_int(item.get("item_id", item.get("id")))
+        if item_id is None:
+            continue
+        quantity = _coerce_int(item.get("quantity")) or 1
+        if item_id in rows:
+            rows[item_id].quantity += quantity
+            continue
+        rows[item_id] = PaymentItem(
+            item_id=item_id,
+            seller_id=_coerce_int(item.get("seller_id")) or seller_id,
+            price=_coerce_amount(item.get("price")) if item.get("price") is not None else None,
+            quantity=quantity,
+        )
+    return list(rows.values())
+
+
+def _find_idempotency_key(key: str) -> IdempotencyKey | None:
+    rec = IdempotencyKey.query.filter_by(key=key).first()
+    if rec and rec.created_at < datetime.utcnow() - IDEMPOTENCY_TTL:
+        db.session.delete(rec)
+        _commit()
+        return None
+    return rec
+
+
 def _extract_seller_id(data):
     cand = data.get("seller_id") or (data.get("seller") or {}).get("id")
     if cand is not None:
@@ -382,6 +534,19 @@ def health():
 @bp.post("/create")
 def create_payment():
     data = request.get_json(force=True) or {}
+
+    # Retry từ gateway/trình duyệt: trả lại đúng phản hồi 201 ban đầu, không insert thêm
+    idem_key = (request.headers.get("Idempotency-Key") or "").strip()[:128] or None
+    request_hash = hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    if idem_key:
+        rec = _find_idempotency_key(idem_key)
+        if rec:
+            if rec.request_hash != request_hash:
+                return jsonify({"error": "idempotency_key_reused"}), 422
+            return _replayed(rec.response, rec.status_code)
+
     buyer_id = _extract_buyer_id(data)
     seller_id = _extract_seller_id(data)
     amount = _coerce_amount(data.get("amount"))
@@ -452,6 +617,13 @@ def create_payment():
     except ValueError:
         return jsonify({"error": "invalid method", "raw": raw_method}), 400
 
+    # Không có key: (order_id, buyer_id) là khóa tự nhiên của một lần đặt hàng
+    existing = Payment.query.filter_by(
+        order_id=str(data["order_id"]), buyer_id=int(data["buyer_id"])
+    ).first()
+    if existing:
+        return _replayed(_create_response(existing), 201)
+
     try:
         payment = Payment(
             order_id=str(data["order_id"]),
@@ -462,8 +634,32 @@ def create_payment():
             method=method,
             provider=data.get("provider", "Manual"),
         )
+        payment.line_items = _payment_item_rows(data.get("items"), seller_id=payment.seller_id)
         db.session.add(payment)
+        if idem_key:
+            db.session.flush()
+            db.session.add(
+                IdempotencyKey(
+                    key=idem_key,
+                    request_hash=request_hash,
+                    payment_id=payment.id,
+                    status_code=201,
+                    response=_create_response(payment),
+                )
+            )
         _commit()
+    except IntegrityError:
+        # Request trùng chạy song song đã commit trước -> trả về bản ghi của nó
+        db.session.rollback()
+        rec = IdempotencyKey.query.filter_by(key=idem_key).first() if idem_key else None
+        if rec:
+            return _replayed(rec.response, rec.status_code)
+        existing = Payment.query.filter_by(
+            order_id=str(data["order_id"]), buyer_id=int(data["buyer_id"])
+        ).first()
+        if existing:
+            return _replayed(_create_response(existing), 201)
+        raise
     except Exception as e:
         # IN RA LOG SERVER CHO DỄ NHÌN
         import traceback, sys
@@ -484,19 +680,7 @@ def create_payment():
             }
         ), 500
 
-    return (
-        jsonify(
-            {
-                "payment_id": payment.id,
-                "id": payment.id,
-                "order_id": payment.order_id,
-                "status": payment.status.value,
-                "amount": float(payment.amount),
-                "checkout_url": f"/payment/checkout/{payment.id}",
-            }
-        ),
-        201,
-    )
+    return jsonify(_create_response(payment)), 201
 
 
 
@@ -522,6 +706,58 @@ def list_payments():
     return jsonify({"items": [_payment_json(p) for p in items]})
 
 
+@bp.get("/purchased")
+def purchased():
+    """buyer_id đã có payment PAID chứa item_id chưa (tra index payment_items, không duyệt JSON).
+
+    GET /payment/purchased?buyer_id=&item_id=[&seller_id=] -> {"purchased": bool, "payment_id": id|null}
+    Chỉ cho service nội bộ (reviews-service); gateway không proxy đường này ra ngoài,
+    trình duyệt dùng /payments/purchased của gateway (buyer lấy từ session).
+    """
+    buyer_id = request.args.get("buyer_id", type=int)
+    item_id = request.args.get("item_id", type=int)
+    seller_id = request.args.get("seller_id", type=int)
+    if buyer_id is None or item_id is None:
+        return jsonify({"error": "buyer_id and item_id are required"}), 400
+
+    query = (
+        db.session.query(Payment.id)
+        .join(PaymentItem, PaymentItem.payment_id == Payment.id)
+        .filter(
+            PaymentItem.item_id == item_id,
+            Payment.buyer_id == buyer_id,
+            Payment.status == PaymentStatus.PAID,
+        )
+    )
+    if seller_id is not None:
+        query = query.filter(Payment.seller_id == seller_id)
+    row = query.first()
+    return jsonify({"purchased": row is not None, "payment_id": row[0] if row else None})
+
+
+@bp.get("/items/<int:item_id>")
+def item_sales(item_id: int):
+    """Listing đã bán chưa / cho ai / doanh thu, tính từ payment_items của các payment PAID."""
+    rows = (
+        db.session.query(Payment.id, Payment.buyer_id, PaymentItem.seller_id, PaymentItem.price, PaymentItem.quantity)
+        .join(PaymentItem, PaymentItem.payment_id == Payment.id)
+        .filter(PaymentItem.item_id == item_id, Payment.status == PaymentStatus.PAID)
+        .order_by(Payment.id)
+        .all()
+    )
+    return jsonify(
+        {
+            "item_id": item_id,
+            "sold": bool(rows),
+            "payment_ids": [r.id for r in rows],
+            "buyer_ids": sorted({r.buyer_id for r in rows}),
+            "seller_ids": sorted({r.seller_id for r in rows if r.seller_id is not None}),
+            "quantity": sum(r.quantity or 0 for r in rows),
+            "revenue": float(sum((r.price or 0) * (r.quantity or 1) for r in rows)),
+        }
+    )
+
+
 @bp.get("/<int:payment_id>")
 def get_payment(payment_id: int):
     payment = Payment.query.get(payment_id)
@@ -594,8 +830,8 @@ def checkout_page(payment_id: int):
             payment.method = PaymentMethod(payload["method"])
         except (KeyError, ValueError):
             return (
-                render_template_string(
-                    _CHECKOUT_HTML,
+                render_template(
+                    "checkout.html",
                     payment=payment,
                     ui=_build_checkout_ui(payment),
                     error="Phương thức không hợp lệ",
@@ -609,8 +845,8 @@ def checkout_page(payment_id: int):
         # Chỉ cho phép banking
         if payment.method != PaymentMethod.BANKING:
             return (
-                render_template_string(
-                    _CHECKOUT_HTML,
+                render_template(
+                    "checkout.html",
                     payment=payment,
                     ui=_build_checkout_ui(payment),
                     error="Hiện chỉ hỗ trợ 'Chuyển khoản ngân hàng'. Vui lòng chọn lại phương thức này để tiếp tục.",
@@ -659,8 +895,8 @@ def checkout_page(payment_id: int):
         f"{BANK_NAME}|{BANK_ACCOUNT}|{BANK_OWNER}|{memo}|{int(total)}"
     )
 
-    return render_template_string(
-        _CHECKOUT_HTML,
+    return render_template(
+        "checkout.html",
         payment=payment,
         ui=ui,
         error=None,
@@ -671,291 +907,6 @@ def checkout_page(payment_id: int):
     )
 
 
-_CHECKOUT_HTML = r"""
-<!doctype html>
-<html lang="vi">
-<head>
-<meta charset="utf-8" />
-<meta name="viewport" content="width=device-width, initial-scale=1" />
-<title>Giỏ hàng • Đặt hàng — {{ ui.product_name }}</title>
-<style>
-  :root{--bg:#f7f7f9;--card:#fff;--line:#e5e7eb;--brand:#ff7a45;--accent:#16a34a;--muted:#64748b;--text:#111827}
-  *{box-sizing:border-box} html,body{margin:0;background:var(--bg);color:var(--text);font-family:ui-sans-serif,system-ui,Segoe UI,Roboto,Arial}
-  .wrap{max-width:1120px;margin:24px auto;padding:0 12px}
-  .grid{display:grid;grid-template-columns:1.2fr .8fr;gap:18px}
-  .card{background:var(--card);border:1px solid var(--line);border-radius:14px;box-shadow:0 8px 24px rgba(2,6,23,.05)}
-  .section{padding:16px 18px;border-bottom:1px solid var(--line)}
-  .section:last-child{border-bottom:none}
-  h2{font-size:18px;margin:0;display:flex;align-items:center;gap:8px}
-  .row{display:flex;align-items:center;gap:12px}
-  .item{display:flex;gap:12px;align-items:center}
-  .thumb{width:56px;height:56px;border-radius:10px;background:#f1f5f9;overflow:hidden;display:grid;place-items:center;font-size:12px;color:#94a3b8}
-  .thumb img{width:100%;height:100%;object-fit:cover}
-  .name{font-weight:700}
-  .muted{color:var(--muted);font-size:12px}
-
-  .pill{display:inline-flex;align-items:center;gap:6px;border:1px solid var(--line);padding:8px 10px;border-radius:12px;background:#fff;cursor:pointer}
-  .pill.active{border-color:#cbd5e1;background:#f8fafc}
-  .radio{width:14px;height:14px;border:2px solid #cbd5e1;border-radius:50%;display:inline-block;position:relative}
-  .pill.active .radio::after{content:"";position:absolute;top:3px;left:3px;width:6px;height:6px;border-radius:50%;background:var(--brand)}
-
-  .field{display:grid;gap:6px}
-  .label{font-size:12px;color:#475569}
-  .input,.textarea,select{width:100%;padding:10px 12px;border:1px solid var(--line);border-radius:10px;background:#fff;outline:none}
-  .textarea{min-height:84px;resize:vertical}
-  .input:focus,.textarea:focus,select:focus{border-color:#94a3b8}
-  .grid2{display:grid;grid-template-columns:1fr 1fr;gap:12px}
-  .grid3{display:grid;grid-template-columns:1fr 1fr 1fr;gap:12px}
-  .error{background:#fef2f2;border:1px solid #fecaca;color:#991b1b;padding:10px 12px;border-radius:10px;margin-top:8px}
-  .trust{display:flex;gap:10px;flex-wrap:wrap;margin-top:10px}
-  .seal{display:flex;align-items:center;gap:8px;border:1px solid var(--line);padding:8px 10px;border-radius:999px;background:#fff;font-size:12px;color:#334155}
-
-  .summary{padding:16px 18px}
-  .hr{height:1px;background:var(--line);margin:12px 0}
-  .total{display:flex;justify-content:space-between;font-weight:800;font-size:18px}
-  .btn{appearance:none;border:none;background:var(--brand);color:#fff;font-weight:700;border-radius:10px;padding:12px 14px;width:100%;cursor:pointer}
-  .btn:disabled{opacity:.6;cursor:not-allowed}
-  .safe{display:flex;align-items:center;gap:8px;color:#64748b;font-size:12px;margin-top:8px}
-  @media(max-width:980px){.grid{grid-template-columns:1fr}.grid2,.grid3{grid-template-columns:1fr}}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <div class="grid">
-
-    <!-- LEFT -->
-    <div class="col">
-      <div class="card">
-        <div class="section">
-          <h2>📅 Xác nhận đơn hàng</h2>
-        </div>
-        <div class="section">
-          <div class="item">
-            <div class="thumb">
-              {% if ui.product_img %}<img src="{{ ui.product_img }}" alt="product"/>{% else %} IMG {% endif %}
-            </div>
-            <div style="flex:1">
-              <div class="name">{{ ui.product_name }}</div>
-              <div class="muted">📍 {{ ui.province or '—' }}</div>
-            </div>
-            <div style="font-weight:700">{{ "{:,.0f}".format(ui.subtotal).replace(",", ".") }} đ</div>
-          </div>
-        </div>
-
-        <!-- PAYMENT METHOD -->
-        <div class="section">
-          <h2>💳 Phương thức thanh toán</h2>
-          <div style="margin-top:10px;display:grid;gap:10px">
-            {% for m in ui.methods %}
-            <label class="pill {% if ui.current_method==m.key %}active{% endif %}">
-              <span class="radio"></span>
-              <span style="font-size:18px">{{ m.icon }}</span>
-              <span style="font-weight:700">{{ m.label }}</span>
-              <span class="muted">— {{ m.desc }}</span>
-              <input type="radio" name="method_fake" value="{{ m.key }}" style="display:none" {% if ui.current_method==m.key %}checked{% endif %} />
-            </label>
-            {% endfor %}
-            <div class="muted">Chọn phương thức bằng cách nhấn vào ô trên (mặc định: ngân hàng).</div>
-          </div>
-        </div>
-
-        <!-- BUYER INFO -->
-        <div class="section">
-          <h2>🧑‍💼 Thông tin người mua</h2>
-          {% if error %}<div class="error">{{ error }}</div>{% endif %}
-
-          <div class="grid2" style="margin-top:10px">
-            <div class="field">
-              <label class="label">Họ và tên *</label>
-              <input class="input" name="full_name" form="orderForm" placeholder="Ví dụ: Nguyễn Văn A" required>
-            </div>
-            <div class="field">
-              <label class="label">Số điện thoại *</label>
-              <input class="input" name="phone" form="orderForm" placeholder="09xxxxxxxx" required pattern="^0[0-9]{9,10}$" title="Bắt đầu bằng 0, 10-11 số">
-            </div>
-          </div>
-
-          <div class="grid2" style="margin-top:10px">
-            <div class="field">
-              <label class="label">Email</label>
-              <input class="input" type="email" name="email" form="orderForm" placeholder="you@example.com">
-            </div>
-            <div class="field">
-              <label class="label">Ngày sinh</label>
-              <input class="input" type="date" name="dob" form="orderForm">
-            </div>
-          </div>
-
-          <div class="grid2" style="margin-top:10px">
-            <div class="field">
-              <label class="label">CCCD/CMND</label>
-              <input class="input" name="id_number" form="orderForm" placeholder="12 số" pattern="^[0-9]{9,12}$">
-            </div>
-            <div class="field">
-              <label class="label">Địa chỉ</label>
-              <input class="input" name="address" form="orderForm" placeholder="Số nhà, đường, phường/xã, quận/huyện">
-            </div>
-          </div>
-
-          <div class="grid3" style="margin-top:10px">
-            <div class="field">
-              <label class="label">Tỉnh/Thành</label>
-              <input class="input" name="province" form="orderForm" placeholder="VD: TP.HCM">
-            </div>
-            <div class="field">
-              <label class="label">Quận/Huyện</label>
-              <input class="input" name="district" form="orderForm" placeholder="VD: Quận 1">
-            </div>
-            <div class="field">
-              <label class="label">Phường/Xã</label>
-              <input class="input" name="ward" form="orderForm" placeholder="VD: Bến Nghé">
-            </div>
-          </div>
-
-          <div style="margin-top:14px">
-            <label style="display:flex;gap:8px;align-items:center">
-              <input type="checkbox" name="is_company_invoice" form="orderForm" id="ckCompany">
-              <span>Xuất hóa đơn công ty (VAT)</span>
-            </label>
-          </div>
-
-          <div id="companyBox" style="display:none;margin-top:10px">
-            <div class="grid2">
-              <div class="field">
-                <label class="label">Tên công ty</label>
-                <input class="input" name="company_name" form="orderForm" placeholder="Công ty TNHH ABC">
-              </div>
-              <div class="field">
-                <label class="label">Mã số thuế</label>
-                <input class="input" name="tax_code" form="orderForm" placeholder="MST">
-              </div>
-            </div>
-            <div class="field" style="margin-top:10px">
-              <label class="label">Địa chỉ công ty</label>
-              <input class="input" name="company_address" form="orderForm" placeholder="Địa chỉ in trên hóa đơn">
-            </div>
-          </div>
-
-          <div class="field" style="margin-top:10px">
-            <label class="label">Ghi chú cho người bán</label>
-            <textarea class="textarea" name="note" form="orderForm" placeholder="Thời gian nhận hàng, lưu ý xuất hóa đơn..."></textarea>
-          </div>
-
-          <!-- Hidden gửi kèm -->
-          <input type="hidden" name="product_name" value="{{ ui.product_name }}" form="orderForm">
-          <input type="hidden" name="method" id="methodField" value="{{ ui.current_method }}" form="orderForm">
-
-          <div class="safe">Bằng việc đặt hàng, bạn đồng ý với <a href="#" onclick="return false;">Chính sách bảo mật</a> & <a href="#" onclick="return false;">Điều khoản</a>.</div>
-        </div>
-      </div>
-    </div>
-
-    <!-- RIGHT -->
-    <div class="col">
-      <form id="orderForm" class="card" method="post" action="">
-        <div class="section">
-          <h2>🧾 Tóm tắt đơn hàng</h2>
-        </div>
-        <div class="summary">
-          <div class="row" style="justify-content:space-between">
-            <span class="muted">Tạm tính ({{ ui.qty }} sản phẩm)</span>
-            <span>{{ "{:,.0f}".format(ui.subtotal).replace(",", ".") }} đ</span>
-          </div>
-          <div class="row" style="justify-content:space-between;margin-top:6px">
-            <span class="muted">Phí vận chuyển</span>
-            <span style="color:#16a34a">Miễn phí</span>
-          </div>
-          <div class="hr"></div>
-          <div class="total">
-            <span>Tổng thanh toán</span>
-            <span style="color:#ef4444">{{ "{:,.0f}".format(ui.total).replace(",", ".") }} đ</span>
-          </div>
-
-          <div style="margin-top:12px">
-            <div style="margin-bottom:8px;text-align:center">
-              <div style="display:inline-block;border:1px dashed var(--line);border-radius:10px;padding:8px;background:#fff">
-                <img id="qrImg" src="https://img.vietqr.io/image/mbbank-0359506148-compact2.jpg?amount={{ ui.total|int }}&addInfo={{ ('PAY' ~ payment.id ~ '-ORD' ~ payment.order_id) | urlencode }}&accountName={{ bank_owner | urlencode }}" alt="QR" width="140" height="140" loading="eager"/>
-              </div>
-              <div class="small" style="margin-top:8px">{{ bank_owner }}</div>
-            </div>
-            <button class="btn" type="submit" onclick="return onSubmit()">Đặt hàng ngay</button>
-            <div class="safe">🔒 Thanh toán an toàn & bảo mật</div>
-            <div id="methodWarn" class="safe" style="display:none">⚠️ Vui lòng chọn “Chuyển khoản ngân hàng” để tiếp tục đặt hàng.</div>
-          </div>
-        </div>
-      </form>
-    </div>
-
-  </div>
-</div>
-
-<script>
-  const submitBtn = document.querySelector('button.btn[type=submit]');
-  const warn = document.getElementById('methodWarn');
-  const methodField = document.getElementById('methodField');
-
-  function selectedMethod(){
-    const checked = document.querySelector('input[name=method_fake]:checked');
-    return checked ? checked.value : (methodField ? methodField.value : '');
-  }
-
-  function setSubmitEnabled(enabled){
-    if (!submitBtn) return;
-    submitBtn.disabled = !enabled;
-    if (warn) warn.style.display = enabled ? 'none' : 'block';
-  }
-
-  function syncMethodToForm(){
-    const m = selectedMethod();
-    if (methodField) methodField.value = m;
-  }
-
-  function reevaluateMethod(){
-    syncMethodToForm();
-    // Chỉ cho phép khi là 'banking'
-    const ok = selectedMethod() === 'banking';
-    setSubmitEnabled(ok);
-  }
-
-  // init: gắn sự kiện lên các "pill"
-  document.querySelectorAll('.pill').forEach(l => {
-    l.addEventListener('click', () => {
-      document.querySelectorAll('.pill').forEach(x=>x.classList.remove('active'));
-      l.classList.add('active');
-      const radio = l.querySelector('input[type=radio]');
-      if (radio) radio.checked = true;
-      reevaluateMethod();
-    });
-  });
-
-  // toggle HĐ công ty
-  const ck = document.getElementById('ckCompany');
-  const box = document.getElementById('companyBox');
-  if (ck) ck.addEventListener('change', ()=> box.style.display = ck.checked ? 'block':'none');
-
-  function onSubmit(){
-    reevaluateMethod();
-    const name = document.querySelector('input[name=full_name]');
-    const phone = document.querySelector('input[name=phone]');
-    if (selectedMethod() !== 'banking'){
-      alert('Hiện chỉ hỗ trợ “Chuyển khoản ngân hàng”. Vui lòng chọn lại.');
-      return false;
-    }
-    if (!name.value.trim() || !phone.checkValidity()){
-      alert('Vui lòng nhập Họ tên và SĐT hợp lệ');
-      return false;
-    }
-    return true;
-  }
-
-  // chạy lần đầu khi trang load
-  reevaluateMethod();
-</script>
-</body>
-</html>
-"""
-
-
 # ============ CONFIRM -> CREATE INVOICE ============
 @bp.post("/confirm/<int:payment_id>")
 def confirm_payment(payment_id: int):
@@ -1133,6 +1084,7 @@ def sign_contract():
     contract.signer_name = signer_name
     contract.signature_jwt = token
     contract.signed_at = datetime.utcnow()
+    _freeze_contract_document(contract)
     _commit()
     return jsonify({"message": "signed", "signature_jwt": token})
 
@@ -1174,6 +1126,7 @@ def sign_contract_v2(contract_id: int):
         contract.contract_status = ContractStatus.SIGNED
         contract.signed_at = now
 
+    _freeze_contract_document(contract)
     _commit()
     return jsonify(
         {
@@ -1184,10 +1137,56 @@ def sign_contract_v2(contract_id: int):
             else "draft",
             "buyer_signed": bool(contract.buyer_signed_at),
             "seller_signed": bool(contract.seller_signed_at),
+            "document_sha256": contract.document_sha256,
+            "document_url": f"/payment/contract/document/{contract.id}",
         }
     )
 
 
+@bp.get("/contract/document/<int:contract_id>")
+def contract_document(contract_id: int):
+    """
+    Trả bản hợp đồng đã chốt lúc ký, đọc thẳng từ đĩa (chỉ render lại khi file bị mất).
+    ETag = sha256 nội dung nên client chỉ tải lại khi có chữ ký mới; hỗ trợ Range.
+    Cần JWT của người mua / người bán / admin (gateway forward token phiên đăng nhập).
+    """
+    claims = _request_claims()
+    if not claims:
+        return jsonify({"error": "unauthorized"}), 401
+    contract = Contract.query.get(contract_id)
+    if not contract:
+        return jsonify({"error": "not_found"}), 404
+    if not _can_view_contract(contract, claims):
+        return jsonify({"error": "forbidden"}), 403
+    if not contract.document_sha256:
+        return jsonify({"error": "not_signed"}), 404
+
+    path = _contract_document_path(contract.document_sha256)
+    if not os.path.exists(path):
+        # File mất (volume mới, chuyển máy...): dựng lại từ nội dung + chữ ký trong DB với
+        # cùng thời điểm chốt. Chỉ phục vụ nếu ra đúng sha256 đã ký; document_sha256 không
+        # bao giờ bị đổi sau khi chốt, bản render khác (template đổi...) không được lưu.
+        data = _render_contract_document(contract, contract.document_frozen_at or datetime.utcnow())
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 != contract.document_sha256:
+            current_app.logger.error(
+                "contract %s: signed document %s missing, re-render gives %s (template changed?)",
+                contract.id, contract.document_sha256, sha256,
+            )
+            return jsonify({"error": "document_missing"}), 410
+        _store_contract_document(data)
+
+    resp = send_file(
+        path,
+        mimetype="text/html",
+        conditional=True,
+        etag=contract.document_sha256,
+        download_name=f"HD{contract.id:02d}.html",
+    )
+    resp.headers["X-Content-SHA256"] = contract.document_sha256
+    return resp
+
+
 @bp.get("/contract/view/<int:contract_id>")
 def view_contract(contract_id: int):
     contract = Contract.query.get(contract_id)
@@ -1219,6 +1218,10 @@ def view_contract(contract_id: int):
                 contract.created_at.isoformat() if contract.created_at else None
             ),
             "contract_code": f"HD{contract.id}",
+            "document_sha256": contract.document_sha256,
+            "document_url": f"/payment/contract/document/{contract.id}"
+            if contract.document_sha256
+            else None,
             "buyer_signature_type": contract.buyer_signature_type.value
             if contract.buyer_signature_type
             else None,
@@ -1301,232 +1304,8 @@ def invoice_page(contract_id: int):
         "".join([w[0] for w in BANK_NAME.split()[:2]]).upper() or "BK"
     )
 
-    html = r"""
-<!doctype html>
-<html lang="vi">
-<head>
-<meta charset="utf-8" />
-<meta name="viewport" content="width=device-width, initial-scale=1" />
-<title>THANH TOÁN ĐƠN HÀNG — {{ payment.order_id }}</title>
-<style>
-  :root{
-    --bg:#f5f7fb;--card:#fff;--line:#e5e7eb;--muted:#64748b;--text:#0f172a;
-    --brand1:#6b8cff;--brand2:#7b5cff;--accent:#ef4444;--ok:#16a34a;--warn:#f59e0b;
-  }
-  *{box-sizing:border-box}
-  html,body{margin:0;background:var(--bg);color:var(--text);font-family:ui-sans-serif,system-ui,Segoe UI,Roboto,Arial}
-  .wrap{max-width:760px;margin:28px auto;padding:0 12px}
-  .card{background:var(--card);border:1px solid var(--line);border-radius:14px;box-shadow:0 10px 28px rgba(2,6,23,.06);overflow:hidden}
-  .header{padding:18px 20px;background:linear-gradient(135deg,var(--brand1),var(--brand2));color:#fff;text-align:center}
-  .title{font-weight:800;letter-spacing:.5px}
-  .sub{opacity:.9;font-size:12px;margin-top:4px}
-  .badges{display:flex;gap:8px;justify-content:center;margin-top:10px;flex-wrap:wrap}
-  .badge{background:#ffffff22;border:1px solid #ffffff44;color:#fff;padding:6px 10px;border-radius:999px;font-size:12px;backdrop-filter:blur(2px)}
-  .body{padding:18px 20px}
-  .totalbox{border:1px solid var(--line);border-radius:12px;background:#fff;box-shadow:inset 0 1px 0 #fff}
-  .totalhead{padding:12px 14px;border-bottom:1px dashed var(--line);text-align:center;background:#fff}
-  .totalval{padding:16px 14px;text-align:center;font-size:28px;font-weight:900;color:var(--accent)}
-  .totalnote{padding:0 0 6px 0;text-align:center;font-size:12px;color:#6b7280}
-  .section{margin-top:14px}
-  .callout{background:#f1f5ff;border:1px solid #dbe3ff;border-radius:12px;padding:12px 14px;color:#304073}
-  .callout ol{margin:6px 0 0 16px;padding:0}
-  .center{display:flex;justify-content:center}
-  .qrwrap{margin-top:14px;border:1px solid var(--line);border-radius:12px;padding:16px 14px;background:#fff}
-  .qrhead{display:flex;align-items:center;gap:8px;justify-content:center;color:#475569;font-weight:700}
-  .vietqr{width:72px;height:20px;background:url('https://upload.wikimedia.org/wikipedia/commons/6/6b/VietQR_logo.svg') center/contain no-repeat;filter:grayscale(0)}
-  .qrgrid{display:grid;grid-template-columns:160px 1fr;gap:16px;margin-top:10px}
-  .qrbox{width:160px;height:160px;border:1px dashed var(--line);border-radius:10px;display:grid;place-items:center;overflow:hidden}
-  .kv{display:grid;grid-template-columns:140px 1fr;gap:6px 10px;font-size:14px}
-  .kv .k{color:#475569}
-  .note{margin-top:14px;background:#fff7ed;border:1px solid #fed7aa;color:#7c2d12;padding:10px 12px;border-radius:10px;font-size:13px}
-  .foot{display:flex;gap:10px;justify-content:flex-end;margin-top:14px}
-  .btn{appearance:none;border:1px solid var(--line);background:#fff;border-radius:10px;padding:10px 14px;font-weight:700;cursor:pointer}
-  .btn.primary{background:#16a34a;color:#fff;border-color:#16a34a}
-  .btn.ghost{background:transparent}
-  .small{font-size:12px;color:var(--muted)}
-  @media (max-width:720px){.qrgrid{grid-template-columns:1fr}.kv{grid-template-columns:120px 1fr}}
-  @media print{.foot{display:none}.card{border:none;box-shadow:none;border-radius:0}}
-  .btn.disabled{opacity:.5;pointer-events:none}
-  .contract-doc{
-    font-family: ui-serif, Georgia, "Times New Roman", serif;
-    line-height:1.7;font-size:14px;color:#0f172a;
-    background:#fff;border:1px solid #e5e7eb;border-radius:12px;
-    padding:14px;max-height:65vh;overflow:auto
-  }
-  .contract-doc pre{white-space:pre-wrap;margin:0}
-  .modal-backdrop{
-    display:none;position:fixed;inset:0;background:rgba(15,23,42,.35);
-    backdrop-filter:blur(4px);z-index:40;align-items:center;justify-content:center
-  }
-  .modal{
-    background:#fff;border-radius:14px;max-width:780px;width:92%;
-    max-height:90vh;display:flex;flex-direction:column;box-shadow:0 20px 50px rgba(15,23,42,.4)
-  }
-  .modal-head,.modal-foot{padding:10px 14px;border-bottom:1px solid #e5e7eb;display:flex;justify-content:space-between;align-items:center}
-  .modal-foot{border-top:1px solid #e5e7eb;border-bottom:none}
-  .modal-body{padding:12px 14px;overflow:auto}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <div class="card">
-    <!-- HEADER -->
-    <div class="header">
-      <div class="title">🧾 THANH TOÁN ĐƠN HÀNG</div>
-      <div class="sub">Mã đơn hàng: <b>{{ payment.order_id }}</b></div>
-      <div class="badges">
-        <span class="badge">Hợp đồng: {{ sale_code }}</span>
-        <span class="badge">Trạng thái: {{ payment.status.value|upper }}</span>
-      </div>
-    </div>
-
-    <!-- BODY -->
-    <div class="body">
-
-      <!-- TỔNG THANH TOÁN -->
-      <div class="totalbox">
-        <div class="totalhead">Tổng thanh toán</div>
-        <div class="totalval">{{ "{:,.0f}".format(total).replace(",", ".") }} đ</div>
-        <div class="totalnote">Nội dung CK: {{ info.get('product_name') or ("Đơn hàng " ~ payment.order_id) }}</div>
-      </div>
-
-      <!-- HƯỚNG DẪN -->
-      <div class="section callout">
-        <b>📘 Hướng dẫn thanh toán</b>
-        <ol>
-          <li>Mở ứng dụng ngân hàng có tính năng quét QR Code.</li>
-          <li>Chọn <b>“Quét mã QR”</b> và quét mã bên dưới.</li>
-          <li>Kiểm tra <b>Ngân hàng / Số TK / Số tiền / Nội dung</b>.</li>
-          <li>Xác nhận chuyển tiền, sau đó quay lại trang này.</li>
-          <li>Nhấn nút <b>“Đã chuyển tiền – kiểm tra”</b>.</li>
-        </ol>
-      </div>
-
-      <!-- QR + THÔNG TIN NGÂN HÀNG -->
-      <div class="section qrwrap">
-        <div class="qrhead">🔎 Second-hand EV &amp; Battery Trading Platform <span class="vietqr" aria-label="VietQR"></span></div>
-        <div class="qrgrid">
-          <div class="center">
-            <div class="qrbox">
-              <img id="qrImg" src="https://img.vietqr.io/image/mbbank-0359506148-compact2.jpg?amount={{ total|int }}&addInfo={{ memo | urlencode }}&accountName={{ bank_owner | urlencode }}" alt="QR" width="160" height="160" loading="eager"/>
-            </div>
-          </div>
-          <div class="kv">
-            <div class="k">Ngân hàng</div><div><b>{{ bank_name }}</b></div>
-            <div class="k">Số tài khoản</div><div><b>{{ bank_account }}</b></div>
-            <div class="k">Chủ tài khoản</div><div><b>{{ bank_owner }}</b></div>
-            <div class="k">Số tiền</div><div><b>{{ "{:,.0f}".format(total).replace(",", ".") }} đ</b></div>
-            <div class="k">Nội dung chuyển khoản</div><div><b id="memo">{{ memo }}</b></div>
-            <div class="k">Sản phẩm/ghi chú</div><div>{{ info.get('product_name') or ("Thanh toán đơn " ~ payment.order_id) }}</div>
-          </div>
-        </div>
-      </div>
-
-      <!-- HỢP ĐỒNG MUA BÁN -->
-      <div class="section" style="margin-top:14px">
-        <div style="background:linear-gradient(135deg,#6b8cff,#7b5cff);color:#fff;border-radius:12px 12px 0 0;padding:10px 14px;font-weight:800;">
-          📄 HỢP ĐỒNG MUA BÁN
-        </div>
-        <div style="border:1px solid var(--line);border-top:none;border-radius:0 0 12px 12px;padding:12px 14px;background:#fff">
-          <div style="display:flex;gap:10px;flex-wrap:wrap;margin-bottom:8px">
-            <span class="badge">Mã HĐ: {{ sale_code }}</span>
-            <span class="badge">Trạng thái: {{ sale_status|upper }}</span>
-            <span class="badge" style="background:#16a34a22;border-color:#16a34a55;color:#14532d">
-              Người mua: {{ 'ĐÃ KÝ' if buyer_signed else 'CHƯA KÝ' }}
-            </span>
-            <span class="badge" style="background:#f59e0b22;border-color:#f59e0b55;color:#7c2d12">
-              Người bán: {{ 'ĐÃ KÝ' if seller_signed else 'CHƯA KÝ' }}
-            </span>
-          </div>
-
-          {% if sale_id %}
-            <div style="display:flex;gap:10px;flex-wrap:wrap">
-              <button type="button" class="btn ghost" onclick="openContract()">Xem hợp đồng</button>
-            </div>
-          {% else %}
-            <div class="small">Hợp đồng sẽ được tạo tự động sau khi lập hóa đơn.</div>
-          {% endif %}
-        </div>
-      </div>
-
-      <!-- Modal HỢP ĐỒNG -->
-      <div id="contractModal" class="modal-backdrop">
-        <div class="modal" role="dialog" aria-modal="true" aria-label="Nội dung hợp đồng">
-          <div class="modal-head">
-            <div style="font-weight:800">📄 Nội dung hợp đồng</div>
-            <button class="btn" onclick="closeContract()">Đóng</button>
-          </div>
-          <div class="modal-body">
-            <div class="contract-doc">
-              <pre>{{ sale_content }}</pre>
-            </div>
-          </div>
-          <div class="modal-foot">
-            {% if sale_id %}
-              {% if buyer_signed %}
-                <button class="btn primary disabled" aria-disabled="true" title="Bạn đã ký hợp đồng">Đã ký</button>
-              {% else %}
-                <a class="btn primary" href="/payment/contract/sign/{{ sale_id }}">Ký hợp đồng</a>
-              {% endif %}
-            {% endif %}
-            <button class="btn" onclick="closeContract()">Đóng</button>
-          </div>
-        </div>
-      </div>
-
-      <!-- CẢNH BÁO -->
-      <div class="note">
-        ⚠️ <b>Lưu ý quan trọng:</b> Vui lòng <u>KHÔNG thay đổi</u> số tiền hoặc nội dung chuyển khoản để hệ thống đối soát nhanh.
-        Sau khi chuyển thành công, hãy bấm “Đã chuyển tiền – kiểm tra”.
-      </div>
-
-      <!-- ACTIONS -->
-      <div class="foot">
-        <button class="btn" onclick="window.print()">In hóa đơn</button>
-        <button class="btn primary" onclick="checkStatus()">Đã chuyển tiền – kiểm tra</button>
-      </div>
-
-      <div class="small">Người mua: <b>{{ buyer_name }}</b> • Tạo lúc {{ payment.created_at.strftime('%d/%m/%Y %H:%M') if payment.created_at else '' }}</div>
-    </div>
-  </div>
-</div>
-
-<script>
-let _pollTimer = null;
-
-function openContract(){ const m=document.getElementById('contractModal'); if(m){m.style.display='flex';} }
-function closeContract(){ const m=document.getElementById('contractModal'); if(m){m.style.display='none';} }
-document.addEventListener('click',e=>{ const m=document.getElementById('contractModal'); if(e.target===m) closeContract(); });
-
-async function _checkAndMaybeRedirect(){
-  const r = await fetch('/payment/status/{{ payment.id }}');
-  const d = await r.json();
-  const st = String(d.status || '').toLowerCase();
-  console.log("Trạng thái đơn:", st);
-
-  if (st === 'paid') {
-    if (_pollTimer) clearInterval(_pollTimer);
-    location.href = '/payment/thankyou/{{ payment.id }}';
-    return true;
-  }
-  return false;
-}
-
-async function checkStatus(){
-  const ok = await _checkAndMaybeRedirect();
-  if (ok) return;
-
-  alert('Trạng thái đơn: pending (đang chờ duyệt)');
-  if (!_pollTimer){
-    _pollTimer = setInterval(_checkAndMaybeRedirect, 5000);
-  }
-}
-</script>
-</body>
-</html>
-"""
-    return render_template_string(
-        html,
+    return render_template(
+        "invoice.html",
         payment=payment,
         info=info,
         confirmed=confirmed,
@@ -1547,6 +1326,11 @@ async function checkStatus(){
         seller_signed=seller_signed,
         sale_status=sale_status,
         sale_content=(sale.content if sale else ""),
+        sale_document_url=(
+            f"/payment/contract/document/{sale.id}"
+            if sale and sale.document_sha256
+            else None
+        ),
         seller_net=seller_net,
     )
 
@@ -1627,30 +1411,24 @@ def admin_reports():
             }
         )
 
-    # ===== Enrich buyer_name / seller_name từ auth-service (giữ nguyên logic cũ) =====
+    # ===== Enrich buyer_name / seller_name từ auth-service (1 lần gọi /auth/users/bulk) =====
     try:
         import requests
 
-        ADMIN_TOKEN = (
-            os.getenv("ADMIN_TOKEN")
-            or os.getenv("GATEWAY_ADMIN_TOKEN")
-            or os.getenv("ADMIN_TOKEN_FALLBACK")
-        )
         AUTH_URL = os.getenv("AUTH_URL", "http://auth_service:5001")
-        headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"} if ADMIN_TOKEN else {}
+        user_ids = sorted(
+            {int(x) for it in out for x in (it.get("buyer_id"), it.get("seller_id")) if x is not None}
+        )
         user_map = {}
-        if headers:
-            ur = requests.get(f"{AUTH_URL}/auth/admin/users", headers=headers, timeout=5)
+        for start in range(0, len(user_ids), 200):
+            ur = requests.post(
+                f"{AUTH_URL}/auth/users/bulk", json={"ids": user_ids[start:start + 200]}, timeout=5
+            )
             if ur.ok and ur.headers.get("content-type", "").startswith("application/json"):
-                udata = ur.json().get("data", [])
-                for u in udata:
-                    try:
-                        uid = int(u.get("id"))
-                    except Exception:
-                        continue
+                for u in ur.json().get("users", []):
                     name = u.get("full_name") or u.get("username") or u.get("email")
                     if name:
-                        user_map[uid] = name
+                        user_map[int(u["id"])] = name
         if user_map:
             for it in out:
                 bid = it.get("buyer_id")
@@ -1692,9 +1470,13 @@ def admin_approve(pid):
     p = Payment.query.get(pid)
     if not p:
         return jsonify({"error": "not_found"}), 404
-    p.status = PaymentStatus.PAID
-    p.updated_at = datetime.utcnow()
-    _commit()
+    if p.status != PaymentStatus.PAID:
+        p.status = PaymentStatus.PAID
+        p.updated_at = datetime.utcnow()
+        # Đánh dấu listing đã bán qua outbox: ghi cùng transaction, gửi ở thread nền.
+        outbox.enqueue_listing_events(outbox.MARK_SOLD, p)
+        _commit()
+        outbox.notify()
     return jsonify({"message": "approved", "id": p.id})
 
 
@@ -1703,9 +1485,14 @@ def admin_reject(pid):
     p = Payment.query.get(pid)
     if not p:
         return jsonify({"error": "not_found"}), 404
+    was_paid = p.status == PaymentStatus.PAID
     p.status = PaymentStatus.CANCELED
     p.updated_at = datetime.utcnow()
+    if was_paid:
+        outbox.enqueue_listing_events(outbox.MARK_AVAILABLE, p)
     _commit()
+    if was_paid:
+        outbox.notify()
     return jsonify({"message": "rejected", "id": p.id})
 
 
@@ -1753,142 +1540,11 @@ def sign_contract_page(contract_id: int):
     created = c.created_at.strftime("%d/%m/%Y %H:%M") if c.created_at else ""
     buyer_already_signed = bool(getattr(c, "buyer_signed_at", None))
 
-    html = r"""
-<!doctype html>
-<html lang="vi">
-<head>
-<meta charset="utf-8"/><meta name="viewport" content="width=device-width, initial-scale=1"/>
-<title>HỢP ĐỒNG MUA BÁN ĐIỆN TỬ</title>
-<style>
-  :root{--bg:#f5f7fb;--card:#fff;--line:#e5e7eb;--muted:#64748b;--text:#0f172a;--header:#6b8cff;--cta:#7c3aed}
-  *{box-sizing:border-box} html,body{margin:0;background:var(--bg);color:var(--text);font-family:ui-sans-serif,system-ui,Segoe UI,Roboto,Arial}
-  .wrap{max-width:900px;margin:20px auto;padding:0 12px}
-  .card{background:#fff;border:1px solid var(--line);border-radius:14px;box-shadow:0 8px 24px rgba(2,6,23,.06);overflow:hidden}
-  .head{padding:14px 16px;background:linear-gradient(135deg,#6b8cff,#7b5cff);color:#fff}
-  .title{font-weight:800} .sub{opacity:.9;font-size:12px;margin-top:4px}
-  .body{padding:16px}
-  textarea.contract{width:100%;min-height:320px;border:1px solid var(--line);border-radius:12px;padding:12px;font-family:ui-monospace,Consolas,monospace;white-space:pre-wrap}
-  .sigbox{border:1px dashed var(--line);border-radius:12px;padding:12px;margin-top:12px;background:#fbfaff}
-  .grid{display:grid;grid-template-columns:1fr 1fr;gap:12px}
-  .field{display:grid;gap:6px} .label{font-size:12px;color:#475569}
-  .input{padding:10px 12px;border:1px solid var(--line);border-radius:10px}
-  .btn{appearance:none;border:none;border-radius:10px;padding:12px 14px;font-weight:800;cursor:pointer}
-  .btn.cta{background:#7c3aed;color:#fff;width:100%}
-  .row{display:flex;gap:10px;align-items:center;flex-wrap:wrap}
-  .muted{color:var(--muted);font-size:12px}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <div class="card">
-    <div class="head">
-      <div class="title">🖊️ HỢP ĐỒNG MUA BÁN ĐIỆN TỬ</div>
-      <div class="sub">Mã hợp đồng: <b>{{ code }}</b> • Tạo lúc {{ created }}</div>
-    </div>
-    <div class="body">
-      <!-- Nội dung hợp đồng -->
-      <textarea class="contract" readonly>{{ content }}</textarea>
-
-      <!-- Khối chữ ký -->
-      <div class="sigbox">
-        <div class="grid">
-          <div class="field">
-            <label class="label">Chữ ký người mua (tải ảnh)</label>
-            <input class="input" type="file" id="sigImg" accept="image/*">
-            <div class="muted">Hoặc bạn có thể ký bằng text ở khung bên phải.</div>
-          </div>
-          <div class="field">
-            <label class="label">Chữ ký người mua (text)</label>
-            <input class="input" type="text" id="sigText" placeholder="Nhập họ tên viết tay/kiểu chữ ký">
-          </div>
-        </div>
-
-        <div class="grid" style="margin-top:12px">
-          <div class="field">
-            <label class="label">Họ và tên đầy đủ *</label>
-            <input class="input" type="text" id="fullName" placeholder="Ví dụ: Nguyễn Văn A" required>
-          </div>
-          <div class="field">
-            <label class="label">Xác nhận</label>
-            <label class="row"><input type="checkbox" id="agree"> <span>Tôi đã đọc, hiểu và đồng ý toàn bộ nội dung hợp đồng.</span></label>
-          </div>
-        </div>
-
-        <div style="margin-top:14px">
-          <button class="btn cta" onclick="submitSign()" {% if buyer_already_signed %}disabled{% endif %}>
-            ✅ XÁC NHẬN KÝ HỢP ĐỒNG
-          </button>
-          <div id="msg" class="muted" style="margin-top:8px"></div>
-        </div>
-      </div>
-
-      <div class="row" style="margin-top:12px">
-        <a class="muted" href="/payment/invoice/{{ invoice_id }}">← Quay lại hoá đơn</a>
-      </div>
-    </div>
-  </div>
-</div>
-
-<script>
-async function submitSign(){
-  const agree = document.getElementById('agree').checked;
-  const fullName = document.getElementById('fullName').value.trim();
-  const sigText = document.getElementById('sigText').value.trim();
-  const sigImg = document.getElementById('sigImg').files[0];
-  const msg = document.getElementById('msg');
-  msg.textContent = '';
-
-  if (!agree){ msg.textContent = 'Vui lòng tick xác nhận đã đọc và đồng ý.'; return; }
-  if (!fullName){ msg.textContent = 'Vui lòng nhập Họ và tên đầy đủ.'; return; }
-
-  let signature_type = 'text';
-  let signature_data = sigText;
-  if (sigImg){
-    const b64 = await toBase64(sigImg);
-    signature_type = 'image';
-    signature_data = b64;
-  } else if (!sigText){
-    msg.textContent = 'Vui lòng tải ảnh chữ ký hoặc nhập chữ ký dạng text.'; return;
-  }
-
-  const payload = {
-    signer_role: 'buyer',
-    signature_type,
-    signature_data
-  };
-
-  const r = await fetch('/payment/contract/sign/{{ contract_id }}', {
-    method:'POST',
-    headers:{'Content-Type':'application/json'},
-    body: JSON.stringify(payload)
-  });
-  const d = await r.json();
-
-  if (!r.ok){
-    msg.textContent = 'Lỗi ký hợp đồng: ' + (d.error || r.status);
-    return;
-  }
-  msg.textContent = 'Đã ghi nhận chữ ký. Bạn có thể quay lại hoá đơn để thanh toán hoặc chờ người bán ký.';
-  setTimeout(()=>{ window.location.href = '/payment/invoice/{{ invoice_id }}'; }, 800);
-}
-
-function toBase64(file){
-  return new Promise((resolve,reject)=>{
-    const reader = new FileReader();
-    reader.onload = () => resolve(reader.result);
-    reader.onerror = reject;
-    reader.readAsDataURL(file);
-  });
-}
-</script>
-</body>
-</html>
-"""
     inv = Contract.query.filter_by(
         payment_id=c.payment_id, contract_type=ContractType.INVOICE
     ).first()
-    return render_template_string(
-        html,
+    return render_template(
+        "sign_contract.html",
         content=c.content or "",
         code=code,
         created=created,
@@ -1917,74 +1573,8 @@ def thankyou_page(payment_id: int):
     sale_code = f"H{sale.id:03d}" if sale else "—"
     amount = float(p.amount or 0)
 
-    html = r"""
-<!doctype html>
-<html lang="vi">
-<head>
-<meta charset="utf-8"/>
-<meta name="viewport" content="width=device-width, initial-scale=1"/>
-<title>Cảm ơn — EV Trading</title>
-<style>
-  :root{--bg:#f6f8fb;--card:#fff;--line:#e5e7eb;--ok:#16a34a;--muted:#64748b;--text:#0f172a}
-  *{box-sizing:border-box} html,body{margin:0;background:var(--bg);color:var(--text);font-family:ui-sans-serif,system-ui,Segoe UI,Roboto,Arial}
-  .wrap{max-width:760px;margin:28px auto;padding:0 12px}
-  .card{background:var(--card);border:1px solid var(--line);border-radius:16px;box-shadow:0 12px 32px rgba(2,6,23,.06);padding:22px}
-  .check{width:88px;height:88px;border-radius:50%;background:#dcfce7;display:grid;place-items:center;margin:8px auto 12px auto}
-  .check svg{width:42px;height:42px;fill:#16a34a}
-  h1{margin:6px 0 8px 0;text-align:center}
-  .lead{color:var(--muted);text-align:center;max-width:560px;margin:0 auto 14px auto}
-  .kv{border:1px solid var(--line);border-radius:12px;padding:12px;background:#fff;margin:12px 0}
-  .row{display:grid;grid-template-columns:160px 1fr;gap:6px 12px}
-  .k{color:#475569}
-  .pill{display:inline-flex;align-items:center;gap:8px;border:1px solid #bbf7d0;background:#ecfdf5;color:#065f46;border-radius:999px;padding:6px 10px;font-weight:700;font-size:12px}
-  .info{background:#eef2ff;border:1px solid #c7d2fe;border-radius:12px;padding:12px;color:#3730a3;margin-top:10px}
-  .actions{display:flex;gap:10px;justify-content:center;margin-top:14px;flex-wrap:wrap}
-  .btn{appearance:none;border:1px solid #e5e7eb;background:#fff;border-radius:10px;padding:10px 14px;font-weight:700;cursor:pointer;text-decoration:none}
-  .btn.primary{background:#0ea5e9;border-color:#0ea5e9;color:#fff}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <div class="card">
-    <div class="check">
-      <svg viewBox="0 0 24 24"><path d="M9 16.17 4.83 12l-1.42 1.41L9 19 21 7l-1.41-1.41z"/></svg>
-    </div>
-    <h1>Cảm ơn quý khách!</h1>
-    <div class="lead">
-      Chúng tôi đã nhận được thanh toán của bạn. Nhân viên sẽ sớm kiểm tra &amp; xác nhận thông tin.
-      Sản phẩm sẽ được chuẩn bị và giao tới địa chỉ của bạn trong thời gian sớm nhất.
-    </div>
-
-    <div class="kv">
-      <div class="row">
-        <div class="k">Mã đơn hàng</div><div><b>{{ order_id }}</b></div>
-        <div class="k">Mã hợp đồng</div><div><b>{{ sale_code }}</b></div>
-        <div class="k">Số tiền</div><div><b>{{ "{:,.0f}".format(amount).replace(",", ".") }} đ</b></div>
-        <div class="k">Trạng thái</div><div><span class="pill">Thanh toán đã được xác nhận</span></div>
-      </div>
-    </div>
-
-    <div class="info">
-      <b>Thông tin quan trọng</b>
-      <ul style="margin:8px 0 0 18px;padding:0">
-        <li>Đơn hàng của bạn đã được ghi nhận.</li>
-        <li>Chúng tôi sẽ xác minh giao dịch trong 5–10 phút.</li>
-        <li>Bạn sẽ nhận email/SMS khi xác minh hoàn tất.</li>
-        <li>Sản phẩm dự kiến giao trong 3–5 ngày làm việc.</li>
-      </ul>
-    </div>
-
-    <div class="actions">
-      <a class="btn" href="/">Quay về trang chủ</a>
-      {% if inv %}<a class="btn primary" href="/payment/invoice/{{ inv.id }}">Xem hoá đơn</a>{% endif %}
-    </div>
-  </div>
-</div>
-</body>
-</html>
-"""
-    return render_template_string(
-        html,
+    return render_template(
+        "thankyou.html",
         p=p,
         inv=inv,
         sale=sale,
@@ -1992,3 +1582,4 @@ def thankyou_page(payment_id: int):
         sale_code=sale_code,
         amount=amount,
     )
+
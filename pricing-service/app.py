@@ -2,6 +2,7 @@
 from flask import Flask, request, jsonify
 import os, json, re, time, threading, concurrent.futures, hashlib
 from datetime import datetime
+import http_middleware
 
 # ---------- Config ----------
 VERSION = "2025-11-04-pin-hardlock+normalize-robust"
@@ -21,6 +22,8 @@ THIS_YEAR = datetime.now().year
 
 app = Flask(__name__)
 app.config["JSON_AS_ASCII"] = False
+# đăng ký trước CORS để chạy sau cùng (after_request chạy ngược thứ tự) -> Vary không bị ghi đè
+http_middleware.init_app(app)
 
 # --- CORS thuần Flask: luôn chèn header cho 8000 (Django) ---
 from flask import request
@@ -0,0 +1,21 @@
+"""
+Thêm index (seller_id, created_at) và (product_id, created_at) cho bảng reviews đã tồn tại
+(db.create_all() không thêm index vào bảng cũ). Chạy lại nhiều lần không sao.
+
+Chạy: python add_review_indexes.py   (dùng DATABASE_URL giống service)
+"""
+from app import app
+from db import db
+from models import Review
+
+
+def main():
+    with app.app_context():
+        for index in Review.__table__.indexes:
+            if index.name.endswith("_created"):
+                index.create(bind=db.engine, checkfirst=True)
+                print("ok:", index.name)
+
+
+if __name__ == "__main__":
+    main()
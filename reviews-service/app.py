@@ -1,6 +1,11 @@
 from flask import Flask
+from sqlalchemy import event
 from db import db
+from models import RatingStats, Review
+import ratings
+import sellers
 from routes import bp as reviews_bp
+import http_middleware
 import os
 import logging
 
@@ -8,17 +13,53 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def engine_options(database_url: str) -> dict:
+    """Pool cho Postgres; SQLite (chạy local) chỉ chờ khoá thay vì báo lỗi ngay."""
+    if database_url.startswith("sqlite"):
+        return {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        # Kết nối bị Postgres/pgbouncer cắt khi idle sẽ được phát hiện trước khi dùng
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL: trang đánh giá vẫn đọc được trong lúc có request đang ghi review;
+    # busy_timeout: ghi đồng thời thì chờ khoá thay vì "database is locked"
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+
 def create_app():
     app = Flask(__name__)
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///reviews.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
     app.config["JSON_AS_ASCII"] = False
 
     db.init_app(app)
     with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_pragmas)
         db.create_all()
+        # lần đầu chạy với bảng rating_stats mới: dựng lại từ reviews có sẵn
+        if not RatingStats.query.first() and Review.query.first():
+            ratings.rebuild()
+        # product -> seller đã biết từ reviews: trang đánh giá khỏi gọi listing/auth-service
+        sellers.warm_from_reviews()
 
     app.register_blueprint(reviews_bp)
+    http_middleware.init_app(app)
 
     @app.get("/")
     def index():
@@ -5,6 +5,11 @@ from db import db
 
 class Review(db.Model):
     __tablename__ = "reviews"
+    # trang đánh giá lọc theo seller/product rồi sắp xếp mới nhất trước
+    __table_args__ = (
+        db.Index("ix_reviews_seller_created", "seller_id", "created_at"),
+        db.Index("ix_reviews_product_created", "product_id", "created_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, index=True, nullable=False)
@@ -48,3 +53,42 @@ class Reply(db.Model):
 
     def __repr__(self) -> str:  # pragma: no cover
         return f"<Reply id={self.id} review_id={self.review_id} seller_id={self.seller_id}>"
+
+
+class RatingStats(db.Model):
+    """Tổng hợp điểm đánh giá theo người bán / sản phẩm, cập nhật cùng transaction với Review.
+
+    scope = "seller" | "product", subject_id = seller_id / product_id.
+    """
+
+    __tablename__ = "rating_stats"
+
+    scope = db.Column(db.String(16), primary_key=True)
+    subject_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    star_1 = db.Column(db.Integer, nullable=False, default=0)
+    star_2 = db.Column(db.Integer, nullable=False, default=0)
+    star_3 = db.Column(db.Integer, nullable=False, default=0)
+    star_4 = db.Column(db.Integer, nullable=False, default=0)
+    star_5 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        nullable=False,
+    )
+
+    @property
+    def avg(self):
+        return self.rating_sum / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.avg, 2) if self.avg is not None else None,
+            "histogram": {str(i): getattr(self, f"star_{i}") for i in range(1, 6)},
+        }
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<RatingStats {self.scope}:{self.subject_id} count={self.count}>"
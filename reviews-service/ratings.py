@@ -0,0 +1,85 @@
+"""
+Bảng rating_stats: count / tổng điểm / histogram 1–5 sao cho từng người bán và sản phẩm.
+
+create_review gọi record_review() trước commit nên số liệu đổi cùng transaction với Review;
+trang đánh giá và GET /reviews/api/stats chỉ đọc 1 dòng thay vì quét toàn bộ review.
+Dữ liệu lệch (import tay, sửa DB) thì chạy lại: python rebuild_rating_stats.py
+"""
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models import RatingStats, Review
+
+SELLER = "seller"
+PRODUCT = "product"
+
+
+def _bump(scope: str, subject_id: int, rating: int):
+    star = f"star_{rating}"
+    values = {
+        "count": RatingStats.count + 1,
+        "rating_sum": RatingStats.rating_sum + rating,
+        star: getattr(RatingStats, star) + 1,
+    }
+    where = (RatingStats.scope == scope) & (RatingStats.subject_id == subject_id)
+    # UPDATE cộng dồn trong DB -> hai review đồng thời không ghi đè nhau
+    if db.session.query(RatingStats).filter(where).update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(RatingStats(scope=scope, subject_id=subject_id, count=1,
+                                       rating_sum=rating, **{star: 1}))
+    except IntegrityError:
+        # request khác vừa tạo dòng này trước -> cộng dồn vào dòng đó
+        db.session.query(RatingStats).filter(where).update(values, synchronize_session=False)
+
+
+def record_review(review: Review):
+    """Cộng review mới vào thống kê; gọi trước db.session.commit() của review."""
+    _bump(PRODUCT, review.product_id, review.rating)
+    if review.seller_id:
+        _bump(SELLER, review.seller_id, review.rating)
+
+
+def get_stats(scope: str, ids) -> dict:
+    """{id: RatingStats.to_dict()} cho các id có review; id chưa có review không có trong dict."""
+    ids = list(ids)
+    if not ids:
+        return {}
+    rows = RatingStats.query.filter(RatingStats.scope == scope, RatingStats.subject_id.in_(ids)).all()
+    return {row.subject_id: row.to_dict() for row in rows}
+
+
+def empty_stats() -> dict:
+    return {"count": 0, "avg": None, "histogram": {str(i): 0 for i in range(1, 6)}}
+
+
+def summarize(query) -> dict:
+    """Thống kê cho bộ lọc không có sẵn trong rating_stats (vd. seller + product): aggregate trong SQL."""
+    cols = [func.count(Review.id), func.coalesce(func.sum(Review.rating), 0)]
+    cols += [func.coalesce(func.sum(case((Review.rating == i, 1), else_=0)), 0) for i in range(1, 6)]
+    row = query.with_entities(*cols).one()
+    count, total = int(row[0]), int(row[1])
+    return {
+        "count": count,
+        "avg": round(total / count, 2) if count else None,
+        "histogram": {str(i): int(row[i + 1]) for i in range(1, 6)},
+    }
+
+
+def rebuild():
+    """Tính lại toàn bộ rating_stats từ bảng reviews (một transaction)."""
+    RatingStats.query.delete(synchronize_session=False)
+    n = 0
+    for scope, col in ((PRODUCT, Review.product_id), (SELLER, Review.seller_id)):
+        cols = [col, func.count(Review.id), func.sum(Review.rating)]
+        cols += [func.sum(case((Review.rating == i, 1), else_=0)) for i in range(1, 6)]
+        for row in db.session.query(*cols).filter(col.isnot(None)).group_by(col):
+            db.session.add(RatingStats(
+                scope=scope, subject_id=row[0], count=row[1], rating_sum=row[2],
+                **{f"star_{i}": row[i + 2] for i in range(1, 6)},
+            ))
+            n += 1
+    db.session.commit()
+    return n
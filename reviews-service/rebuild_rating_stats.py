@@ -0,0 +1,19 @@
+"""
+Tính lại bảng rating_stats từ toàn bộ reviews (tạo bảng nếu chưa có).
+
+Chạy: python rebuild_rating_stats.py   (dùng DATABASE_URL giống service)
+"""
+from app import app
+from db import db
+import ratings
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        n = ratings.rebuild()
+        print(f"rating_stats: {n} dòng (seller + product)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,82 @@ from typing import Optional
 
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, current_app
 import os
+import threading
+import time
 import requests
 from datetime import datetime
 
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
+
 from db import db
 from models import Review, Reply
+import ratings
+import sellers
+
+STATS_MAX_IDS = int(os.getenv("REVIEWS_STATS_MAX_IDS", "200"))
+STATS_MAX_AGE = int(os.getenv("REVIEWS_STATS_MAX_AGE", "60"))
+REVIEWS_PER_PAGE = int(os.getenv("REVIEWS_PER_PAGE", "20"))
+REVIEWS_MAX_PER_PAGE = 100
 
 bp = Blueprint("reviews", __name__, url_prefix="/reviews", template_folder="templates")
 
 
+def _encode_cursor(r: Review) -> str:
+    return f"{r.created_at.isoformat()}_{r.id}"
+
+
+def _decode_cursor(raw):
+    try:
+        ts, _, rid = raw.rpartition("_")
+        return datetime.fromisoformat(ts), int(rid)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _page_reviews(query, total: Optional[int] = None):
+    """Một trang review mới nhất trước, replies nạp bằng 1 query selectin cho cả trang.
+
+    Query: per_page (<= 100) + page, hoặc cursor (next_cursor của trang trước, keyset
+    trên (created_at, id) — không OFFSET). total truyền vào (từ rating_stats) thì khỏi COUNT.
+    """
+    per_page = max(1, min(request.args.get("per_page", REVIEWS_PER_PAGE, type=int) or REVIEWS_PER_PAGE,
+                          REVIEWS_MAX_PER_PAGE))
+    meta = {"per_page": per_page}
+    cursor = _decode_cursor(request.args.get("cursor"))
+    if cursor is None:
+        page = max(1, request.args.get("page", 1, type=int) or 1)
+        if total is None:
+            total = query.order_by(None).count()
+        meta.update(page=page, total=total, pages=max(1, -(-total // per_page)))
+
+    query = query.options(selectinload(Review.replies)).order_by(Review.created_at.desc(), Review.id.desc())
+    if cursor is not None:
+        at, rid = cursor
+        query = query.filter(or_(Review.created_at < at, and_(Review.created_at == at, Review.id < rid)))
+    else:
+        query = query.offset((meta["page"] - 1) * per_page)
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    meta["next_cursor"] = _encode_cursor(rows[-1]) if has_more else None
+    return rows, meta
+
+
+def _page_links(meta) -> dict:
+    """URL trang trước/sau cho template (giữ nguyên các query param khác)."""
+    links = {"prev_url": None, "next_url": None}
+    page = meta.get("page")
+    if not page:
+        return links
+    args = {k: v for k, v in request.args.items() if k not in ("page", "cursor")}
+    if page > 1:
+        links["prev_url"] = url_for(request.endpoint, **request.view_args, **args, page=page - 1)
+    if meta.get("next_cursor"):
+        links["next_url"] = url_for(request.endpoint, **request.view_args, **args, page=page + 1)
+    return links
+
+
 @bp.get("/")
 def idx():
     """Health-check endpoint for the reviews service."""
@@ -29,42 +96,20 @@ def product_page(product_id: int):
     /reviews/product/<product_id>?seller_id=<seller_id_optional>
     """
     seller_id = request.args.get("seller_id", type=int)
-    # If seller_id not provided, try to resolve seller from listing-service
+    # Không truyền seller_id: tra listing -> người bán (có cache, xem sellers.py)
     if not seller_id:
-        try:
-            LISTING_URL = os.getenv("LISTING_URL", "http://listing_service:5002")
-            lr = requests.get(f"{LISTING_URL}/listings/{int(product_id)}", timeout=4)
-            if lr.ok:
-                listing = lr.json() or {}
-                # listing may contain owner id or owner username
-                owner = listing.get("owner") or listing.get("owner_username") or listing.get("user")
-                if owner:
-                    try:
-                        # if owner is numeric id
-                        owner_int = int(owner)
-                        seller_id = owner_int
-                    except Exception:
-                        # otherwise resolve username -> id via auth service
-                        try:
-                            AUTH_URL = os.getenv("AUTH_URL", "http://auth_service:5001")
-                            aresp = requests.get(f"{AUTH_URL}/auth/users/{owner}", timeout=4)
-                            if aresp.ok:
-                                seller_id = aresp.json().get("id")
-                        except Exception:
-                            seller_id = None
-        except Exception:
-            seller_id = None
+        seller_id = sellers.resolve(product_id)
 
     # If we were able to resolve a seller_id, show all reviews for that seller (aggregate votes/comments)
     if seller_id:
         query = Review.query.filter(Review.seller_id == seller_id)
+        stats = ratings.get_stats(ratings.SELLER, [seller_id]).get(seller_id)
     else:
         query = Review.query.filter(Review.product_id == product_id)
+        stats = ratings.get_stats(ratings.PRODUCT, [product_id]).get(product_id)
+    stats = stats or ratings.empty_stats()
 
-    reviews = query.order_by(Review.created_at.desc()).all()
-    avg: Optional[float] = None
-    if reviews:
-        avg = sum(r.rating for r in reviews) / len(reviews)
+    reviews, page_meta = _page_reviews(query, total=stats["count"])
 
     # Map buyer_id -> buyer info (nếu sau này muốn call user-service thì bổ sung ở đây)
     buyers = {}
@@ -73,8 +118,11 @@ def product_page(product_id: int):
         "product_reviews.html",
         product_id=product_id,
         seller_id=seller_id,
-        avg=avg,
+        avg=stats["avg"],
+        stats=stats,
         reviews=reviews,
+        page_meta=page_meta,
+        **_page_links(page_meta),
         buyers=buyers,
     )
 
@@ -91,10 +139,13 @@ def seller_page(seller_id: int):
     if product_id:
         query = query.filter(Review.product_id == product_id)
 
-    reviews = query.order_by(Review.created_at.desc()).all()
-    avg: Optional[float] = None
-    if reviews:
-        avg = sum(r.rating for r in reviews) / len(reviews)
+    if product_id:
+        # seller + product không có dòng sẵn trong rating_stats -> aggregate trong SQL
+        stats = ratings.summarize(query)
+    else:
+        stats = ratings.get_stats(ratings.SELLER, [seller_id]).get(seller_id) or ratings.empty_stats()
+
+    reviews, page_meta = _page_reviews(query, total=stats["count"])
 
     buyers = {}
 
@@ -102,8 +153,11 @@ def seller_page(seller_id: int):
         "product_reviews.html",
         product_id=product_id,
         seller_id=seller_id,
-        avg=avg,
+        avg=stats["avg"],
+        stats=stats,
         reviews=reviews,
+        page_meta=page_meta,
+        **_page_links(page_meta),
         buyers=buyers,
     )
 
@@ -115,12 +169,13 @@ def seller_page(seller_id: int):
 
 @bp.get("/api/reviews")
 def list_reviews():
-    """API trả về danh sách đánh giá.
+    """API trả về danh sách đánh giá (phân trang, kèm replies).
 
     Hỗ trợ filter theo:
     - product_id
     - seller_id
     - buyer_id
+    Phân trang: page/per_page hoặc cursor (xem _page_reviews).
     """
     product_id = request.args.get("product_id", type=int)
     seller_id = request.args.get("seller_id", type=int)
@@ -134,7 +189,7 @@ def list_reviews():
     if buyer_id is not None:
         query = query.filter(Review.buyer_id == buyer_id)
 
-    reviews = query.order_by(Review.created_at.desc()).all()
+    reviews, meta = _page_reviews(query)
 
     items = []
     for r in reviews:
@@ -148,10 +203,70 @@ def list_reviews():
                 "comment": r.comment,
                 "created_at": (r.created_at.isoformat() if r.created_at else None),
                 "updated_at": (r.updated_at.isoformat() if r.updated_at else None),
+                "replies": [
+                    {
+                        "id": rep.id,
+                        "seller_id": rep.seller_id,
+                        "message": rep.message,
+                        "created_at": (rep.created_at.isoformat() if rep.created_at else None),
+                    }
+                    for rep in r.replies
+                ],
             }
         )
 
-    return jsonify({"items": items, "total": len(items)})
+    return jsonify({"items": items, **meta})
+
+
+def _parse_ids(raw) -> list[int]:
+    ids = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) not in ids:
+            ids.append(int(part))
+    return ids
+
+
+@bp.get("/api/stats")
+def rating_stats():
+    """Điểm trung bình / số đánh giá / histogram theo lô, đọc từ rating_stats.
+
+    GET /reviews/api/stats?seller_ids=1,2,3&product_ids=10,11
+    -> {"sellers": {"1": {count, avg, histogram}, ...}, "products": {...}}
+    Id chưa có đánh giá trả count=0, avg=null.
+    """
+    seller_ids = _parse_ids(request.args.get("seller_ids"))
+    product_ids = _parse_ids(request.args.get("product_ids"))
+    if not seller_ids and not product_ids:
+        return jsonify({"detail": "seller_ids or product_ids is required"}), 400
+    if len(seller_ids) + len(product_ids) > STATS_MAX_IDS:
+        return jsonify({"detail": f"at most {STATS_MAX_IDS} ids per request"}), 400
+
+    out = {}
+    for key, scope, ids in (("sellers", ratings.SELLER, seller_ids), ("products", ratings.PRODUCT, product_ids)):
+        if ids:
+            found = ratings.get_stats(scope, ids)
+            out[key] = {str(i): found.get(i) or ratings.empty_stats() for i in ids}
+
+    resp = jsonify(out)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = STATS_MAX_AGE
+    return resp
+
+
+@bp.get("/api/seller-cache")
+def seller_cache_stats():
+    """Số liệu cache product -> seller của worker này (hits, misses, hit_rate, size...)."""
+    return jsonify(sellers.stats())
+
+
+# Cache các lần kiểm tra "đã mua" thành công: (buyer_id, product_id, seller_id) -> hết hạn.
+# Payment đã PAID chỉ đổi khi hoàn tiền nên giữ lâu; kết quả "chưa mua" không cache
+# để người vừa được admin duyệt có thể đánh giá ngay.
+PURCHASE_CACHE_TTL = int(os.getenv("PURCHASE_CACHE_TTL", "86400"))
+PURCHASE_CACHE_MAX = int(os.getenv("PURCHASE_CACHE_MAX", "10000"))
+_purchase_cache: dict = {}
+_purchase_lock = threading.Lock()
 
 
 def _check_user_has_paid(buyer_id: int, product_id: int, seller_id: Optional[int]) -> bool:
@@ -159,17 +274,24 @@ def _check_user_has_paid(buyer_id: int, product_id: int, seller_id: Optional[int
     cho sản phẩm này chưa.
 
     Logic:
-      - Gửi GET tới PAYMENT_BASE_URL + /payment
-      - Query params: buyer_id, status=paid, optional seller_id
-      - Trong response, duyệt các items xem có item nào trùng product_id
+      - Kết quả dương đã cache -> trả luôn
+      - GET PAYMENT_BASE_URL + /payment/purchased?buyer_id=&item_id=[&seller_id=]
+        (payment-service tra index payment_items, không giới hạn số payment)
     """
+    key = (buyer_id, product_id, seller_id)
+    now = time.monotonic()
+    with _purchase_lock:
+        expires = _purchase_cache.get(key)
+    if expires and expires > now:
+        return True
+
     base_url = os.getenv("PAYMENT_BASE_URL") or os.getenv("PAYMENT_URL") or "http://payment_service:5003"
 
     try:
-        params: dict[str, str] = {"buyer_id": str(buyer_id), "status": "paid"}
+        params: dict[str, str] = {"buyer_id": str(buyer_id), "item_id": str(product_id)}
         if seller_id:
             params["seller_id"] = str(seller_id)
-        resp = requests.get(f"{base_url.rstrip('/')}/payment", params=params, timeout=5)
+        resp = requests.get(f"{base_url.rstrip('/')}/payment/purchased", params=params, timeout=5)
     except Exception as exc:  # noqa: BLE001
         current_app.logger.error(f"Error calling payment service: {exc}")
         # Có thể chọn fail-open (cho phép) hoặc fail-closed (không cho).
@@ -183,24 +305,18 @@ def _check_user_has_paid(buyer_id: int, product_id: int, seller_id: Optional[int
         return False
 
     try:
-        data = resp.json()
+        purchased = bool(resp.json().get("purchased"))
     except Exception as exc:  # noqa: BLE001
         current_app.logger.error(f"Cannot decode payment JSON: {exc}")
         return False
 
-    items = data.get("items") or []
-    for p in items:
-        its = p.get("items") or []
-        for it in its:
-            candidate = (
-                it.get("item_id", None)
-                if "item_id" in it
-                else it.get("id", None) or it.get("itemId", None)
-            )
-            if candidate is not None and str(candidate) == str(product_id):
-                return True
-
-    return False
+    if purchased:
+        with _purchase_lock:
+            if len(_purchase_cache) >= PURCHASE_CACHE_MAX:
+                for k in [k for k, exp in _purchase_cache.items() if exp <= now] or [next(iter(_purchase_cache))]:
+                    _purchase_cache.pop(k, None)
+            _purchase_cache[key] = now + PURCHASE_CACHE_TTL
+    return purchased
 
 
 @bp.post("/api/reviews")
@@ -262,20 +378,7 @@ def create_review():
             return jsonify({"detail": "seller_id must be an integer"}), 400
     else:
         # Try to resolve seller_id via listing service when not provided
-        try:
-            LISTING_URL = os.getenv("LISTING_URL", "http://listing_service:5002")
-            lresp = requests.get(f"{LISTING_URL}/listings/{int(product_id)}", timeout=4)
-            if lresp.ok:
-                listing = lresp.json() or {}
-                owner = listing.get("owner") or listing.get("owner_username") or listing.get("user")
-                if owner:
-                    # resolve username -> id
-                    AUTH_URL = os.getenv("AUTH_URL", "http://auth_service:5001")
-                    aresp = requests.get(f"{AUTH_URL}/auth/users/{owner}", timeout=4)
-                    if aresp.ok:
-                        seller_id = aresp.json().get("id")
-        except Exception:
-            seller_id = None
+        seller_id = sellers.resolve(product_id)
 
     try:
         rating = int(rating)
@@ -335,6 +438,8 @@ def create_review():
 
     try:
         db.session.add(review)
+        db.session.flush()
+        ratings.record_review(review)
         db.session.commit()
     except Exception as exc:  # noqa: BLE001
         db.session.rollback()
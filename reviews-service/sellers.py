@@ -0,0 +1,139 @@
+"""
+Cache product_id -> seller_id cho reviews-service (TTL + LRU, trong tiến trình).
+
+Trước đây mỗi request trang đánh giá / tạo review đều gọi listing-service rồi
+auth-service (owner username -> id). Chủ của một listing gần như không đổi nên:
+  - hit: không gọi service nào
+  - miss: GET /listings/<id>, dùng owner_id có sẵn trong JSON; chỉ khi thiếu mới
+    tra username qua auth-service
+  - listing 404: cache âm SELLER_CACHE_NEGATIVE_TTL giây
+  - lỗi mạng / 5xx: không cache, lần sau thử lại
+Lúc khởi động nạp sẵn hàng loạt từ bảng reviews (một GROUP BY) bằng warm_from_reviews().
+
+Env: SELLER_CACHE_TTL (giây, mặc định 6h), SELLER_CACHE_NEGATIVE_TTL (300),
+SELLER_CACHE_MAX (số product giữ tối đa, 20000).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import requests
+from flask import current_app
+from sqlalchemy import func
+
+from db import db
+from models import Review
+
+SELLER_CACHE_TTL = int(os.getenv("SELLER_CACHE_TTL", str(6 * 3600)))
+SELLER_CACHE_NEGATIVE_TTL = int(os.getenv("SELLER_CACHE_NEGATIVE_TTL", "300"))
+SELLER_CACHE_MAX = int(os.getenv("SELLER_CACHE_MAX", "20000"))
+
+_MISSING = object()
+_cache: "OrderedDict[int, tuple[float, Optional[int]]]" = OrderedDict()
+_lock = threading.Lock()
+_counters = {"hits": 0, "negative_hits": 0, "misses": 0, "errors": 0, "warmed": 0}
+
+
+def _get(product_id: int):
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(product_id)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _cache[product_id]
+            _counters["misses"] += 1
+            return _MISSING
+        _cache.move_to_end(product_id)
+        _counters["hits" if entry[1] is not None else "negative_hits"] += 1
+        return entry[1]
+
+
+def remember(product_id: int, seller_id: Optional[int], ttl: Optional[int] = None):
+    """Ghi product_id -> seller_id (None = listing không tồn tại)."""
+    if ttl is None:
+        ttl = SELLER_CACHE_TTL if seller_id is not None else SELLER_CACHE_NEGATIVE_TTL
+    with _lock:
+        _cache[product_id] = (time.monotonic() + ttl, seller_id)
+        _cache.move_to_end(product_id)
+        while len(_cache) > SELLER_CACHE_MAX:
+            _cache.popitem(last=False)
+
+
+def _fetch(product_id: int):
+    """Gọi listing-service (+ auth-service nếu cần). Trả về seller_id, None (404) hoặc _MISSING (lỗi)."""
+    listing_url = os.getenv("LISTING_URL", "http://listing_service:5002")
+    try:
+        lr = requests.get(f"{listing_url}/listings/{int(product_id)}", timeout=4)
+        if lr.status_code == 404:
+            return None
+        if not lr.ok:
+            return _MISSING
+        listing = lr.json() or {}
+        if listing.get("owner_id"):
+            return int(listing["owner_id"])
+        owner = listing.get("owner") or listing.get("owner_username") or listing.get("user")
+        if not owner:
+            return None
+        try:
+            # owner đôi khi đã là id dạng số
+            return int(owner)
+        except (TypeError, ValueError):
+            pass
+        auth_url = os.getenv("AUTH_URL", "http://auth_service:5001")
+        ar = requests.get(f"{auth_url}/auth/users/{owner}", timeout=4)
+        if ar.status_code == 404:
+            return None
+        if not ar.ok:
+            return _MISSING
+        seller_id = ar.json().get("id")
+        return int(seller_id) if seller_id else None
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.warning("Cannot resolve seller for product %s: %s", product_id, exc)
+        return _MISSING
+
+
+def resolve(product_id: int) -> Optional[int]:
+    """seller_id của listing; None nếu listing không tồn tại hoặc service lỗi."""
+    seller_id = _get(product_id)
+    if seller_id is not _MISSING:
+        return seller_id
+    seller_id = _fetch(product_id)
+    if seller_id is _MISSING:
+        with _lock:
+            _counters["errors"] += 1
+        return None
+    remember(product_id, seller_id)
+    return seller_id
+
+
+def warm_from_reviews(limit: int = SELLER_CACHE_MAX) -> int:
+    """Nạp hàng loạt product -> seller đã biết từ bảng reviews (review mới nhất trước)."""
+    rows = (
+        db.session.query(Review.product_id, func.max(Review.seller_id))
+        .filter(Review.seller_id.isnot(None))
+        .group_by(Review.product_id)
+        .order_by(func.max(Review.created_at).desc())
+        .limit(limit)
+        .all()
+    )
+    # thêm cũ -> mới để product mới nhất nằm cuối LRU
+    for product_id, seller_id in reversed(rows):
+        remember(product_id, seller_id)
+    with _lock:
+        _counters["warmed"] += len(rows)
+    return len(rows)
+
+
+def stats() -> dict:
+    with _lock:
+        c = dict(_counters)
+        size = len(_cache)
+    lookups = c["hits"] + c["negative_hits"] + c["misses"]
+    c.update(
+        size=size,
+        max_size=SELLER_CACHE_MAX,
+        hit_rate=round((c["hits"] + c["negative_hits"]) / lookups, 4) if lookups else None,
+    )
+    return c
@@ -1,6 +1,7 @@
 from flask import Flask, jsonify
 from models import db
 from routes import bp
+import http_middleware
 import os
 
 def create_app():
@@ -9,6 +10,7 @@ def create_app():
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.init_app(app)
     app.register_blueprint(bp)
+    http_middleware.init_app(app)
 
     @app.get("/")
     def root():
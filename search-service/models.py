@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from enum import Enum
+from sqlalchemy import Column, Integer, MetaData, String, Table
 from sqlalchemy import Enum as SAEnum
 
 db = SQLAlchemy()
@@ -45,3 +46,14 @@ class Product(db.Model):
     status           = db.Column(SAEnum(ProductStatus), default=ProductStatus.pending, nullable=False)
     verified         = db.Column(db.Boolean, default=False)
     moderation_notes = db.Column(db.Text)
+
+
+# Bảng favorite_counts do favorites-service duy trì (cùng Postgres), chỉ đọc cho sort=popular.
+# MetaData riêng để không lẫn vào db.metadata của service này.
+favorites_metadata = MetaData()
+favorite_counts = Table(
+    "favorite_counts", favorites_metadata,
+    Column("item_id", Integer, primary_key=True),
+    Column("item_type", String(20), primary_key=True),
+    Column("count", Integer, nullable=False),
+)
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
-from models import db, Product
+from models import db, Product, favorite_counts
 import json
-from sqlalchemy import cast, Float
+from sqlalchemy import and_, cast, Float, func, inspect, select, String
+import re
 
 bp = Blueprint("search", __name__, url_prefix="/search")
 
@@ -30,7 +31,57 @@ def parse_float(v, default=None, minv=None, maxv=None):
     except:
         return default
 
-def to_json(p: Product):
+STATIC_UPLOAD_PREFIX = "/static/uploads/"
+# Ảnh upload qua pipeline của gateway: <prefix>_<sha16>.jpg + <base>_card.webp / <base>_detail.webp
+_PROCESSED_IMG = re.compile(r"^(.*_[0-9a-f]{16})\.jpg$")
+
+
+def _img_url(url):
+    if not url:
+        return None
+    url = url.strip()
+    if url.lower().startswith(("http://", "https://", "/")):
+        return url
+    return STATIC_UPLOAD_PREFIX + url
+
+
+def _img_variant(url, variant):
+    """URL biến thể WebP (card/detail); ảnh cũ không có biến thể => trả lại URL gốc."""
+    m = _PROCESSED_IMG.match(url or "")
+    return f"{m.group(1)}_{variant}.webp" if m else url
+
+
+_favorite_counts_table = None
+
+
+def _has_favorite_counts() -> bool:
+    """favorite_counts có trong cùng DB không (compose: Postgres dùng chung; dev SQLite: không).
+
+    Chỉ nhớ kết quả True: favorites-service có thể tạo bảng sau khi service này khởi động.
+    """
+    global _favorite_counts_table
+    if not _favorite_counts_table:
+        _favorite_counts_table = inspect(db.engine).has_table("favorite_counts")
+    return _favorite_counts_table
+
+
+def _page_favorite_counts(products):
+    """Lượt thích cho các listing của trang hiện tại (1 query IN trên favorite_counts, khớp cả item_type)."""
+    if not products or not _has_favorite_counts():
+        return None
+    rows = db.session.execute(
+        select(favorite_counts.c.item_id, favorite_counts.c.item_type, favorite_counts.c.count)
+        .where(favorite_counts.c.item_id.in_([p.id for p in products]))
+    ).all()
+    by_key = {(item_id, item_type): int(n or 0) for item_id, item_type, n in rows}
+    return {
+        p.id: by_key[(p.id, p.item_type.value)]
+        for p in products
+        if (p.id, p.item_type.value) in by_key
+    }
+
+
+def to_json(p: Product, fav_counts: dict = None):
     # Chuyển Enum sang string nếu cần
     item_type_val = p.item_type.value if hasattr(p.item_type, 'value') else str(p.item_type)
     status_val = p.status.value if hasattr(p, 'status') and hasattr(p.status, 'value') else getattr(p, 'status', 'pending')
@@ -50,6 +101,8 @@ def to_json(p: Product):
         "owner": p.owner,
         "main_image_url": p.main_image_url,
         "sub_image_urls": json.loads(p.sub_image_urls or "[]"),
+        "main_image_card_url": _img_variant(_img_url(p.main_image_url), "card"),
+        "main_image_detail_url": _img_variant(_img_url(p.main_image_url), "detail"),
         "approved": p.approved,
         "status": status_val,
         "verified": getattr(p, 'verified', False),
@@ -57,6 +110,8 @@ def to_json(p: Product):
         "approved_by": p.approved_by,
         "created_at": p.created_at.isoformat(),
         "updated_at": p.updated_at.isoformat() if p.updated_at else None,
+        # None khi không đọc được favorite_counts (DB riêng lúc chạy dev)
+        "favorite_count": fav_counts.get(p.id, 0) if fav_counts is not None else None,
     }
 
 
@@ -159,6 +214,13 @@ def do_search(args):
         q = q.order_by(Product.price.asc())
     elif sort == "price_desc":
         q = q.order_by(Product.price.desc())
+    elif sort == "popular" and _has_favorite_counts():
+        # Được thích nhiều nhất: join thẳng favorite_counts theo (item_id, item_type),
+        # không COUNT(*) trên favorites và không aggregate cả bảng counts
+        fc = favorite_counts
+        q = q.outerjoin(
+            fc, and_(fc.c.item_id == Product.id, fc.c.item_type == cast(Product.item_type, String))
+        ).order_by(func.coalesce(fc.c.count, 0).desc(), Product.created_at.desc())
     else:
         q = q.order_by(Product.created_at.desc())
 
@@ -166,9 +228,10 @@ def do_search(args):
     page = parse_int(args.get("page"), 1, 1)
     per_page = parse_int(args.get("per_page"), 12, 1, 50)
     page_obj = q.paginate(page=page, per_page=per_page, error_out=False)
+    fav_counts = _page_favorite_counts(page_obj.items)
 
     return jsonify({
-        "items": [to_json(p) for p in page_obj.items],
+        "items": [to_json(p, fav_counts) for p in page_obj.items],
         "page": page_obj.page,
         "per_page": page_obj.per_page,
         "total": page_obj.total,